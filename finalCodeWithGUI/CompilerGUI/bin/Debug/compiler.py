@@ -3,13 +3,75 @@
 #  LEXER                                                                      #
 #                                                                             #
 ###############################################################################
+import asyncio
+import fnmatch
+import glob
+import hashlib
+import heapq
+import io
+import json
+import marshal
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from bisect import bisect_left
 from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from enum import IntEnum
+from functools import partial
+from itertools import count
+from operator import add, eq, ge, gt, itemgetter, le, lshift, lt, mul, ne, or_, sub
+from types import GeneratorType
+
+
+class CompilationContext(object):
+    """The state of one compilation, handed to its lexer, parser, semantic
+    analyzer and interpreter.
+
+    It holds the files the warnings, errors and symbol table rows go to,
+    in memory unless given, `output` for what the stages print, stdout
+    unless given, and the numbering of the registers and labels. Nothing
+    is shared between contexts, so compilations can run one after another
+    or in threads of one process, each numbering from the start.
+    """
+
+    def __init__(self, warn_file=None, error_file=None, symtable_file=None, output=None):
+        self.warn_file = io.StringIO() if warn_file is None else warn_file
+        self.error_file = io.StringIO() if error_file is None else error_file
+        self.symtable_file = io.StringIO() if symtable_file is None else symtable_file
+        self.output = sys.stdout if output is None else output
+        self.register_id = 0
+        self.label_id = 1
+
+    def new_register(self):
+        """Return the operand of a register not used before."""
+        register = self.register_id << OPERAND_KIND_BITS | O_TEMP
+        self.register_id += 1
+        return register
+
+    def new_label(self):
+        """Return the operand of a label not used before."""
+        label = self.label_id << OPERAND_KIND_BITS | O_LABEL
+        self.label_id += 1
+        return label
+
+    def new_labels(self, size):
+        """Return the operands of `size` labels not used before, numbered in order."""
+        labels = [label << OPERAND_KIND_BITS | O_LABEL for label in range(self.label_id, self.label_id + size)]
+        self.label_id += size
+        return labels
 
-register_id = 0
-label_id = 1
-line_no = 1
-out_file = None
-newLine_pos = None
 
 # Token types
 #
@@ -54,25 +116,140 @@ ID = 'ID'
 EOF = 'EOF'
 
 
-def locations_of_substring(string, substring):
-    """Return a list of locations of a substring."""
-
-    substring_length = len(substring)
-
-    def recurse(locations_found, start):
-        location = string.find(substring, start)
-        if location != -1:
-            return recurse(locations_found + [location], location + substring_length)
-        else:
-            return locations_found
-
-    return recurse([], 0)
+# Integer token kinds, used by TokenBuffer and the parser. Each kind is named
+# after the string token type above, which stays the `type` of a Token.
+class TokenKind(IntEnum):
+    EOF = 0
+    INTEGER_TYPE = 1
+    INTEGER_VALUE = 2
+    CONSTANT = 3
+    IF = 4
+    ELSE = 5
+    FOR = 6
+    WHILE = 7
+    DO = 8
+    SWITCH = 9
+    CASE = 10
+    BREAK = 11
+    DEFAULT = 12
+    TRUE = 13
+    FALSE = 14
+    AND = 15
+    OR = 16
+    NOT = 17
+    EQUAL = 18
+    NOT_EQUAL = 19
+    LESS_EQUAL = 20
+    GREATER_EQUAL = 21
+    LESS = 22
+    GREATER = 23
+    COLON = 24
+    COMMA = 25
+    ASSIGN = 26
+    SEMI_COLON = 27
+    L_PAREN = 28
+    R_PAREN = 29
+    L_BRACE = 30
+    R_BRACE = 31
+    PLUS = 32
+    MINUS = 33
+    MULTIPLY = 34
+    DIVIDE = 35
+    ID = 36
+    ERROR = 37  # lexical error, only ever the last entry of a TokenBuffer
+
+
+KIND_NAMES = tuple(kind.name for kind in TokenKind)
+
+# Plain int copies of the kinds for the parser's hot paths: looking a member
+# up on the IntEnum class costs several times as much as a global.
+K_EOF = int(TokenKind.EOF)
+K_INTEGER_TYPE = int(TokenKind.INTEGER_TYPE)
+K_INTEGER_VALUE = int(TokenKind.INTEGER_VALUE)
+K_CONSTANT = int(TokenKind.CONSTANT)
+K_IF = int(TokenKind.IF)
+K_ELSE = int(TokenKind.ELSE)
+K_FOR = int(TokenKind.FOR)
+K_WHILE = int(TokenKind.WHILE)
+K_DO = int(TokenKind.DO)
+K_SWITCH = int(TokenKind.SWITCH)
+K_CASE = int(TokenKind.CASE)
+K_BREAK = int(TokenKind.BREAK)
+K_DEFAULT = int(TokenKind.DEFAULT)
+K_TRUE = int(TokenKind.TRUE)
+K_FALSE = int(TokenKind.FALSE)
+K_AND = int(TokenKind.AND)
+K_OR = int(TokenKind.OR)
+K_NOT = int(TokenKind.NOT)
+K_EQUAL = int(TokenKind.EQUAL)
+K_NOT_EQUAL = int(TokenKind.NOT_EQUAL)
+K_LESS_EQUAL = int(TokenKind.LESS_EQUAL)
+K_GREATER_EQUAL = int(TokenKind.GREATER_EQUAL)
+K_LESS = int(TokenKind.LESS)
+K_GREATER = int(TokenKind.GREATER)
+K_COLON = int(TokenKind.COLON)
+K_COMMA = int(TokenKind.COMMA)
+K_ASSIGN = int(TokenKind.ASSIGN)
+K_SEMI_COLON = int(TokenKind.SEMI_COLON)
+K_L_PAREN = int(TokenKind.L_PAREN)
+K_R_PAREN = int(TokenKind.R_PAREN)
+K_L_BRACE = int(TokenKind.L_BRACE)
+K_R_BRACE = int(TokenKind.R_BRACE)
+K_PLUS = int(TokenKind.PLUS)
+K_MINUS = int(TokenKind.MINUS)
+K_MULTIPLY = int(TokenKind.MULTIPLY)
+K_DIVIDE = int(TokenKind.DIVIDE)
+K_ID = int(TokenKind.ID)
+K_ERROR = int(TokenKind.ERROR)
+
+
+class LineIndex(object):
+    """Maps source offsets to 1-based (line, column) positions.
+
+    The offsets of all newlines are collected in one linear pass into a
+    compact array('q'); a lookup is a binary search over it.
+    """
+
+    def __init__(self, text):
+        self.newlines = newlines = array('q')
+        find = text.find
+        pos = find('\n')
+        while pos != -1:
+            newlines.append(pos)
+            pos = find('\n', pos + 1)
+
+    def line(self, offset):
+        return bisect_left(self.newlines, offset) + 1
+
+    def position(self, offset):
+        """Return the (line, column) of the character at `offset`."""
+        index = bisect_left(self.newlines, offset)
+        if index:
+            return index + 1, offset - self.newlines[index - 1]
+        return 1, offset + 1
 
 
 class Token(object):
-    def __init__(self, type, value):
+    __slots__ = ('type', 'value', 'pos', 'lines')
+
+    def __init__(self, type, value, pos=None, lines=None):
         self.type = type
         self.value = value
+        # start offset of the token and the LineIndex of its source
+        self.pos = pos
+        self.lines = lines
+
+    @property
+    def line(self):
+        if self.lines is None:
+            return None
+        return self.lines.line(self.pos)
+
+    @property
+    def column(self):
+        if self.lines is None:
+            return None
+        return self.lines.position(self.pos)[1]
 
     def __str__(self):
         return 'Token({type}, {value})'.format(
@@ -84,6 +261,114 @@ class Token(object):
         return self.__str__()
 
 
+def format_position(token):
+    """Describe where `token` starts, for diagnostics."""
+    if token is None or token.line is None:
+        return 'unknown position'
+    return 'line: {}, column: {}'.format(token.line, token.column)
+
+
+class LexicalError(Exception):
+    """Raised by the lexers for a character that cannot start a token."""
+
+    def __init__(self, message, pos):
+        super(LexicalError, self).__init__(message)
+        self.pos = pos
+
+
+class TokenBuffer(object):
+    """The token stream of a whole source, held in parallel typed arrays.
+
+    Token `i` has kind `kinds[i]` and spans `text[starts[i]:ends[i]]`.
+    Identifier names and integer literals are interned into `values` and
+    referenced through `value_ids[i]`; the value of every other kind is
+    fixed by the kind and its id is -1. Token objects are only built on
+    demand by `token()`.
+    """
+
+    def __init__(self, text, lines):
+        self.text = text
+        self.lines = lines
+        self.kinds = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.value_ids = array('l')
+        self.values = []
+        self.value_index = {}
+        # LexicalError behind the trailing ERROR entry, if scanning failed
+        self.error = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, value):
+        value_id = self.value_index.get(value)
+        if value_id is None:
+            value_id = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def append(self, kind, start, end, value=None):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.value_ids.append(-1 if value is None else self.intern(value))
+
+    def fail(self, error):
+        """Terminate the stream with an ERROR entry for `error`."""
+        self.error = error
+        self.append(K_ERROR, error.pos, error.pos)
+
+    def token(self, index):
+        kind = self.kinds[index]
+        value_id = self.value_ids[index]
+        value = self.values[value_id] if value_id >= 0 else FIXED_VALUES[kind]
+        return Token(KIND_NAMES[kind], value, self.starts[index], self.lines)
+
+
+class SourcePosition(object):
+    """Stands in for the LineIndex of a single token whose source is gone."""
+    __slots__ = ('line_no', 'column')
+
+    def __init__(self, line_no, column):
+        self.line_no = line_no
+        self.column = column
+
+    def line(self, offset):
+        return self.line_no
+
+    def position(self, offset):
+        return self.line_no, self.column
+
+
+class StreamTokenBuffer(TokenBuffer):
+    """One window of the token stream produced by StreamLexer.
+
+    The source text is not kept around, so the line and column of every
+    token are stored next to it; `starts` and `ends` are byte offsets into
+    the source file.
+    """
+
+    def __init__(self):
+        super(StreamTokenBuffer, self).__init__(None, None)
+        self.line_nos = array('q')
+        self.columns = array('q')
+
+    def add(self, kind, start, end, value, line, column):
+        self.append(kind, start, end, value)
+        self.line_nos.append(line)
+        self.columns.append(column)
+
+    def fail(self, error, line, column):
+        self.error = error
+        self.add(K_ERROR, error.pos, error.pos, None, line, column)
+
+    def token(self, index):
+        token = super(StreamTokenBuffer, self).token(index)
+        token.lines = SourcePosition(self.line_nos[index], self.columns[index])
+        return token
+
+
 RESERVED_KEYWORDS = {
     'int': Token(INTEGER_TYPE, INTEGER_TYPE),
     'const': Token(CONSTANT, CONSTANT),
@@ -103,25 +388,28 @@ RESERVED_KEYWORDS = {
     'not': Token(NOT, NOT)
 }
 
+KEYWORD_KINDS = dict((word, TokenKind[token.type]) for word, token in RESERVED_KEYWORDS.items())
+
 
 class Lexer(object):
-    def __init__(self, text, warn_file, error_file):
+    def __init__(self, text, context):
         self.text = text
         self.pos = 0
         self.current_char = self.text[self.pos]
-        self.error_file = error_file
-        self.warn_file = warn_file
+        self.context = context
+        self.lines = LineIndex(text)
+        self.token_start = 0
 
     def error(self):
-        self.error_file.write('Lexical Error: Invalid character at line: ' + str(line_no) + '\n')
-        raise Exception('Lexical Error: Invalid character at line: ' + str(line_no))
+        raise LexicalError('Lexical Error: Invalid character at ' + format_position(self.token_at(self.pos)),
+                           self.pos)
+
+    def token_at(self, offset, type=None, value=None):
+        """Build a token starting at `offset`, positioned through the line index."""
+        return Token(type, value, offset, self.lines)
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
-        global line_no
-        if len(newLine_pos) > 0 and self.pos > newLine_pos[0]:
-            line_no = line_no + 1
-            del newLine_pos[0]
         self.pos += 1
         if self.pos > len(self.text) - 1:
             self.current_char = None  # Indicates end of input
@@ -166,11 +454,43 @@ class Lexer(object):
         return token
 
     def get_next_token(self):
+        """Return the next token, stamped with its position in the source."""
+        token = self._next_token()
+        return self.token_at(self.token_start, token.type, token.value)
+
+    def tokenize(self, tokens=None, pos=0, stop=None):
+        """Collect the whole token stream into a TokenBuffer.
+
+        Given `tokens`, the scan appends to them from offset `pos`, which
+        ends a token; given `stop`, it returns without an EOF once a token
+        ends at or after `stop`, leaving `pos` there.
+        """
+        if tokens is None:
+            tokens = TokenBuffer(self.text, self.lines)
+        if pos:
+            self.pos = pos
+            self.current_char = self.text[pos] if pos < len(self.text) else None
+        if stop is None:
+            stop = len(self.text) + 1
+        try:
+            while self.pos < stop:
+                token = self.get_next_token()
+                kind = TokenKind[token.type]
+                value = token.value if kind in (K_ID, K_INTEGER_VALUE) else None
+                tokens.append(kind, token.pos, self.pos, value)
+                if kind == K_EOF:
+                    return tokens
+        except LexicalError as error:
+            tokens.fail(error)
+        return tokens
+
+    def _next_token(self):
         """Lexical analyzer (also known as scanner or tokenizer)
         This method is responsible for breaking a sentence
         apart into tokens. One token at a time.
         """
         while self.current_char is not None:
+            self.token_start = self.pos
 
             if self.current_char.isspace():
                 self.skip_whitespace()
@@ -264,155 +584,933 @@ class Lexer(object):
 
             self.error()
 
+        self.token_start = self.pos
         return Token(EOF, None)
 
 
+OPERATORS = {
+    '==': EQUAL,
+    '!=': NOT_EQUAL,
+    '<=': LESS_EQUAL,
+    '>=': GREATER_EQUAL,
+    '<': LESS,
+    '>': GREATER,
+    ':': COLON,
+    ',': COMMA,
+    '=': ASSIGN,
+    ';': SEMI_COLON,
+    '(': L_PAREN,
+    ')': R_PAREN,
+    '{': L_BRACE,
+    '}': R_BRACE,
+    '+': PLUS,
+    '-': MINUS,
+    '*': MULTIPLY,
+    '/': DIVIDE
+}
+
+# value of every kind that has no interned value: the keywords' own type
+# name, the operators' text and None for EOF
+FIXED_VALUES = [None] * len(TokenKind)
+for _token in RESERVED_KEYWORDS.values():
+    FIXED_VALUES[TokenKind[_token.type]] = _token.value
+for _text, _type in OPERATORS.items():
+    FIXED_VALUES[TokenKind[_type]] = _text
+FIXED_VALUES = tuple(FIXED_VALUES)
+
+# Master pattern used by FastLexer. A single match skips any whitespace and
+# complete #...# comments in front of a token and then classifies the token;
+# every operator has a group of its own so `lastindex` is enough to tell
+# its kind. The pattern only ever matches ASCII: a non-ASCII character (or
+# an unterminated comment) makes the match fail, and FastLexer falls back to
+# the same str predicates the legacy Lexer uses so both engines agree on
+# unicode input.
+_SKIP = r'(?:[\t-\r\x1c-\x1f ]|\#[^#]*\#)*'  # ASCII isspace set and comments
+_TOKEN = (
+    r'(?:([A-Za-z][A-Za-z0-9]*)'  # 1: identifier or keyword
+    r'|([0-9]+)'                  # 2: integer literal
+    r'|(\Z)' +                    # 3: end of input
+    ''.join('|(' + re.escape(text) + ')' for text in OPERATORS) +  # 4...: operators
+    r')')
+_TOKEN_PATTERN = re.compile(_SKIP + _TOKEN)
+_SKIP_PATTERN = re.compile(_SKIP)
+
+# The same patterns over bytes, for StreamLexer. Comments holding non-ASCII
+# text are left to its slow path, which keeps the columns of multi-byte
+# characters right.
+_BYTE_SKIP = rb'(?:[\t-\r\x1c-\x1f ]|\#[^#\x80-\xff]*\#)*'
+_BYTE_TOKEN_PATTERN = re.compile(_BYTE_SKIP + _TOKEN.encode('ascii'))
+_BYTE_SKIP_PATTERN = re.compile(_BYTE_SKIP)
+
+_ID_GROUP, _INT_GROUP, _EOF_GROUP = 1, 2, 3
+_GROUP_KINDS = (None, K_ID, K_INTEGER_VALUE, K_EOF) + tuple(TokenKind[type] for type in OPERATORS.values())
+
+
+class FastLexer(object):
+    """Table-driven replacement for Lexer.
+
+    Produces exactly the same token stream as Lexer, but consumes a whole
+    token per step: one `_TOKEN_PATTERN.match` skips the whitespace and
+    comments in front of the token, classifies it and finds its end.
+    `tokenize` writes straight into a TokenBuffer without building Token
+    objects. The legacy Lexer is still available through `--lexer legacy`
+    for comparison.
+    """
+
+    def __init__(self, text, context):
+        self.text = text
+        self.pos = 0
+        self.context = context
+        self.lines = LineIndex(text)
+        self._tokens = None
+        self._index = 0
+
+    def error(self):
+        raise LexicalError('Lexical Error: Invalid character at ' + format_position(self.token_at(self.pos)),
+                           self.pos)
+
+    def token_at(self, offset, type=None, value=None):
+        """Build a token starting at `offset`, positioned through the line index."""
+        return Token(type, value, offset, self.lines)
+
+    def get_next_token(self):
+        if self._tokens is None:
+            self._tokens = self.tokenize()
+        tokens = self._tokens
+        index = self._index
+        if tokens.kinds[index] == K_ERROR:
+            raise tokens.error
+        if tokens.kinds[index] != K_EOF:
+            self._index = index + 1
+        return tokens.token(index)
+
+    def tokenize(self, tokens=None, pos=0, stop=None):
+        """Scan the whole source into a TokenBuffer in one pass.
+
+        Given `tokens`, the scan appends to them from offset `pos`, which
+        ends a token; given `stop`, it returns without an EOF once a token
+        ends at or after `stop`, leaving `pos` there.
+        """
+        text = self.text
+        if tokens is None:
+            tokens = TokenBuffer(text, self.lines)
+        if stop is None:
+            stop = len(text) + 1
+        append_kind = tokens.kinds.append
+        append_start = tokens.starts.append
+        append_end = tokens.ends.append
+        append_value_id = tokens.value_ids.append
+        intern = tokens.intern
+        value_index = tokens.value_index
+        match = _TOKEN_PATTERN.match
+        group_kinds = _GROUP_KINDS
+        keyword_kinds = KEYWORD_KINDS
+
+        while pos < stop:
+            m = match(text, pos)
+            if m is None:
+                # non-ASCII character or unterminated comment
+                try:
+                    token = self._slow_token(pos)
+                except LexicalError as error:
+                    tokens.fail(error)
+                    return tokens
+                pos = self.pos
+                if token is not None:
+                    tokens.append(*token)
+                continue
+
+            group = m.lastindex
+            # the token is always the tail of the match
+            start, pos = m.span(group)
+
+            if group > _EOF_GROUP:
+                append_kind(group_kinds[group])
+                append_value_id(-1)
+            elif group == _ID_GROUP:
+                if text[pos:pos + 1] > '\x7f':
+                    tokens.append(*self._word(start, pos))
+                    pos = self.pos
+                    continue
+                word = m.group(group)
+                kind = keyword_kinds.get(word)
+                if kind is None:
+                    value_id = value_index.get(word)
+                    append_kind(K_ID)
+                    append_value_id(intern(word) if value_id is None else value_id)
+                else:
+                    append_kind(kind)
+                    append_value_id(-1)
+            elif group == _INT_GROUP:
+                if text[pos:pos + 1] > '\x7f':
+                    try:
+                        tokens.append(*self._integer(start, pos))
+                    except LexicalError as error:
+                        tokens.fail(error)
+                        return tokens
+                    pos = self.pos
+                    continue
+                append_kind(K_INTEGER_VALUE)
+                append_value_id(intern(int(m.group(group))))
+            else:
+                self.pos = pos
+                tokens.append(K_EOF, pos, pos)
+                return tokens
+            append_start(start)
+            append_end(pos)
+        self.pos = pos
+        return tokens
+
+    def _slow_token(self, pos):
+        """Scan one token that starts with a non-ASCII character.
+
+        Returns None after skipping a non-ASCII whitespace character,
+        otherwise a (kind, start, end, value) tuple for TokenBuffer.append.
+        """
+        text = self.text
+        pos = _SKIP_PATTERN.match(text, pos).end()
+        self.pos = pos
+        char = text[pos]
+        if char.isspace():
+            self.pos = pos + 1
+            return None
+        if char.isalpha():
+            return self._word(pos, pos)
+        if char.isdigit():
+            return self._integer(pos, pos)
+        self.error()
+
+    def _extend(self, end, predicate):
+        """Extend a token while `predicate` accepts the next character."""
+        text = self.text
+        length = len(text)
+        while end < length and predicate(text[end]):
+            end += 1
+        return end
+
+    def _word(self, start, end):
+        end = self._extend(end, str.isalnum)
+        self.pos = end
+        word = self.text[start:end]
+        kind = KEYWORD_KINDS.get(word)
+        if kind is not None:
+            return kind, start, end, None
+        return K_ID, start, end, word
+
+    def _integer(self, start, end):
+        end = self._extend(end, str.isdigit)
+        try:
+            value = int(self.text[start:end])
+        except ValueError:
+            # a digit without a decimal value, such as a superscript
+            self.pos = start
+            self.error()
+        self.pos = end
+        return K_INTEGER_VALUE, start, end, value
+
+
+BYTE_KEYWORD_KINDS = dict((word.encode('ascii'), kind) for word, kind in KEYWORD_KINDS.items())
+
+# bytes 0x80-0xbf only continue a UTF-8 sequence, they never start a character
+_CONTINUATION_BYTES = bytes(range(0x80, 0xc0))
+
+
+def continuation_bytes(data):
+    return len(data) - len(data.translate(None, _CONTINUATION_BYTES))
+
+
+class StreamLexer(object):
+    """FastLexer over a byte stream, for sources too big to hold in memory.
+
+    The source is either a buffer that is scanned in place, such as an
+    mmap of the file, or a binary reader that is read chunk by chunk into
+    one reusable bytearray. Tokens, whitespace and #...# comments may span
+    chunk boundaries: whatever is left of an unfinished token is moved to
+    the front of the buffer before the next chunk is read, and an open
+    comment is consumed as it is read. `tokenize` hands the parser one
+    window of at most `window` tokens at a time, so neither the source nor
+    its whole token stream are ever held in memory.
+
+    The source is decoded as UTF-8; columns count characters like the
+    other lexers do.
+    """
+
+    CHUNK_SIZE = 1 << 20
+    WINDOW = 1 << 16
+
+    def __init__(self, source, context, chunk_size=CHUNK_SIZE, window=WINDOW):
+        self.context = context
+        self.window = window
+        if hasattr(source, 'readinto'):
+            self.reader = source
+            self.data = bytearray(chunk_size)
+            self.limit = 0
+            self.final = False
+        else:
+            self.reader = None
+            self.data = source
+            self.limit = len(source)
+            self.final = True
+        # offset of data[0] in the source
+        self.base = 0
+        self.pos = 0
+        # line of data[pos], where that line starts in data (possibly before
+        # data[0]) and how many continuation bytes it has up to pos
+        self.line = 1
+        self.line_start = 0
+        self.line_extra = 0
+        # (line, column, offset) of the comment being skipped, if any
+        self.comment = None
+        self.done = False
+
+    @classmethod
+    def open(cls, path, context):
+        """Map the file at `path` into memory, or read it in chunks if it cannot be mapped."""
+        import mmap
+        source = open(path, 'rb')
+        try:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # empty files, pipes and devices
+            return cls(source, context)
+        source.close()
+        if hasattr(data, 'madvise'):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        return cls(data, context)
+
+    def column(self, pos):
+        return pos - self.line_start - self.line_extra + 1
+
+    def tokenize(self):
+        """Scan the next window of tokens; the last one ends with EOF or ERROR."""
+        tokens = StreamTokenBuffer()
+        while not self.scan(tokens):
+            self.refill()
+        return tokens
+
+    def refill(self):
+        """Keep the unscanned tail of the buffer and read the next chunk after it."""
+        data = self.data
+        pos = self.pos
+        tail = self.limit - pos
+        if pos:
+            data[:tail] = data[pos:self.limit]
+            self.base += pos
+            self.line_start -= pos
+            self.pos = 0
+        if tail == len(data):
+            # a single token longer than the buffer
+            data.extend(bytes(len(data)))
+        count = self.reader.readinto(memoryview(data)[tail:])
+        self.limit = tail + count
+        self.final = not count
+
+    def scan(self, tokens):
+        """Scan tokens into `tokens` until the window is full or the stream ends.
+
+        Returns False if the data runs out in the middle of a token, once
+        everything in front of it has been consumed.
+        """
+        data = self.data
+        limit = self.limit
+        final = self.final
+        match = _BYTE_TOKEN_PATTERN.match
+        rfind = data.rfind
+        group_kinds = _GROUP_KINDS
+        keyword_kinds = BYTE_KEYWORD_KINDS
+        append_kind = tokens.kinds.append
+        append_start = tokens.starts.append
+        append_end = tokens.ends.append
+        append_value_id = tokens.value_ids.append
+        append_line = tokens.line_nos.append
+        append_column = tokens.columns.append
+        intern = tokens.intern
+        # value ids by the raw bytes of identifiers and integers
+        raw_ids = {}
+        base = self.base
+        pos = self.pos
+        line, line_start, line_extra = self.line, self.line_start, self.line_extra
+        room = self.window - len(tokens)
+
+        while room > 0:
+            m = None if self.comment is not None else match(data, pos, limit)
+            if m is not None:
+                group = m.lastindex
+                start, end = m.span(group)
+                if start != pos:
+                    newline = rfind(b'\n', pos, start)
+                    if newline != -1:
+                        line += data[pos:newline + 1].count(b'\n')
+                        line_start = newline + 1
+                        line_extra = 0
+                    pos = start
+                if end == limit and not final:
+                    # the token may go on in the next chunk
+                    self.pos, self.line, self.line_start, self.line_extra = pos, line, line_start, line_extra
+                    return False
+                if group <= _INT_GROUP and end < limit and data[end] > 0x7f:
+                    # identifier or integer going on with non-ASCII characters
+                    m = None
+            if m is None:
+                self.pos, self.line, self.line_start, self.line_extra = pos, line, line_start, line_extra
+                added = self._slow_token(tokens)
+                if added < 0:
+                    return False
+                if self.done:
+                    return True
+                room -= added
+                pos, line, line_start, line_extra = self.pos, self.line, self.line_start, self.line_extra
+                continue
+
+            if group > _EOF_GROUP:
+                append_kind(group_kinds[group])
+                append_value_id(-1)
+            elif group == _ID_GROUP:
+                word = m.group(group)
+                kind = keyword_kinds.get(word)
+                if kind is None:
+                    value_id = raw_ids.get(word)
+                    if value_id is None:
+                        value_id = raw_ids[word] = intern(word.decode('ascii'))
+                    append_kind(K_ID)
+                    append_value_id(value_id)
+                else:
+                    append_kind(kind)
+                    append_value_id(-1)
+            elif group == _INT_GROUP:
+                digits = m.group(group)
+                value_id = raw_ids.get(digits)
+                if value_id is None:
+                    value_id = raw_ids[digits] = intern(int(digits))
+                append_kind(K_INTEGER_VALUE)
+                append_value_id(value_id)
+            else:
+                append_kind(K_EOF)
+                append_value_id(-1)
+                self.done = True
+                room = 0
+            append_start(base + start)
+            append_end(base + end)
+            append_line(line)
+            append_column(start - line_start - line_extra + 1)
+            pos = end
+            room -= 1
+
+        self.pos, self.line, self.line_start, self.line_extra = pos, line, line_start, line_extra
+        return True
+
+    def advance(self, end):
+        """Move `pos` to `end`, keeping track of lines and columns."""
+        data = self.data
+        start = self.pos
+        newline = data.rfind(b'\n', start, end)
+        if newline != -1:
+            step = self.CHUNK_SIZE
+            for offset in range(start, newline + 1, step):
+                self.line += data[offset:min(offset + step, newline + 1)].count(b'\n')
+            start = self.line_start = newline + 1
+            self.line_extra = 0
+        self.line_extra += continuation_bytes(data[start:end])
+        self.pos = end
+
+    def _slow_token(self, tokens):
+        """Scan what the byte pattern leaves out at `pos`.
+
+        That is comments that are open or hold non-ASCII text, non-ASCII
+        characters and errors.
+        Returns the number of tokens added, or -1 if more data is needed.
+        """
+        data = self.data
+        limit = self.limit
+        if self.comment is not None:
+            close = data.find(b'#', self.pos, limit)
+            if close == -1:
+                if self.final:
+                    return self.error(tokens, *self.comment)
+                self.advance(limit)
+                return -1
+            self.advance(close + 1)
+            self.comment = None
+            return 0
+
+        pos = _BYTE_SKIP_PATTERN.match(data, self.pos, limit).end()
+        self.advance(pos)
+        if pos == limit:
+            return -1
+        byte = data[pos]
+        if byte == 0x23:  # '#'
+            self.comment = (self.line, self.column(pos), self.base + pos)
+            self.advance(pos + 1)
+            return 0
+        if byte < 0x80:
+            if byte == 0x21 and pos + 1 == limit and not self.final:
+                # '!' of a '!=' cut off by the end of the buffer
+                return -1
+            if not chr(byte).isalnum():
+                return self.error(tokens)
+            # an identifier or integer going on with non-ASCII characters
+            return self._word(tokens, pos, str.isalnum if chr(byte).isalpha() else str.isdigit)
+
+        char, size = self._char(pos)
+        if char is None:
+            if pos + size > limit and not self.final:
+                return -1
+            return self.error(tokens)
+        if char.isspace():
+            self.advance(pos + size)
+            return 0
+        if char.isalpha():
+            return self._word(tokens, pos, str.isalnum)
+        if char.isdigit():
+            return self._word(tokens, pos, str.isdigit)
+        return self.error(tokens)
+
+    def _char(self, pos):
+        """Decode the multi-byte character at `pos` as (char, size)."""
+        lead = self.data[pos]
+        size = 2 if lead < 0xe0 else 3 if lead < 0xf0 else 4
+        if pos + size > self.limit:
+            return None, size
+        try:
+            return bytes(self.data[pos:pos + size]).decode('utf-8'), size
+        except UnicodeDecodeError:
+            return None, 0
+
+    def _word(self, tokens, start, predicate):
+        """Scan an identifier or integer while `predicate` accepts its characters."""
+        data = self.data
+        limit = self.limit
+        end = start
+        while end < limit:
+            if data[end] < 0x80:
+                char, size = chr(data[end]), 1
+            else:
+                char, size = self._char(end)
+                if char is None:
+                    break
+            if not predicate(char):
+                break
+            end += size
+        if not self.final and (end == limit or end + size > limit):
+            return -1
+        text = bytes(data[start:end]).decode('utf-8')
+        if predicate is str.isdigit:
+            try:
+                kind, value = K_INTEGER_VALUE, int(text)
+            except ValueError:
+                # a digit without a decimal value, such as a superscript
+                return self.error(tokens)
+        else:
+            kind = KEYWORD_KINDS.get(text)
+            if kind is None:
+                kind, value = K_ID, text
+            else:
+                value = None
+        tokens.add(kind, self.base + start, self.base + end, value, self.line, self.column(start))
+        self.advance(end)
+        return 1
+
+    def error(self, tokens, line=None, column=None, offset=None):
+        """End the stream with an ERROR entry for the character at `pos`."""
+        if line is None:
+            line, column, offset = self.line, self.column(self.pos), self.base + self.pos
+        where = Token(None, None, offset, SourcePosition(line, column))
+        tokens.fail(LexicalError('Lexical Error: Invalid character at ' + format_position(where), offset),
+                    line, column)
+        self.done = True
+        return 1
+
+
+LEXERS = {
+    'table': FastLexer,
+    'legacy': Lexer,
+    'stream': StreamLexer
+}
+
+
 ###############################################################################
 #                                                                             #
 #  PARSER                                                                     #
 #                                                                             #
 ###############################################################################
 
-boolean_e = []
+KIND_BY_NAME = dict((kind.name, int(kind)) for kind in TokenKind)
+
+
+class NodeArena(object):
+    """The nodes of a syntax tree, held in parallel typed arrays.
+
+    Node `i` is of class `NODE_TYPES[kinds[i]]`, refers to entry
+    `tokens[i]` of the token table (-1 if it has none) and its children
+    are `children[firsts[i]:firsts[i + 1]]`. A child entry is the index of
+    a node, -1 for None, or `-2 - j` for `foreign[j]`, any other object
+    the parser hangs into the tree.
+
+    The token table keeps kind, interned value and start offset of every
+    token a node refers to, the offset less `origin`. Tokens from a lexer
+    that sees the whole source are positioned through its LineIndex,
+    streamed ones carry their own line and column. A tree is moved within
+    its source, or to another version of it, by changing `origin` and
+    `lines`.
+
+    Nodes are only materialized as AST views, which are built on access.
+    """
+
+    def __init__(self, lines=None, origin=0):
+        self.kinds = array('B')
+        self.tokens = array('i')
+        self.firsts = array('i')
+        self.flags = array('B')
+        self.children = array('i')
+        self.foreign = []
+        self.lines = lines
+        self.origin = origin
+        self.token_kinds = array('B')
+        self.token_values = array('i')
+        self.token_starts = array('q')
+        self.token_lines = array('i')
+        self.token_columns = array('i')
+        self.values = []
+        self.value_index = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def add(self, node_type, token=None, children=(), flag=0):
+        """Append a node and return its view."""
+        index = len(self.kinds)
+        self.kinds.append(node_type.node_kind)
+        self.tokens.append(-1 if token is None else self.add_token(token))
+        self.firsts.append(len(self.children))
+        self.flags.append(flag)
+        for child in children:
+            if child is None:
+                self.children.append(-1)
+            elif isinstance(child, AST) and child.arena is self:
+                self.children.append(child.index)
+            else:
+                self.children.append(-2 - len(self.foreign))
+                self.foreign.append(child)
+        return node_type((self, index))
+
+    def add_token(self, token):
+        value_id = self.value_index.get(token.value)
+        if value_id is None:
+            value_id = self.value_index[token.value] = len(self.values)
+            self.values.append(token.value)
+        self.token_kinds.append(KIND_BY_NAME[token.type])
+        self.token_values.append(value_id)
+        self.token_starts.append(token.pos - self.origin)
+        if self.lines is None:
+            line, column = token.lines.position(token.pos)
+            self.token_lines.append(line)
+            self.token_columns.append(column)
+        return len(self.token_kinds) - 1
+
+    def token(self, token_id):
+        if token_id < 0:
+            return None
+        start = self.token_starts[token_id] + self.origin
+        if self.lines is None:
+            lines = SourcePosition(self.token_lines[token_id], self.token_columns[token_id])
+        else:
+            lines = self.lines
+        return Token(KIND_NAMES[self.token_kinds[token_id]], self.values[self.token_values[token_id]], start, lines)
+
+    def node(self, entry):
+        """Return the node, None or foreign object a child entry stands for."""
+        if entry >= 0:
+            return NODE_TYPES[self.kinds[entry]]((self, entry))
+        if entry == -1:
+            return None
+        return self.foreign[-2 - entry]
+
+    def child_nodes(self, index):
+        first = self.firsts[index]
+        if index + 1 < len(self.firsts):
+            entries = self.children[first:self.firsts[index + 1]]
+        else:
+            entries = self.children[first:]
+        kinds = self.kinds
+        return [NODE_TYPES[kinds[entry]]((self, entry)) if entry >= 0 else self.node(entry) for entry in entries]
+
+
+class ChildField(object):
+    """Node field holding the n-th child."""
+
+    def __init__(self, n):
+        self.n = n
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        arena, index = node
+        entry = arena.children[arena.firsts[index] + self.n]
+        if entry >= 0:
+            return NODE_TYPES[arena.kinds[entry]]((arena, entry))
+        return arena.node(entry)
+
+
+class ChildrenField(object):
+    """Node field holding all children as a list."""
 
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        arena, index = node
+        return arena.child_nodes(index)
 
-class AST(object):  # parent node, abstract syntax tree
-    pass
+
+class TokenField(object):
+    """Node field holding the node's token."""
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        arena, index = node
+        return arena.token(arena.tokens[index])
+
+
+class ValueField(object):
+    """Node field holding the value of the node's token."""
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        arena, index = node
+        return arena.values[arena.token_values[arena.tokens[index]]]
+
+
+class FlagField(object):
+    """Boolean node field."""
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        arena, index = node
+        return bool(arena.flags[index])
+
+
+class AST(tuple):  # parent node, abstract syntax tree
+    """View of node `index` of a NodeArena, the pair (arena, index).
+
+    Views are cheap and not unique, two views of one node compare equal.
+    """
+    __slots__ = ()
+    arena = property(itemgetter(0))
+    index = property(itemgetter(1))
 
 
 # BASIC NODES
 class BinOp(AST):
-    def __init__(self, left, op, right):
-        self.left = left
-        self.token = self.op = op
-        self.right = right
+    __slots__ = ()
+    left = ChildField(0)
+    token = op = TokenField()
+    right = ChildField(1)
 
 
 class Number(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    __slots__ = ()
+    token = TokenField()
+    value = ValueField()
 
 
 class Boolean(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    __slots__ = ()
+    token = TokenField()
+    value = ValueField()
 
 
 class UnaryOp(AST):
-    def __init__(self, op, expr):
-        self.token = self.op = op
-        self.expr = expr
+    __slots__ = ()
+    token = op = TokenField()
+    expr = ChildField(0)
 
 
 class Compound(AST):
-    def __init__(self):
-        self.children = []
+    __slots__ = ()
+    children = ChildrenField()
 
 
 class Assign(AST):
-    def __init__(self, left, op, right):
-        self.left = left
-        self.token = self.op = op
-        self.right = right
+    __slots__ = ()
+    left = ChildField(0)
+    token = op = TokenField()
+    right = ChildField(1)
 
 
 class Var(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    __slots__ = ()
+    token = TokenField()
+    value = ValueField()
 
 
 class Program(AST):
-    def __init__(self):
-        self.children = []
+    __slots__ = ()
+    children = ChildrenField()
 
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
 
 
 class SwitchStat(AST):
-    def __init__(self, var, case_stats, cmpd_stats):
-        self.var = var
-        self.case_stats = case_stats
-        self.cmpd_stats = cmpd_stats
+    __slots__ = ()
+    var = ChildField(0)
+    # the parser's case lists, kept as foreign children since it keeps
+    # appending to them while a nested switch is open
+    case_stats = ChildField(1)
+    cmpd_stats = ChildField(2)
 
 
 class VarDecl(AST):
-    def __init__(self, var, type, exp, isConst):
-        self.left = var
-        self.var_type = type
-        self.right = exp
-        self.isConst = isConst
+    __slots__ = ()
+    left = ChildField(0)
+    var_type = ChildField(1)
+    right = ChildField(2)
+    isConst = FlagField()
 
 
 class IfStat(AST):
-    def __init__(self, expr, cmpd1, cmpd2):
-        self.expr = expr
-        self.cmpd1 = cmpd1
-        self.cmpd2 = cmpd2
+    __slots__ = ()
+    expr = ChildField(0)
+    cmpd1 = ChildField(1)
+    cmpd2 = ChildField(2)
 
 
 class WhileStat(AST):
-    def __init__(self, expr, cmpd):
-        self.expr = expr
-        self.cmpd1 = cmpd
+    __slots__ = ()
+    expr = ChildField(0)
+    cmpd1 = ChildField(1)
 
 
 class DoWhileStat(AST):
-    def __init__(self, expr, cmpd):
-        self.expr = expr
-        self.cmpd1 = cmpd
+    __slots__ = ()
+    expr = ChildField(0)
+    cmpd1 = ChildField(1)
 
 
 class BoolOp(AST):
-    def __init__(self, left, op, right):
-        self.left = left
-        self.token = self.op = op
-        self.right = right
+    __slots__ = ()
+    left = ChildField(0)
+    token = op = TokenField()
+    right = ChildField(1)
 
 
 class ForStat(AST):
-    def __init__(self, init, middle, end, cmpd_stat):
-        self.init = init
-        self.middle = middle
-        self.end = end
-        self.cmpd_stat = cmpd_stat
+    __slots__ = ()
+    init = ChildField(0)
+    middle = ChildField(1)
+    end = ChildField(2)
+    cmpd_stat = ChildField(3)
 
 
 class BreakStat(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    __slots__ = ()
+    token = TokenField()
+    value = ValueField()
 
 
 class Type(AST):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    __slots__ = ()
+    token = TokenField()
+    value = ValueField()
+
+
+NODE_TYPES = (Program, Compound, NoOp, VarDecl, Type, Assign, Var, Number, Boolean, BinOp, UnaryOp, BoolOp, IfStat,
+              SwitchStat, WhileStat, DoWhileStat, ForStat, BreakStat)
+for _kind, _node_type in enumerate(NODE_TYPES):
+    _node_type.node_kind = _kind
+
+
+def kind_mask(*kinds):
+    """Return a bitmask with bit `kind` set for each of `kinds`."""
+    mask = 0
+    for kind in kinds:
+        mask |= 1 << kind
+    return mask
+
+
+# FIRST sets and operator sets of the grammar as kind bitmasks, so a
+# membership test in the parser is `(1 << kind) & SET`
+STATEMENT_FIRST = kind_mask(K_BREAK, K_IF, K_SWITCH, K_WHILE, K_DO, K_FOR, K_ID, K_INTEGER_TYPE, K_CONSTANT,
+                            K_SEMI_COLON)
+SELECTION_FIRST = kind_mask(K_IF, K_SWITCH)
+ITERATION_FIRST = kind_mask(K_WHILE, K_DO, K_FOR)
+ADD_OPS = kind_mask(K_PLUS, K_MINUS)
+MUL_OPS = kind_mask(K_MULTIPLY, K_DIVIDE)
+RELATION_OPS = kind_mask(K_AND, K_OR, K_NOT, K_EQUAL, K_NOT_EQUAL, K_LESS_EQUAL, K_GREATER_EQUAL, K_LESS,
+                         K_GREATER)
+
+
+def precedence_table(precedences):
+    """Return a tuple mapping every token kind to its binary precedence, 0 if it has none."""
+    table = [0] * len(TokenKind)
+    for kind, precedence in precedences.items():
+        table[kind] = precedence
+    return tuple(table)
+
+
+# Binary operator precedences for PrattParser. All relations share one level,
+# as boolean_expression applies them strictly left to right; prefix + and -
+# bind tighter than any binary operator.
+ARITHMETIC_PRECEDENCE = precedence_table({K_PLUS: 1, K_MINUS: 1, K_MULTIPLY: 2, K_DIVIDE: 2})
+BOOLEAN_PRECEDENCE = precedence_table(dict((kind, 1) for kind in TokenKind if (1 << kind) & RELATION_OPS))
+UNARY_PRECEDENCE = 3
 
 
 class Parser(object):
-    def __init__(self, lexer, warn_file, error_file):
+    def __init__(self, lexer, context):
         self.lexer = lexer
-        # set current token to the first token taken from the input
-        self.current_token = self.lexer.get_next_token()
-        self.error_file = error_file
-        self.warn_file = warn_file
+        self.context = context
+        # the tree is built into an arena; tokens of a lexer that sees the
+        # whole source are positioned through its line index
+        self.nodes = NodeArena(getattr(lexer, 'lines', None))
+        # the loops and switches around the statement being parsed, which a
+        # break leaves
+        self.breakable = 0
+        # the parser walks the lexer's TokenBuffer by index and only looks
+        # at token kinds; Token objects are built for the AST on demand
+        self.next_window()
+
+    def next_window(self):
+        # Lexers that see the whole source return all tokens in one buffer.
+        # StreamLexer returns one window at a time; the parser only moves
+        # forward, so it asks for the next one when it runs off the end.
+        self.tokens = self.lexer.tokenize()
+        self.kinds = self.tokens.kinds
+        self.index = 0
+        self.current_kind = self.kinds[0]
+
+    @property
+    def current_token(self):
+        return self.tokens.token(self.index)
+
+    def lexical_error(self):
+        error = self.tokens.error
+        self.context.error_file.write(str(error) + '\n')
+        raise error
 
     def error(self):
-        self.error_file.write('Syntax Error: Invalid syntax at line: ' + str(line_no) + '\n')
-        raise Exception('Syntax Error: Invalid syntax at line: ' + str(line_no))
-
-    def eat(self, token_type):
-        # compare the current token type with the passed token
-        # type and if they match then "eat" the current token
-        # and assign the next token to the self.current_token,
-        # otherwise raise an exception.
-        if self.current_token.type == token_type:
-            self.current_token = self.lexer.get_next_token()
+        # No rule accepts an ERROR entry, so a lexical error always surfaces
+        # here, at the point where the parser reaches it; nothing observable
+        # happens between reading that lookahead and getting here.
+        if self.current_kind == K_ERROR:
+            self.lexical_error()
+        message = 'Syntax Error: Invalid syntax at ' + format_position(self.current_token)
+        self.context.error_file.write(message + '\n')
+        raise Exception(message)
+
+    def eat(self, kind):
+        # compare the current token kind with the passed token
+        # kind and if they match then "eat" the current token
+        # and move on to the next one, otherwise raise an exception.
+        if self.current_kind == kind:
+            self.index += 1
+            try:
+                self.current_kind = self.kinds[self.index]
+            except IndexError:
+                self.next_window()
         else:
             self.error()
 
@@ -422,8 +1520,8 @@ class Parser(object):
         variable : ID
         """
         token = self.current_token
-        self.eat(ID)
-        node = Var(token)
+        self.eat(K_ID)
+        node = self.nodes.add(Var, token)
         return node
 
     def type_spec(self):
@@ -431,8 +1529,8 @@ class Parser(object):
         type_spec : INTEGER_TYPE
         """
         token = self.current_token
-        self.eat(INTEGER_TYPE)
-        node = Type(token)
+        self.eat(K_INTEGER_TYPE)
+        node = self.nodes.add(Type, token)
         return node
 
     def program(self):
@@ -440,9 +1538,7 @@ class Parser(object):
         program : statement_list
         """
         nodes = self.statement_list()
-        root = Program()
-        for node in nodes:
-            root.children.append(node)
+        root = self.nodes.add(Program, None, nodes)
         return root
 
     def statement_list(self):
@@ -453,7 +1549,7 @@ class Parser(object):
         node = self.statement()
         results = [node]
 
-        while self.current_token.type in (BREAK, IF, SWITCH, WHILE, DO, FOR, ID, INTEGER_TYPE, CONSTANT, SEMI_COLON):
+        while (1 << self.current_kind) & STATEMENT_FIRST:
             results.append(self.statement())
 
         return results
@@ -468,24 +1564,30 @@ class Parser(object):
                   | const_statement SEMI_COLON
                   | SEMI_COLON
         """
-        node = NoOp()
-        if self.current_token.type == BREAK:
-            node = BreakStat()
-        elif self.current_token.type in (IF, SWITCH):
+        if self.current_kind == K_BREAK:
+            if not self.breakable:
+                self.error()
+            token = self.current_token
+            self.eat(K_BREAK)
+            self.eat(K_SEMI_COLON)
+            node = self.nodes.add(BreakStat, token)
+        elif (1 << self.current_kind) & SELECTION_FIRST:
             node = self.selection_statement()
-        elif self.current_token.type in (WHILE, DO, FOR):
+        elif (1 << self.current_kind) & ITERATION_FIRST:
             node = self.iteration_statement()
-        elif self.current_token.type == ID:
+        elif self.current_kind == K_ID:
             node = self.assignment_statement()
-            self.eat(SEMI_COLON)
-        elif self.current_token.type in (INTEGER_TYPE):
+            self.eat(K_SEMI_COLON)
+        elif self.current_kind == K_INTEGER_TYPE:
             node = self.variable_declaration()
-            self.eat(SEMI_COLON)
-        elif self.current_token.type == CONSTANT:
+            self.eat(K_SEMI_COLON)
+        elif self.current_kind == K_CONSTANT:
             node = self.const_declaration()
-            self.eat(SEMI_COLON)
-        elif self.current_token.type == SEMI_COLON:
-            self.eat(SEMI_COLON)
+            self.eat(K_SEMI_COLON)
+        else:
+            if self.current_kind == K_SEMI_COLON:
+                self.eat(K_SEMI_COLON)
+            node = self.nodes.add(NoOp)
 
         return node
 
@@ -494,11 +1596,12 @@ class Parser(object):
         init_for : assignment_statement
                  | declaration_statement
         """
-        node = NoOp()
-        if self.current_token.type == ID:
+        if self.current_kind == K_ID:
             node = self.assignment_statement()
-        elif self.current_token.type == INTEGER_TYPE:
+        elif self.current_kind == K_INTEGER_TYPE:
             node = self.variable_declaration()
+        else:
+            node = self.nodes.add(NoOp)
         return node
 
     def compound_statement(self):
@@ -507,26 +1610,31 @@ class Parser(object):
                           | L_BRACE R_BRACE
         """
         nodes = []
-        self.eat(L_BRACE)
-        if self.current_token.type in (BREAK, IF, SWITCH, WHILE, DO, FOR, ID, INTEGER_TYPE, CONSTANT, SEMI_COLON):
+        self.eat(K_L_BRACE)
+        if (1 << self.current_kind) & STATEMENT_FIRST:
             nodes = self.statement_list()
-        self.eat(R_BRACE)
+        self.eat(K_R_BRACE)
 
-        root = Compound()
-        for node in nodes:
-            root.children.append(node)
+        root = self.nodes.add(Compound, None, nodes)
 
         return root
 
+    def loop_body(self):
+        """The compound_statement of a loop, where a break may be."""
+        self.breakable += 1
+        node = self.compound_statement()
+        self.breakable -= 1
+        return node
+
     def assignment_statement(self):
         """
         assignment_statement : variable ASSIGN expr
         """
         left = self.variable()
         token = self.current_token
-        self.eat(ASSIGN)
+        self.eat(K_ASSIGN)
         right = self.expr()
-        node = Assign(left, token, right)
+        node = self.nodes.add(Assign, token, (left, right))
         return node
 
     def selection_statement(self):
@@ -535,68 +1643,67 @@ class Parser(object):
                             | IF L_PAREN boolean_expression R_PAREN compound_statement ELSE compound_statement
                             | SWITCH L_PAREN variable R_PAREN L_BRACE (CASE (INTEGER_VALUE | MINUS INTEGER_VALUE) COLON compound_statement)+ (DEFAULT COLON compound_statement) R_BRACE
         """
-        node = NoOp()
-        global boolean_e
-        if self.current_token.type == IF:
-            self.eat(IF)
-            self.eat(L_PAREN)
-            boolean_e.append(self.boolean_expression())
-            self.eat(R_PAREN)
-            self.cmpd_stat1 = self.compound_statement()
-            self.cmpd_stat2 = None
-            if self.current_token.type == ELSE:
-                self.eat(ELSE)
-                self.cmpd_stat2 = self.compound_statement()
-            node = IfStat(boolean_e[-1], self.cmpd_stat1, self.cmpd_stat2)
-            del boolean_e[-1]
+        if self.current_kind == K_IF:
+            self.eat(K_IF)
+            self.eat(K_L_PAREN)
+            bool_expr = self.boolean_expression()
+            self.eat(K_R_PAREN)
+            cmpd_stat1 = self.compound_statement()
+            cmpd_stat2 = None
+            if self.current_kind == K_ELSE:
+                self.eat(K_ELSE)
+                cmpd_stat2 = self.compound_statement()
+            node = self.nodes.add(IfStat, None, (bool_expr, cmpd_stat1, cmpd_stat2))
             return node
-        elif self.current_token.type == SWITCH:
-            self.eat(SWITCH)
-            self.eat(L_PAREN)
-            self.var = self.variable()
-            self.eat(R_PAREN)
-            self.eat(L_BRACE)
-            self.eat(CASE)
-            self.case_stats = []
-            self.cmpd_stats = []
-            if self.current_token.type == INTEGER_VALUE:
+        elif self.current_kind == K_SWITCH:
+            self.eat(K_SWITCH)
+            self.eat(K_L_PAREN)
+            var = self.variable()
+            self.eat(K_R_PAREN)
+            self.eat(K_L_BRACE)
+            self.eat(K_CASE)
+            self.breakable += 1
+            case_stats = []
+            cmpd_stats = []
+            if self.current_kind == K_INTEGER_VALUE:
                 num_token = self.current_token
-                self.eat(INTEGER_VALUE)
-                self.eat(COLON)
-                self.cmpd_stats.append(self.compound_statement())
-                self.case_stats.append(Number(num_token))
-            elif self.current_token.type == MINUS:
+                self.eat(K_INTEGER_VALUE)
+                self.eat(K_COLON)
+                cmpd_stats.append(self.compound_statement())
+                case_stats.append(self.nodes.add(Number, num_token))
+            elif self.current_kind == K_MINUS:
                 minus_token = self.current_token
-                self.eat(MINUS)
+                self.eat(K_MINUS)
                 num_token = self.current_token
-                self.eat(INTEGER_VALUE)
-                self.eat(COLON)
-                self.cmpd_stats.append(self.compound_statement())
-                self.case_stats.append(UnaryOp(minus_token, Number(num_token)))
-            while self.current_token.type == CASE:
-                self.eat(CASE)
-                if self.current_token.type == INTEGER_VALUE:
+                self.eat(K_INTEGER_VALUE)
+                self.eat(K_COLON)
+                cmpd_stats.append(self.compound_statement())
+                case_stats.append(self.nodes.add(UnaryOp, minus_token, (self.nodes.add(Number, num_token),)))
+            while self.current_kind == K_CASE:
+                self.eat(K_CASE)
+                if self.current_kind == K_INTEGER_VALUE:
                     num_token = self.current_token
-                    self.eat(INTEGER_VALUE)
-                    self.eat(COLON)
-                    self.cmpd_stats.append(self.compound_statement())
-                    self.case_stats.append(Number(num_token))
-                elif self.current_token.type == MINUS:
+                    self.eat(K_INTEGER_VALUE)
+                    self.eat(K_COLON)
+                    cmpd_stats.append(self.compound_statement())
+                    case_stats.append(self.nodes.add(Number, num_token))
+                elif self.current_kind == K_MINUS:
                     minus_token = self.current_token
-                    self.eat(MINUS)
+                    self.eat(K_MINUS)
                     num_token = self.current_token
-                    self.eat(INTEGER_VALUE)
-                    self.eat(COLON)
-                    self.cmpd_stats.append(self.compound_statement())
-                    self.case_stats.append(UnaryOp(minus_token, Number(num_token)))
-            if self.current_token.type == DEFAULT:
+                    self.eat(K_INTEGER_VALUE)
+                    self.eat(K_COLON)
+                    cmpd_stats.append(self.compound_statement())
+                    case_stats.append(self.nodes.add(UnaryOp, minus_token, (self.nodes.add(Number, num_token),)))
+            if self.current_kind == K_DEFAULT:
                 default_token = self.current_token
-                self.eat(DEFAULT)
-                self.eat(COLON)
-                self.cmpd_stats.append(self.compound_statement())
-                self.case_stats.append(default_token)
-            self.eat(R_BRACE)
-            node = SwitchStat(self.var, self.case_stats, self.cmpd_stats)
+                self.eat(K_DEFAULT)
+                self.eat(K_COLON)
+                cmpd_stats.append(self.compound_statement())
+                case_stats.append(default_token)
+            self.breakable -= 1
+            self.eat(K_R_BRACE)
+            node = self.nodes.add(SwitchStat, None, (var, case_stats, cmpd_stats))
             return node
 
     def iteration_statement(self):
@@ -605,36 +1712,35 @@ class Parser(object):
                             | DO compound_statement WHILE L_PAREN boolean_expression R_PAREN SEMI_COLON
                             | FOR L_PAREN init_for SEMI_COLON boolean_expression SEMI_COLON assignment_statement R_PAREN compound_statement
         """
-        node = NoOp()
-        if self.current_token.type == WHILE:
-            self.eat(WHILE)
-            self.eat(L_PAREN)
+        if self.current_kind == K_WHILE:
+            self.eat(K_WHILE)
+            self.eat(K_L_PAREN)
             bool_expr = self.boolean_expression()
-            self.eat(R_PAREN)
-            self.cmpd_stat = self.compound_statement()
-            node = WhileStat(bool_expr, self.cmpd_stat)
+            self.eat(K_R_PAREN)
+            cmpd_stat = self.loop_body()
+            node = self.nodes.add(WhileStat, None, (bool_expr, cmpd_stat))
             return node
-        elif self.current_token.type == DO:
-            self.eat(DO)
-            self.cmpd_stat = self.compound_statement()
-            self.eat(WHILE)
-            self.eat(L_PAREN)
+        elif self.current_kind == K_DO:
+            self.eat(K_DO)
+            cmpd_stat = self.loop_body()
+            self.eat(K_WHILE)
+            self.eat(K_L_PAREN)
             bool_expr = self.boolean_expression()
-            self.eat(R_PAREN)
-            self.eat(SEMI_COLON)
-            node = DoWhileStat(bool_expr, self.cmpd_stat)
+            self.eat(K_R_PAREN)
+            self.eat(K_SEMI_COLON)
+            node = self.nodes.add(DoWhileStat, None, (bool_expr, cmpd_stat))
             return node
-        elif self.current_token.type == FOR:
-            self.eat(FOR)
-            self.eat(L_PAREN)
-            self.init = self.init_for()
-            self.eat(SEMI_COLON)
-            self.middle = self.boolean_expression()
-            self.eat(SEMI_COLON)
-            self.end = self.assignment_statement()
-            self.eat(R_PAREN)
-            self.cmpd_stat = self.compound_statement()
-            node = ForStat(self.init, self.middle, self.end, self.cmpd_stat)
+        elif self.current_kind == K_FOR:
+            self.eat(K_FOR)
+            self.eat(K_L_PAREN)
+            init = self.init_for()
+            self.eat(K_SEMI_COLON)
+            middle = self.boolean_expression()
+            self.eat(K_SEMI_COLON)
+            end = self.assignment_statement()
+            self.eat(K_R_PAREN)
+            cmpd_stat = self.loop_body()
+            node = self.nodes.add(ForStat, None, (init, middle, end, cmpd_stat))
             return node
 
     def variable_declaration(self):
@@ -645,13 +1751,13 @@ class Parser(object):
         type_node = self.type_spec()
         var_node = self.variable()
 
-        if self.current_token.type == ASSIGN:
-            self.eat(ASSIGN)
+        if self.current_kind == K_ASSIGN:
+            self.eat(K_ASSIGN)
             expr_node = self.expr()
         else:
             expr_node = None
 
-        var_declaration = VarDecl(var_node, type_node, expr_node, False)
+        var_declaration = self.nodes.add(VarDecl, None, (var_node, type_node, expr_node), False)
 
         return var_declaration
 
@@ -659,19 +1765,19 @@ class Parser(object):
         """
         const_declaration : CONSTANT TYPE variable ASSIGN expr
         """
-        self.eat(CONSTANT)
+        self.eat(K_CONSTANT)
         type_node = self.type_spec()
         var_node = self.variable()
-        self.eat(ASSIGN)
+        self.eat(K_ASSIGN)
         expr_node = self.expr()
 
-        var_declaration = VarDecl(var_node, type_node, expr_node, True)
+        var_declaration = self.nodes.add(VarDecl, None, (var_node, type_node, expr_node), True)
 
         return var_declaration
 
     def empty(self):
         """An empty production"""
-        return NoOp()
+        return self.nodes.add(NoOp)
 
     def expr(self):
         """
@@ -679,14 +1785,11 @@ class Parser(object):
         """
         node = self.term()
 
-        while self.current_token.type in (PLUS, MINUS):
+        while (1 << self.current_kind) & ADD_OPS:
             token = self.current_token
-            if token.type == PLUS:
-                self.eat(PLUS)
-            elif token.type == MINUS:
-                self.eat(MINUS)
+            self.eat(self.current_kind)
 
-            node = BinOp(left=node, op=token, right=self.term())
+            node = self.nodes.add(BinOp, token, (node, self.term()))
 
         return node
 
@@ -696,14 +1799,11 @@ class Parser(object):
         """
         node = self.factor()
 
-        while self.current_token.type in (MULTIPLY, DIVIDE):
+        while (1 << self.current_kind) & MUL_OPS:
             token = self.current_token
-            if token.type == MULTIPLY:
-                self.eat(MULTIPLY)
-            elif token.type == DIVIDE:
-                self.eat(DIVIDE)
+            self.eat(self.current_kind)
 
-            node = BinOp(left=node, op=token, right=self.factor())
+            node = self.nodes.add(BinOp, token, (node, self.factor()))
 
         return node
 
@@ -715,22 +1815,25 @@ class Parser(object):
                | LPAREN expr RPAREN
                | variable
         """
-        token = self.current_token
-        if token.type == PLUS:
-            self.eat(PLUS)
-            node = UnaryOp(token, self.factor())
+        kind = self.current_kind
+        if kind == K_PLUS:
+            token = self.current_token
+            self.eat(K_PLUS)
+            node = self.nodes.add(UnaryOp, token, (self.factor(),))
             return node
-        elif token.type == MINUS:
-            self.eat(MINUS)
-            node = UnaryOp(token, self.factor())
+        elif kind == K_MINUS:
+            token = self.current_token
+            self.eat(K_MINUS)
+            node = self.nodes.add(UnaryOp, token, (self.factor(),))
             return node
-        elif token.type == INTEGER_VALUE:
-            self.eat(INTEGER_VALUE)
-            return Number(token)
-        elif token.type == L_PAREN:
-            self.eat(L_PAREN)
+        elif kind == K_INTEGER_VALUE:
+            token = self.current_token
+            self.eat(K_INTEGER_VALUE)
+            return self.nodes.add(Number, token)
+        elif kind == K_L_PAREN:
+            self.eat(K_L_PAREN)
             node = self.expr()
-            self.eat(R_PAREN)
+            self.eat(K_R_PAREN)
             return node
         else:
             node = self.variable()
@@ -742,28 +1845,11 @@ class Parser(object):
         """
         node = self.boolean_term()
 
-        while self.current_token.type in (AND, OR, NOT, EQUAL, NOT_EQUAL, LESS_EQUAL, GREATER_EQUAL, LESS, GREATER):
+        while (1 << self.current_kind) & RELATION_OPS:
             token = self.current_token
-            if token.type == AND:
-                self.eat(AND)
-            elif token.type == OR:
-                self.eat(OR)
-            elif token.type == NOT:
-                self.eat(NOT)
-            elif token.type == EQUAL:
-                self.eat(EQUAL)
-            elif token.type == NOT_EQUAL:
-                self.eat(NOT_EQUAL)
-            elif token.type == LESS_EQUAL:
-                self.eat(LESS_EQUAL)
-            elif token.type == GREATER_EQUAL:
-                self.eat(GREATER_EQUAL)
-            elif token.type == LESS:
-                self.eat(LESS)
-            elif token.type == GREATER:
-                self.eat(GREATER)
-
-            node = BoolOp(left=node, op=token, right=self.boolean_term())
+            self.eat(self.current_kind)
+
+            node = self.nodes.add(BoolOp, token, (node, self.boolean_term()))
 
         return node
 
@@ -774,42 +1860,256 @@ class Parser(object):
                      | FALSE
                      | L_PAREN boolean_expression R_PAREN
         """
-        token = self.current_token
-        if token.type == NOT:
-            self.eat(NOT)
-            node = UnaryOp(token, self.boolean_term)
+        kind = self.current_kind
+        if kind == K_NOT:
+            token = self.current_token
+            self.eat(K_NOT)
+            node = self.nodes.add(UnaryOp, token, (self.boolean_term,))
             return node
-        elif token.type == TRUE:
-            self.eat(TRUE)
-            return Boolean(token)
-        elif token.type == FALSE:
-            self.eat(FALSE)
-            return Boolean(token)
-        elif token.type == L_PAREN:
-            self.eat(L_PAREN)
+        elif kind == K_TRUE:
+            token = self.current_token
+            self.eat(K_TRUE)
+            return self.nodes.add(Boolean, token)
+        elif kind == K_FALSE:
+            token = self.current_token
+            self.eat(K_FALSE)
+            return self.nodes.add(Boolean, token)
+        elif kind == K_L_PAREN:
+            self.eat(K_L_PAREN)
             node = self.boolean_expression()
-            self.eat(R_PAREN)
+            self.eat(K_R_PAREN)
             return node
-        elif token.type == INTEGER_VALUE:
-            self.eat(INTEGER_VALUE)
-            return Number(token)
+        elif kind == K_INTEGER_VALUE:
+            token = self.current_token
+            self.eat(K_INTEGER_VALUE)
+            return self.nodes.add(Number, token)
         else:
             node = self.variable()
             return node
 
     def parse(self):
         node = self.program()
-        if self.current_token.type != EOF:
+        if self.current_kind != K_EOF:
             self.error()
 
         return node
 
 
+class PrattParser(Parser):
+    """Parser with an iterative operator-precedence expression engine.
+
+    `expr` and `boolean_expression` build the same BinOp, BoolOp and
+    UnaryOp trees as the recursive descent methods of Parser, but a whole
+    expression is parsed by one loop over an operand stack and an operator
+    stack driven by a precedence table. Nesting depth is no longer bound
+    by the recursion limit. Parser itself is still available through
+    `--parser recursive`.
+    """
+
+    def expr(self):
+        return self.expression(ARITHMETIC_PRECEDENCE, BinOp, False)
+
+    def boolean_expression(self):
+        return self.expression(BOOLEAN_PRECEDENCE, BoolOp, True)
+
+    def expression(self, precedence, node_type, boolean):
+        kinds = self.kinds
+        index = self.index
+        kind = kinds[index]
+        if (kind == K_ID or kind == K_INTEGER_VALUE) and index + 1 < len(kinds) and not precedence[kinds[index + 1]]:
+            # the common case of a lone variable or number
+            node = self.nodes.add(Var if kind == K_ID else Number, self.current_token)
+            self.eat(kind)
+            return node
+
+        operands = []
+        # pending operators and their precedences; an open parenthesis is
+        # None at precedence 0
+        operators = []
+        levels = []
+        depth = 0
+        # the current position is kept in locals and only handed back to
+        # self around the calls that need it
+        token_at = self.tokens.token
+        last = len(kinds) - 1
+        add = self.nodes.add
+
+        while True:
+            # prefix operators and parentheses in front of an operand
+            kind = kinds[index]
+            while kind == K_L_PAREN or not boolean and (1 << kind) & ADD_OPS:
+                if kind == K_L_PAREN:
+                    operators.append(None)
+                    levels.append(0)
+                    depth += 1
+                else:
+                    operators.append(token_at(index))
+                    levels.append(UNARY_PRECEDENCE)
+                if index < last:
+                    index += 1
+                else:
+                    self.index, self.current_kind = index, kind
+                    self.eat(kind)
+                    kinds, token_at, index, last = self.kinds, self.tokens.token, self.index, len(self.kinds) - 1
+                kind = kinds[index]
+
+            if kind == K_ID:
+                operands.append(add(Var, token_at(index)))
+            elif kind == K_INTEGER_VALUE:
+                operands.append(add(Number, token_at(index)))
+            elif boolean and (kind == K_TRUE or kind == K_FALSE):
+                operands.append(add(Boolean, token_at(index)))
+            elif boolean and kind == K_NOT:
+                # the same node boolean_term builds for a leading NOT
+                operands.append(add(UnaryOp, token_at(index), (self.boolean_term,)))
+            else:
+                # reports the syntax error
+                self.index, self.current_kind = index, kind
+                self.variable()
+            if index < last:
+                index += 1
+            else:
+                self.index, self.current_kind = index, kind
+                self.eat(kind)
+                kinds, token_at, index, last = self.kinds, self.tokens.token, self.index, len(self.kinds) - 1
+
+            # closing parentheses and the binary operator after the operand
+            while True:
+                kind = kinds[index]
+                level = precedence[kind]
+                if not level and not (kind == K_R_PAREN and depth):
+                    self.index, self.current_kind = index, kind
+                    if depth:
+                        # an unclosed parenthesis, report the token in its place
+                        self.eat(K_R_PAREN)
+                    if not operators:
+                        return operands[0]
+
+                # apply the pending operators that bind at least as tight
+                bound = level or 1
+                while levels and levels[-1] >= bound:
+                    token = operators.pop()
+                    if levels.pop() == UNARY_PRECEDENCE:
+                        operands[-1] = add(UnaryOp, token, (operands[-1],))
+                    else:
+                        right = operands.pop()
+                        operands[-1] = add(node_type, token, (operands[-1], right))
+
+                if level:
+                    operators.append(token_at(index))
+                    levels.append(level)
+                elif depth:
+                    operators.pop()
+                    levels.pop()
+                    depth -= 1
+                else:
+                    return operands[0]
+                if index < last:
+                    index += 1
+                else:
+                    self.index, self.current_kind = index, kind
+                    self.eat(kind)
+                    kinds, token_at, index, last = self.kinds, self.tokens.token, self.index, len(self.kinds) - 1
+                if level:
+                    break
+
+
+PARSERS = {
+    'pratt': PrattParser,
+    'recursive': Parser
+}
+
+
 class NodeVisitor(object):
+    """Walks an AST without recursion.
+
+    A visit_<Class> method is either a plain function of the node or a
+    generator: it visits a child by yielding it and gets back the child's
+    result, as in `value = yield node.left`, and its return value is its
+    own result. `visit` keeps the suspended generators on an explicit
+    stack, so the depth of a tree is only bounded by memory.
+
+    Optional enter_<Class>(node) and leave_<Class>(node) hooks run right
+    before and after the visit method of a node, e.g. to open and close a
+    scope. The methods for every node class are looked up once and cached
+    in a dispatch table of bound methods.
+    """
+
+    def dispatcher(self, node_type):
+        """Return the bound method that visits nodes of `node_type`, with its hooks."""
+        try:
+            dispatch = self._dispatch
+        except AttributeError:
+            dispatch = self._dispatch = {}
+        visitor = dispatch.get(node_type)
+        if visitor is None:
+            name = node_type.__name__
+            visitor = getattr(self, 'visit_' + name, self.generic_visit)
+            enter = getattr(self, 'enter_' + name, None)
+            leave = getattr(self, 'leave_' + name, None)
+            if enter is not None or leave is not None:
+                visitor = self.hooked(visitor, enter, leave)
+            dispatch[node_type] = visitor
+        return visitor
+
+    @staticmethod
+    def hooked(visitor, enter, leave):
+        def visit_with_hooks(node):
+            if enter is not None:
+                enter(node)
+            value = visitor(node)
+            if type(value) is GeneratorType:
+                value = yield from value
+            if leave is not None:
+                leave(node)
+            return value
+
+        return visit_with_hooks
+
     def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
+        try:
+            dispatch = self._dispatch
+        except AttributeError:
+            dispatch = self._dispatch = {}
+        get = dispatch.get
+        # suspended generator visits below the innermost one, `top`
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        top = None
+        error = None
+
+        while True:
+            # visit `node`; a generator only runs up to its first child
+            try:
+                value = (get(type(node)) or self.dispatcher(type(node)))(node)
+                if type(value) is GeneratorType:
+                    if top is not None:
+                        push(top)
+                    top = value
+                    value = None
+            except Exception as e:
+                error = e
+
+            # hand the result, or the exception, back up until a visit asks
+            # for another child
+            while top is not None:
+                try:
+                    if error is None:
+                        node = top.send(value)
+                    else:
+                        e, error = error, None
+                        node = top.throw(e)
+                    break
+                except StopIteration as stop:
+                    value = stop.value
+                except Exception as e:
+                    error = e
+                top = pop() if stack else None
+            else:
+                if error is not None:
+                    raise error
+                return value
 
     def generic_visit(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
@@ -907,12 +2207,14 @@ class ForSymbol(Symbol):
 
 
 class ScopedSymbolTable(object):
-    def __init__(self, scope_name, scope_level, enclosing_scope=None):
+    def __init__(self, scope_name, scope_level, enclosing_scope=None, symtable_file=None):
         self._symbols = OrderedDict()
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
-        self.symtable_file = open('symtable.txt', 'a+')
+        if symtable_file is None:
+            symtable_file = open('symtable.txt', 'a+')
+        self.symtable_file = symtable_file
 
     def _init_builtins(self):
         self.insert(BuiltInSymbol('INTEGER'))
@@ -933,9 +2235,13 @@ class ScopedSymbolTable(object):
         if current_scope_only:
             return None
 
-        # recursively go up the chain and lookup the name
-        if self.enclosing_scope is not None:
-            return self.enclosing_scope.lookup(name)
+        # go up the chain and lookup the name
+        scope = self.enclosing_scope
+        while scope is not None:
+            symbol = scope.lookup(name, current_scope_only=True)
+            if symbol is not None:
+                return symbol
+            scope = scope.enclosing_scope
 
     def __str__(self):
         h1 = 'SCOPE (SCOPED SYMBOL TABLE)'
@@ -969,28 +2275,64 @@ class ScopedSymbolTable(object):
 
 
 class SemanticAnalyzer(NodeVisitor):
-    def __init__(self, warn_file, error_file):
+    def __init__(self, context):
         self.current_scope = None
-        self.warn_file = warn_file
-        self.error_file = error_file
+        self.context = context
 
-    def visit_Program(self, node):
-        print('ENTER scope: global')
+    def undefined(self, var_name, token):
+        message = "Variable {} is not defined at {}".format(var_name, format_position(token))
+        self.context.error_file.write(message + "\n")
+        raise Exception(message)
+
+    def duplicate(self, var):
+        self.context.warn_file.write("Warning: Duplicate identifier {} found at {}\n".format(
+            var.value, format_position(var.token)))
+
+    def open_scope(self, scope_name, symbol):
+        self.current_scope.insert(symbol)
+        print('ENTER scope: {}'.format(scope_name), file=self.context.output)
+        # Scope for parameters and local variables
+        self.current_scope = ScopedSymbolTable(
+            scope_name=scope_name,
+            scope_level=self.current_scope.scope_level + 1,
+            enclosing_scope=self.current_scope,
+            symtable_file=self.context.symtable_file
+        )
+
+    def close_scope(self, node):
+        scope = self.current_scope
+        print(scope, file=self.context.output)
+        self.current_scope = scope.enclosing_scope
+        print('LEAVE scope: {}'.format(scope.scope_name), file=self.context.output)
+
+    def enter_Program(self, node):
+        print('ENTER scope: global', file=self.context.output)
         global_scope = ScopedSymbolTable(
             scope_name='global',
             scope_level=1,
             enclosing_scope=self.current_scope,  # None
+            symtable_file=self.context.symtable_file
         )
         global_scope._init_builtins()
         self.current_scope = global_scope
 
-        for child in node.children:
-            self.visit(child)
+    def enter_IfStat(self, node):
+        self.open_scope(IF, IfSymbol(IF))
+
+    def enter_WhileStat(self, node):
+        self.open_scope(WHILE, WhileSymbol(WHILE))
+
+    def enter_DoWhileStat(self, node):
+        self.open_scope('Do..While', DoWhileSymbol('Do..While'))
 
-        print(global_scope)
+    def enter_ForStat(self, node):
+        self.open_scope(FOR, ForSymbol(FOR))
 
-        self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: global')
+    leave_Program = leave_IfStat = leave_WhileStat = leave_DoWhileStat = leave_ForStat = close_scope
+
+    def visit_Program(self, node):
+        for child in node.children:
+            yield child
 
     def visit_VarDecl(self, node):
         type_name = node.var_type.value
@@ -999,45 +2341,43 @@ class SemanticAnalyzer(NodeVisitor):
         var_name = node.left.value
         var_symbol = VarSymbol(var_name, type_symbol)
         if self.current_scope.lookup(var_name, current_scope_only=True):
-            self.warn_file.write("Warning: Duplicate identifier {} found\n".format(var_name))
+            self.duplicate(node.left)
             # raise Exception("Warning: Duplicate identifier {} found".format(var_name))
         self.current_scope.insert(var_symbol)
         if node.right is not None:
-            self.visit(node.right)
+            yield node.right
 
     def visit_Type(self, node):
         # Do nothing
         pass
 
     def visit_BinOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
+        yield node.left
+        yield node.right
 
     def visit_Number(self, node):
         pass
 
     def visit_UnaryOp(self, node):
-        self.visit(node.expr)
+        yield node.expr
 
     def visit_Compound(self, node):
         for child in node.children:
-            self.visit(child)
+            yield child
 
     def visit_Assign(self, node):
         var_name = node.left.value
         if var_name is not None:
             var_symbol = self.current_scope.lookup(var_name)
             if var_symbol is None:
-                self.error_file.write("Variable {} is not defined\n".format(var_name))
-                raise Exception("Variable {} is not defined".format(var_name))
+                self.undefined(var_name, node.left.token)
 
     def visit_Var(self, node):
         var_name = node.value
         if var_name is not None:
             var_value = self.current_scope.lookup(var_name)
             if var_value is None:
-                self.error_file.write("Variable {} is not defined\n".format(var_name))
-                raise Exception("Variable {} is not defined".format(var_name))
+                self.undefined(var_name, node.token)
 
     def visit_NoOp(self, node):
         pass
@@ -1050,298 +2390,653 @@ class SemanticAnalyzer(NodeVisitor):
         if var_name is not None:
             var_value = self.current_scope.lookup(var_name)
             if var_value is None:
-                self.error_file.write("Variable {} is not defined\n".format(var_name))
-                raise Exception("Variable {} is not defined".format(var_name))
+                self.undefined(var_name, node.var.token)
         else:
-            self.warn_file.write("No Variable is for switch\n".format(var_name))
+            self.context.warn_file.write("No Variable is for switch\n".format(var_name))
             raise Exception("No Variable is for switch".format(var_name))
         for i, case in enumerate(node.case_stats):
             cmpd = node.cmpd_stats[i]
-            self.visit(cmpd)
+            yield cmpd
 
     def visit_IfStat(self, node):
-        if_symbol = IfSymbol(IF)
-        self.current_scope.insert(if_symbol)
-        print('ENTER scope: {}'.format(IF))
-        # Scope for parameters and local variables
-        if_scope = ScopedSymbolTable(
-            scope_name=IF,
-            scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope
-        )
-        self.current_scope = if_scope
-
-        self.visit(node.expr)
-        self.visit(node.cmpd1)
+        yield node.expr
+        yield node.cmpd1
         if node.cmpd2 is not None:
-            self.visit(node.cmpd1)
-
-        print(if_scope)
-
-        self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: {}'.format(IF))
+            yield node.cmpd1
 
     def visit_WhileStat(self, node):
-        while_symbol = WhileSymbol(WHILE)
-        self.current_scope.insert(while_symbol)
-        print('ENTER scope: {}'.format(WHILE))
-        # Scope for parameters and local variables
-        while_scope = ScopedSymbolTable(
-            scope_name=WHILE,
-            scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope
-        )
-        self.current_scope = while_scope
-
-        self.visit(node.expr)
-        self.visit(node.cmpd1)
-
-        print(while_scope)
-        self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: {}'.format(WHILE))
+        yield node.expr
+        yield node.cmpd1
 
     def visit_DoWhileStat(self, node):
-        do_while_symbol = DoWhileSymbol('Do..While')
-        self.current_scope.insert(do_while_symbol)
-        print('ENTER scope: {}'.format('Do..While'))
-        # Scope for parameters and local variables
-        do_while_scope = ScopedSymbolTable(
-            scope_name='Do..While',
-            scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope
-        )
-        self.current_scope = do_while_scope
-
-        self.visit(node.cmpd1)
-        self.visit(node.expr)
-
-        print(do_while_scope)
-        self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: {}'.format('Do..While'))
+        yield node.cmpd1
+        yield node.expr
 
     def visit_ForStat(self, node):
-        do_while_symbol = ForSymbol(FOR)
-        self.current_scope.insert(do_while_symbol)
-        print('ENTER scope: {}'.format(FOR))
-        # Scope for parameters and local variables
-        for_scope = ScopedSymbolTable(
-            scope_name=FOR,
-            scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope
-        )
-        self.current_scope = for_scope
-
-        var_name = self.visit(node.init)
+        var_name = yield node.init
         var_value = self.current_scope.lookup(var_name)
         if var_value is None:
-            self.error_file.write("Variable {} is not defined\n".format(var_name))
-            raise Exception("Variable {} is not defined".format(var_name))
-
-        self.visit(node.middle)
-        self.visit(node.cmpd_stat)
-        self.visit(node.end)
+            init_var = getattr(node.init, 'left', None)
+            self.undefined(var_name, init_var.token if init_var is not None else None)
 
-        print(for_scope)
-        self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: {}'.format(FOR))
+        yield node.middle
+        yield node.cmpd_stat
+        yield node.end
 
     def visit_BoolOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
+        yield node.left
+        yield node.right
 
     def visit_BreakStat(self, node):
         pass
 
 
+###############################################################################
+#                                                                             #
+#  INTERMEDIATE CODE                                                          #
+#                                                                             #
+###############################################################################
+# Quadruple opcodes; QUAD_OP_NAMES holds their spelling in out.txt
+class QuadOp(IntEnum):
+    LABEL = 0
+    ASSIGN = 1
+    ADD = 2
+    SUB = 3
+    MUL = 4
+    DIV = 5
+    UMINUS = 6
+    AND = 7
+    OR = 8
+    NOT = 9  # a NOT between two terms
+    EQUAL = 10
+    NOT_EQUAL = 11
+    LESS_EQUAL = 12
+    GREATER_EQUAL = 13
+    LESS = 14
+    GREATER = 15
+    CASE_EQUAL = 16  # the switch comparison
+    JFALSE = 17
+    JTRUE = 18
+    JMP = 19
+    JTAB = 20  # (jtab, Lfirst, index, Llast) jumps to label Lfirst + index
+    SHL = 21  # (<<, x, k, R) is x * 2**k
+    SHR = 22  # (>>, x, k, R) is x / 2**k, rounding toward zero like /
+
+
+QUAD_OP_NAMES = ('', '=', '+', '-', '*', '/', 'uminus',
+                 AND, OR, NOT, EQUAL, NOT_EQUAL, LESS_EQUAL, GREATER_EQUAL, LESS, GREATER,
+                 'equal', 'jfalse', 'jtrue', 'jmp', 'jtab', '<<', '>>')
+
+Q_LABEL = int(QuadOp.LABEL)
+Q_ASSIGN = int(QuadOp.ASSIGN)
+Q_ADD = int(QuadOp.ADD)
+Q_SUB = int(QuadOp.SUB)
+Q_MUL = int(QuadOp.MUL)
+Q_DIV = int(QuadOp.DIV)
+Q_UMINUS = int(QuadOp.UMINUS)
+Q_AND = int(QuadOp.AND)
+Q_OR = int(QuadOp.OR)
+Q_NOT = int(QuadOp.NOT)
+Q_EQUAL = int(QuadOp.EQUAL)
+Q_NOT_EQUAL = int(QuadOp.NOT_EQUAL)
+Q_LESS_EQUAL = int(QuadOp.LESS_EQUAL)
+Q_GREATER_EQUAL = int(QuadOp.GREATER_EQUAL)
+Q_LESS = int(QuadOp.LESS)
+Q_GREATER = int(QuadOp.GREATER)
+Q_CASE_EQUAL = int(QuadOp.CASE_EQUAL)
+Q_JFALSE = int(QuadOp.JFALSE)
+Q_JTRUE = int(QuadOp.JTRUE)
+Q_JMP = int(QuadOp.JMP)
+Q_JTAB = int(QuadOp.JTAB)
+Q_SHL = int(QuadOp.SHL)
+Q_SHR = int(QuadOp.SHR)
+
+# opcodes of the BinOp and BoolOp operators, by token type
+ARITHMETIC_QUAD_OPS = {PLUS: Q_ADD, MINUS: Q_SUB, MULTIPLY: Q_MUL, DIVIDE: Q_DIV}
+BOOLEAN_QUAD_OPS = {AND: Q_AND, OR: Q_OR, NOT: Q_NOT, EQUAL: Q_EQUAL, NOT_EQUAL: Q_NOT_EQUAL,
+                    LESS_EQUAL: Q_LESS_EQUAL, GREATER_EQUAL: Q_GREATER_EQUAL,
+                    LESS: Q_LESS, GREATER: Q_GREATER}
+
+
+class OperandKind(IntEnum):
+    NONE = 0  # an unused operand field
+    CONST = 1  # an int, or TRUE or FALSE
+    VAR = 2  # a variable name
+    TEMP = 3  # the number n of register Rn
+    LABEL = 4  # the number n of label Ln
+
+
+O_NONE = int(OperandKind.NONE)
+O_CONST = int(OperandKind.CONST)
+O_VAR = int(OperandKind.VAR)
+O_TEMP = int(OperandKind.TEMP)
+O_LABEL = int(OperandKind.LABEL)
+
+# an encoded operand keeps its kind in the low bits
+OPERAND_KIND_BITS = 3
+OPERAND_KIND_MASK = (1 << OPERAND_KIND_BITS) - 1
+NO_OPERAND = O_NONE
+
+
+def format_operand(kind, value):
+    if kind == O_TEMP:
+        return 'R' + str(value)
+    elif kind == O_LABEL:
+        return 'L' + str(value)
+    elif kind == O_NONE:
+        return ''
+    return str(value)
+
+
+class Quad(tuple):
+    """One decoded quadruple, (op, arg1, arg2, result) with (kind, value) operands."""
+    __slots__ = ()
+    op = property(itemgetter(0))
+    arg1 = property(itemgetter(1))
+    arg2 = property(itemgetter(2))
+    result = property(itemgetter(3))
+
+    def __repr__(self):
+        if self[0] == Q_LABEL:
+            return format_operand(*self[1]) + ':'
+        return '({}, {}, {}, {})'.format(QUAD_OP_NAMES[self[0]], *(format_operand(*arg) for arg in self[1:]))
+
+
+class QuadBuffer(object):
+    """Quadruples held in one flat typed array.
+
+    Quad `i` is `code[4 * i:4 * i + 4]`, its opcode and the operands arg1,
+    arg2 and result in the order of the text listing. Jumps keep their
+    target label in arg1 and the condition in arg2, a LABEL quad only has
+    arg1. A jtab keeps the first and last labels of its table in arg1 and
+    result, and the index into it in arg2.
+
+    An operand is an int with its OperandKind in the low bits and above
+    them the number of a register or label, or the index of a variable
+    name or constant in `values`. NO_OPERAND, 0, is an unused field.
+    """
+
+    def __init__(self):
+        self.code = array('q')
+        self.values = []
+        self.value_index = {}
+        # the variables only declared const
+        self.const_names = set()
+
+    def __len__(self):
+        return len(self.code) >> 2
+
+    def derived(self):
+        """Return an empty buffer whose operands mean the same as in this one."""
+        quads = QuadBuffer()
+        quads.values = self.values
+        quads.value_index = self.value_index
+        quads.const_names = self.const_names
+        return quads
+
+    def emit(self, op, arg1=NO_OPERAND, arg2=NO_OPERAND, result=NO_OPERAND):
+        self.code.extend((op, arg1, arg2, result))
+
+    def intern(self, kind, value):
+        """Return the operand of a variable or constant."""
+        value_id = self.value_index.get(value)
+        if value_id is None:
+            value_id = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        return value_id << OPERAND_KIND_BITS | kind
+
+    def operand(self, operand):
+        """Return the (kind, value) pair an encoded operand stands for."""
+        kind = operand & OPERAND_KIND_MASK
+        if kind == O_CONST or kind == O_VAR:
+            return kind, self.values[operand >> OPERAND_KIND_BITS]
+        elif kind == O_NONE:
+            return kind, None
+        return kind, operand >> OPERAND_KIND_BITS
+
+    def __getitem__(self, index):
+        code = self.code
+        start = 4 * index if index >= 0 else len(code) + 4 * index
+        if not 0 <= start < len(code):
+            raise IndexError('quad index out of range')
+        operand = self.operand
+        return Quad((code[start], operand(code[start + 1]), operand(code[start + 2]), operand(code[start + 3])))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class OperandText(dict):
+    """Memo of the text of encoded operands; variables and constants repeat
+    a lot, registers are mostly used once and are not kept."""
+
+    def __init__(self, quads):
+        super(OperandText, self).__init__()
+        self.quads = quads
+
+    def __missing__(self, operand):
+        if operand & OPERAND_KIND_MASK == O_TEMP:
+            return 'R' + str(operand >> OPERAND_KIND_BITS)
+        text = self[operand] = format_operand(*self.quads.operand(operand))
+        return text
+
+
+def format_quad(text, quad):
+    """Return the listing line of a quad, `text` being an OperandText."""
+    op, arg1, arg2, result = quad
+    if op == Q_LABEL:
+        return text[arg1] + ':'
+    return '(' + QUAD_OP_NAMES[op] + ', ' + text[arg1] + ', ' + text[arg2] + ', ' + text[result] + ')'
+
+
+def format_quads(quads, block_size=1 << 13):
+    """Return the text listing of a QuadBuffer, one line per quad.
+
+    The lines are joined a block at a time, so only the lines of one
+    block are alive next to the text.
+    """
+    names = QUAD_OP_NAMES
+    text = OperandText(quads)
+    code = quads.code
+    blocks = []
+    for first in range(0, len(code), 4 * block_size):
+        lines = []
+        append = lines.append
+        fields = iter(code[first:first + 4 * block_size])
+        for op, arg1, arg2, result in zip(fields, fields, fields, fields):
+            if op == Q_LABEL:
+                append(text[arg1] + ':')
+            else:
+                append('(' + names[op] + ', ' + text[arg1] + ', ' + text[arg2] + ', ' + text[result] + ')')
+        append('')
+        blocks.append('\n'.join(lines))
+    return ''.join(blocks)
+
+
 ###############################################################################
 #                                                                             #
 #  INTERPRETER                                                                #
 #                                                                             #
 ###############################################################################
+# a switch with fewer cases is a chain of comparisons
+SWITCH_DISPATCH_MIN_CASES = 4
+# the least share of the values in their range that fills a jump table
+SWITCH_TABLE_DENSITY = 0.5
+# the cases a tree of comparisons tests one by one
+SWITCH_LINEAR_CASES = 3
+
+
+def case_value(case):
+    """Return the int of a case label, None for the default."""
+    if isinstance(case, Number):
+        return case.value
+    elif isinstance(case, UnaryOp):
+        return -case.expr.value
+    return None
+
+
+def assigned_names(nodes):
+    """Return the names of the variables stored to in the trees of `nodes`."""
+    names = set()
+    pending = list(nodes)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+        elif isinstance(node, AST):
+            if isinstance(node, (Assign, VarDecl)):
+                names.add(node.left.value)
+            pending.extend(node.arena.child_nodes(node.index))
+    return names
+
+
+def breaks_out(nodes):
+    """Return whether a break in the trees of `nodes` leaves the loop or
+    switch they are the body of, not one nested in them."""
+    pending = list(nodes)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+        elif isinstance(node, BreakStat):
+            return True
+        elif isinstance(node, AST) and not isinstance(node, (WhileStat, DoWhileStat, ForStat, SwitchStat)):
+            pending.extend(node.arena.child_nodes(node.index))
+    return False
+
+
+def expression_quads(node):
+    """Return the number of quads, each writing a register, evaluating an expression."""
+    total = 0
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (BinOp, BoolOp)):
+            total += 1
+            pending += [node.left, node.right]
+        elif isinstance(node, UnaryOp) and node.op.type != NOT:
+            total += node.op.type == MINUS
+            pending.append(node.expr)
+    return total
+
+
+def switch_values(node):
+    """Return the ints of the cases of a switch, None for the default, when
+    it can jump straight to the case of its value: it has enough cases, no
+    two alike, the default last and no case storing to the variable, which
+    the chain of comparisons would test again."""
+    values = [case_value(case) for case in node.case_stats]
+    cases = [value for value in values if value is not None]
+    if len(cases) < SWITCH_DISPATCH_MIN_CASES or len(set(cases)) < len(cases) or None in values[:-1]:
+        return None
+    if node.var.value in assigned_names(node.cmpd_stats):
+        return None
+    return values
+
+
 class Interpreter(NodeVisitor):
-    def __init__(self, tree, warn_file, error_file):
+    """Generates the quadruples of a tree into the QuadBuffer `quads`.
+
+    With `dispatch_switches` a switch of enough cases jumps straight to its
+    case, through a jtab when the values are dense and a tree of
+    comparisons when they are not, instead of testing every case in turn.
+    With `short_circuit` the conditions of the if and loop statements are
+    jumping code, their and, or and not going to the branch as soon as a
+    side decides it; `logical_quads` counts the and, or and not quads left
+    out and `saved_registers` the registers, against computing the value
+    of each condition.
+    """
+
+    def __init__(self, tree, context, dispatch_switches=False, short_circuit=False):
         self.tree = tree
         self.GLOBAL_SCOPE = OrderedDict()
-        self.error_file = error_file
-        self.warn_file = warn_file
+        self.context = context
+        self.quads = QuadBuffer()
+        # quads are appended straight to the buffer's array
+        self.code = self.quads.code
+        self.variable_names = set()
+        self.dispatch_switches = dispatch_switches
+        self.short_circuit = short_circuit
+        self.logical_quads = 0
+        self.saved_registers = 0
+        # the comparisons in short-circuit conditions, and those of them on
+        # the right of an and or or, which may be skipped
+        self.comparisons = 0
+        self.conditional_comparisons = 0
+        # the label a break jumps to in each loop and switch being
+        # generated, None where there is no break
+        self.breaks = []
 
     def visit_Program(self, node):
         for child in node.children:
-            self.visit(child)
+            yield child
+
+    def declare(self, var_name, is_const):
+        # a name also declared without const in some scope is no const
+        if not is_const:
+            self.variable_names.add(var_name)
+            self.quads.const_names.discard(var_name)
+        elif var_name not in self.variable_names:
+            self.quads.const_names.add(var_name)
 
     def visit_VarDecl(self, node):
         var_name = node.left.value
+        self.declare(var_name, node.isConst)
         if node.right:
-            value = self.visit(node.right)
+            value = yield node.right
             self.GLOBAL_SCOPE[var_name] = value
-            out_file.write("(=, " + str(value) + ", , " + str(var_name) + ")\n")
+            self.code.extend((Q_ASSIGN, value, NO_OPERAND, self.quads.intern(O_VAR, var_name)))
 
     def visit_Type(self, node):
         # Do nothing
         pass
 
     def visit_BinOp(self, node):
-        global register_id
-        if node.op.type == PLUS:
-            # value = self.visit(node.left) + self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(+, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
-            return destination_register
-        elif node.op.type == MINUS:
-            # value = self.visit(node.left) - self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(-, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
-            return destination_register
-        elif node.op.type == MULTIPLY:
-            # value = self.visit(node.left) * self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(*, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
-            return destination_register
-        elif node.op.type == DIVIDE:
-            # value = self.visit(node.left) / self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(/, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
+        op = ARITHMETIC_QUAD_OPS.get(node.op.type)
+        if op is not None:
+            # value = self.visit(node.left) <op> self.visit(node.right)
+            left_val = yield node.left
+            right_val = yield node.right
+            destination_register = self.context.new_register()
+            self.code.extend((op, left_val, right_val, destination_register))
             return destination_register
 
     def visit_Number(self, node):
-        return str(node.value)
+        return self.quads.intern(O_CONST, node.value)
 
     def visit_UnaryOp(self, node):
-        global register_id
         op = node.op.type
         if op == PLUS:
-            return '' + str(self.visit(node.expr))
+            return (yield node.expr)
         elif op == MINUS:
             # return '-' + str(self.visit(node.expr))
-            value = str(self.visit(node.expr))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(uminus, ' + value + ', , ' + destination_register + ')\n')
-            register_id = register_id + 1
+            value = yield node.expr
+            destination_register = self.context.new_register()
+            self.code.extend((Q_UMINUS, value, NO_OPERAND, destination_register))
             return destination_register
+        # a NOT with no operand, listed as None
+        return self.quads.intern(O_CONST, None)
 
     def visit_Compound(self, node):
         for child in node.children:
-            self.visit(child)
+            yield child
 
     def visit_Assign(self, node):
-        global register_id
         var_name = node.left.value
         # self.GLOBAL_SCOPE[var_name] = self.visit(node.right)
-        value = self.visit(node.right)
-
-        # out_file.write('(=, ' + str(var_name) + ', ' + str(self.visit(node.right)) + ', R' + str(register_id) + ')\n')
-        out_file.write("(=, " + str(value) + ", , " + str(var_name) + ")\n")
-        # register_id = register_id + 1
-        # return 'R' + str(register_id - 1)
+        value = yield node.right
+        self.code.extend((Q_ASSIGN, value, NO_OPERAND, self.quads.intern(O_VAR, var_name)))
 
     def visit_Var(self, node):
         var_name = node.value
         var_value = self.GLOBAL_SCOPE.get(var_name)
         if var_value is None:
-            self.error_file.write("Name Error {}\n".format(repr(var_name)))
+            self.context.error_file.write("Name Error {} at {}\n".format(repr(var_name), format_position(node.token)))
             raise NameError(repr(var_name))
         else:
-            return str(var_name)
+            return self.quads.intern(O_VAR, var_name)
 
     def visit_NoOp(self, node):
-        return ""
+        return NO_OPERAND
 
     def visit_Boolean(self, node):
-        return str(node.value)
+        return self.quads.intern(O_CONST, node.value)
 
     def visit_SwitchStat(self, node):
-        global register_id, label_id
-        v = str(node.var.value)
+        # made first, so the jfalse to the label made next in the chain
+        # still goes to the next case
+        self.breaks.append(self.context.new_label() if breaks_out(node.cmpd_stats) else None)
+        yield from self.switch(node)
+        self.end_breaks()
+
+    def switch(self, node):
+        v = self.quads.intern(O_VAR, node.var.value)
+        values = switch_values(node) if self.dispatch_switches else None
+        if values is not None:
+            labels, missed = self.dispatch_switch(v, values)
+            last_case = len(values) - 1 if values[-1] is not None else len(values) - 2
+            for i, cmpd in enumerate(node.cmpd_stats):
+                for label in labels[i]:
+                    self.code.extend((Q_LABEL, label, NO_OPERAND, NO_OPERAND))
+                yield cmpd
+                # on to the default, as no later case matches
+                if i < last_case:
+                    self.code.extend((Q_JMP, missed, NO_OPERAND, NO_OPERAND))
+            for label in labels[-1]:
+                self.code.extend((Q_LABEL, label, NO_OPERAND, NO_OPERAND))
+            return
         for i, case in enumerate(node.case_stats):
             cmpd = node.cmpd_stats[i]
-            my_label = label_id
-            label_id = label_id + 1
-            out_file.write('L' + str(my_label) + ':\n')
+            self.code.extend((Q_LABEL, self.context.new_label(), NO_OPERAND, NO_OPERAND))
             if not (str(case.value) == 'DEFAULT'):
-                destination_register = 'R' + str(register_id)
-                out_file.write('(equal, ' + v + ', ' + str(case.value) + ', ' + destination_register + ')\n')
-                register_id = register_id + 1
-                out_file.write('(jfalse, L' + str(label_id) + ', ' + destination_register + ', )\n')
-            self.visit(cmpd)
+                destination_register = self.context.new_register()
+                self.code.extend((Q_CASE_EQUAL, v, self.quads.intern(O_CONST, case.value), destination_register))
+                # to whichever label is made next
+                next_label = self.context.label_id << OPERAND_KIND_BITS | O_LABEL
+                self.code.extend((Q_JFALSE, next_label, destination_register, NO_OPERAND))
+            yield cmpd
+
+    def dispatch_switch(self, v, values):
+        """Emit the jump of a switch on the variable `v` to the case of its
+        value, `values` holding the int of each case and None for the default.
+
+        Returns the labels to put before each case, with one more list for
+        the end of the switch, and the label of the default, the end when
+        there is none.
+        """
+        # the first label is the head of the switch, as in the chain, where
+        # the last case of a chain before it jumps
+        self.code.extend((Q_LABEL, self.context.new_label(), NO_OPERAND, NO_OPERAND))
+        labels = [[] for _ in values] + [[]]
+        missed = self.context.new_label()
+        # the default is the last case, the end follows it
+        missed_labels = labels[-2] if values[-1] is None else labels[-1]
+        missed_labels.append(missed)
+        cases = sorted((value, i) for i, value in enumerate(values) if value is not None)
+        base, size = cases[0][0], cases[-1][0] - cases[0][0] + 1
+        if len(cases) >= SWITCH_TABLE_DENSITY * size:
+            table = self.context.new_labels(size)
+            for value, i in cases:
+                labels[i].append(table[value - base])
+            taken = set(value - base for value, _ in cases)
+            # the values without a case go where no case matches
+            missed_labels.extend(label for offset, label in enumerate(table) if offset not in taken)
+            index = v
+            if base != 0:
+                index = self.context.new_register()
+                self.code.extend((Q_SUB, v, self.quads.intern(O_CONST, base), index))
+            self.code.extend((Q_JTAB, table[0], index, table[-1]))
+            self.code.extend((Q_JMP, missed, NO_OPERAND, NO_OPERAND))
+        else:
+            for value, i in cases:
+                labels[i].append(self.context.new_label())
+            self.search_cases(v, [(value, labels[i][0]) for value, i in cases], missed)
+        for case_labels in labels:
+            case_labels.sort()
+        return labels, missed
+
+    def search_cases(self, v, cases, missed):
+        """Emit a balanced tree of comparisons jumping to the label of the
+        case of `v`, `cases` being sorted (value, label) pairs, or to `missed`."""
+        if len(cases) <= SWITCH_LINEAR_CASES:
+            for value, label in cases:
+                destination_register = self.context.new_register()
+                self.code.extend((Q_CASE_EQUAL, v, self.quads.intern(O_CONST, value), destination_register))
+                self.code.extend((Q_JTRUE, label, destination_register, NO_OPERAND))
+            self.code.extend((Q_JMP, missed, NO_OPERAND, NO_OPERAND))
+            return
+        middle = len(cases) // 2
+        lower = self.context.new_label()
+        destination_register = self.context.new_register()
+        self.code.extend((Q_LESS, v, self.quads.intern(O_CONST, cases[middle][0]), destination_register))
+        self.code.extend((Q_JTRUE, lower, destination_register, NO_OPERAND))
+        self.search_cases(v, cases[middle:], missed)
+        self.code.extend((Q_LABEL, lower, NO_OPERAND, NO_OPERAND))
+        self.search_cases(v, cases[:middle], missed)
+
+    def branch(self, node, sense, label):
+        """Emit the jump to `label` taken when the condition `node` is `sense`."""
+        if not self.short_circuit:
+            value = yield node
+            self.code.extend((Q_JTRUE if sense else Q_JFALSE, label, value, NO_OPERAND))
+            return
+        registers = self.context.register_id
+        yield from self.jump_on(node, sense, label, False)
+        # against the registers of computing the value of the condition
+        self.saved_registers += expression_quads(node) - (self.context.register_id - registers)
+
+    def jump_on(self, node, sense, label, conditional):
+        """Emit code jumping to `label` when the condition `node` is `sense`
+        and running on when it is not. An and, or or not is lowered to
+        jumps, so the right side of an and or or is only evaluated when the
+        left side does not decide; `conditional` tells that node is such a
+        right side."""
+        if isinstance(node, BoolOp):
+            op = node.op.type
+            if op == AND or op == OR:
+                self.logical_quads += 1
+                if (op == AND) == sense:
+                    # a left side against `sense` decides, past the right side
+                    decided = self.context.new_label()
+                    yield from self.jump_on(node.left, not sense, decided, conditional)
+                    yield from self.jump_on(node.right, sense, label, True)
+                    self.code.extend((Q_LABEL, decided, NO_OPERAND, NO_OPERAND))
+                else:
+                    yield from self.jump_on(node.left, sense, label, conditional)
+                    yield from self.jump_on(node.right, sense, label, True)
+                return
+            elif op == NOT:
+                self.logical_quads += 1
+                # a NOT between two terms negates the right one
+                yield from self.jump_on(node.right, not sense, label, conditional)
+                return
+            self.comparisons += 1
+            self.conditional_comparisons += conditional
+        elif isinstance(node, Boolean):
+            if (node.value == TRUE) == sense:
+                self.code.extend((Q_JMP, label, NO_OPERAND, NO_OPERAND))
+            return
+        value = yield node
+        self.code.extend((Q_JTRUE if sense else Q_JFALSE, label, value, NO_OPERAND))
 
     def visit_IfStat(self, node):
-        global register_id, label_id
-        value = str(self.visit(node.expr))
-        my_label = label_id
-        label_id = label_id + 1
-        out_file.write('(jfalse, L' + str(my_label) + ', ' + value + ', )\n')
-        value = str(self.visit(node.cmpd1))
+        my_label = self.context.new_label()
+        yield from self.branch(node.expr, False, my_label)
+        yield node.cmpd1
         if node.cmpd2 is not None:
-            my_label = label_id
-            label_id = label_id + 1
-            out_file.write('(jmp, L' + str(my_label) + ', , )\n')
-            value = str(self.visit(node.cmpd1))
-        out_file.write('L' + str(my_label) + ':\n')
+            my_label = self.context.new_label()
+            self.code.extend((Q_JMP, my_label, NO_OPERAND, NO_OPERAND))
+            yield node.cmpd1
+        self.code.extend((Q_LABEL, my_label, NO_OPERAND, NO_OPERAND))
 
     def visit_WhileStat(self, node):
-        global register_id, label_id
-        my_label1 = label_id
-        label_id = label_id + 1
-        out_file.write('L' + str(my_label1) + ':\n')
-        cond = str(self.visit(node.expr))
-        my_label2 = label_id
-        label_id = label_id + 1
-        out_file.write('(jfalse, L' + str(my_label2) + ', ' + cond + ', )\n')
-        val = str(self.visit(node.cmpd1))
-        out_file.write('(jmp, L' + str(my_label1) + ', , )\n')
-        out_file.write('L' + str(my_label2) + ':\n')
+        my_label1 = self.context.new_label()
+        self.code.extend((Q_LABEL, my_label1, NO_OPERAND, NO_OPERAND))
+        my_label2 = self.context.new_label()
+        yield from self.branch(node.expr, False, my_label2)
+        self.breaks.append(my_label2)
+        yield node.cmpd1
+        self.breaks.pop()
+        self.code.extend((Q_JMP, my_label1, NO_OPERAND, NO_OPERAND))
+        self.code.extend((Q_LABEL, my_label2, NO_OPERAND, NO_OPERAND))
 
     def visit_DoWhileStat(self, node):
-        global register_id, label_id
-        my_label1 = label_id
-        label_id = label_id + 1
-        out_file.write('L' + str(my_label1) + ':\n')
-        cond = str(self.visit(node.cmpd1))
-        # my_label2 = label_id
-        # label_id = label_id + 1
-        # out_file.write('(jfalse, L' + str(my_label2) + ', ' + cond + ', )\n')
-        val = str(self.visit(node.expr))
-        out_file.write('(jtrue, L' + str(my_label1) + ', ' + val + ', )\n')
+        my_label1 = self.context.new_label()
+        self.code.extend((Q_LABEL, my_label1, NO_OPERAND, NO_OPERAND))
+        self.breaks.append(self.context.new_label() if breaks_out([node.cmpd1]) else None)
+        yield node.cmpd1
+        yield from self.branch(node.expr, True, my_label1)
+        self.end_breaks()
 
     def visit_BoolOp(self, node):
-        global register_id
-        left_val = str(self.visit(node.left))
-        right_val = str(self.visit(node.right))
-        destination_register = 'R' + str(register_id)
-        out_file.write(
-            '(' + str(node.op.type) + ', ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-        register_id = register_id + 1
+        left_val = yield node.left
+        right_val = yield node.right
+        destination_register = self.context.new_register()
+        self.code.extend((BOOLEAN_QUAD_OPS[node.op.type], left_val, right_val, destination_register))
         return destination_register
 
     def visit_ForStat(self, node):
-        global register_id, label_id
-        value = str(self.visit(node.init))
-        my_label1 = label_id
-        label_id = label_id + 1
-        out_file.write('L' + str(my_label1) + ':\n')
-        cond = str(self.visit(node.middle))
-        my_label2 = label_id
-        label_id = label_id + 1
-        out_file.write('(jfalse, L' + str(my_label2) + ', ' + cond + ', )\n')
-        cmpd = str(self.visit(node.cmpd_stat))
-        it = str(self.visit(node.end))
-        out_file.write('(jmp, L' + str(my_label1) + ', , )\n')
-        out_file.write('L' + str(my_label2) + ':\n')
+        yield node.init
+        my_label1 = self.context.new_label()
+        self.code.extend((Q_LABEL, my_label1, NO_OPERAND, NO_OPERAND))
+        my_label2 = self.context.new_label()
+        yield from self.branch(node.middle, False, my_label2)
+        self.breaks.append(my_label2)
+        yield node.cmpd_stat
+        self.breaks.pop()
+        yield node.end
+        self.code.extend((Q_JMP, my_label1, NO_OPERAND, NO_OPERAND))
+        self.code.extend((Q_LABEL, my_label2, NO_OPERAND, NO_OPERAND))
 
     def visit_BreakStat(self, node):
-        pass
+        self.code.extend((Q_JMP, self.breaks[-1], NO_OPERAND, NO_OPERAND))
+
+    def end_breaks(self):
+        """Close the loop or switch a break may leave, placing its label."""
+        label = self.breaks.pop()
+        if label is not None:
+            self.code.extend((Q_LABEL, label, NO_OPERAND, NO_OPERAND))
 
     def interpret(self):
         tree = self.tree
@@ -1349,30 +3044,3673 @@ class Interpreter(NodeVisitor):
             return ''
         return self.visit(tree)
 
+    def short_circuit_report(self):
+        return 'short-circuit: {} and/or/not quads and {} registers saved, {} of {} comparisons only run ' \
+               'when needed'.format(self.logical_quads, self.saved_registers, self.conditional_comparisons,
+                                    self.comparisons)
+
+
+###############################################################################
+#                                                                             #
+#  CONTROL FLOW                                                               #
+#                                                                             #
+###############################################################################
+JUMP_QUAD_OPS = frozenset((Q_JMP, Q_JFALSE, Q_JTRUE, Q_JTAB))
+
+
+def jump_labels(quad):
+    """Return the labels a jump quad can go to, the run of labels from
+    arg1 to result for a jtab."""
+    if quad[0] == Q_JTAB:
+        return range(quad[1], quad[3] + 1, 1 << OPERAND_KIND_BITS)
+    return (quad[1],)
+
+
+def unresolved_labels(listing):
+    """Return the sorted labels the jumps of a list of quads go to that
+    no label quad places."""
+    placed = set(quad[1] for quad in listing if quad[0] == Q_LABEL)
+    return sorted(set(label for quad in listing if quad[0] in JUMP_QUAD_OPS for label in jump_labels(quad)) - placed)
+
+
+def quad_list(quads):
+    """Return the quads of a QuadBuffer as a list of (op, arg1, arg2, result)."""
+    fields = iter(quads.code)
+    return list(zip(fields, fields, fields, fields))
+
+
+def split_blocks(listing):
+    """Split a list of quads into basic blocks, lists of quads that start
+    at a label or after a jump and end at a jump or before a label."""
+    blocks = []
+    block = []
+    for quad in listing:
+        if quad[0] == Q_LABEL and block:
+            blocks.append(block)
+            block = []
+        block.append(quad)
+        if quad[0] in JUMP_QUAD_OPS:
+            blocks.append(block)
+            block = []
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+class ControlFlowGraph(object):
+    """The basic blocks of a quad listing and the jumps between them.
+
+    `blocks[i]` is the list of quads of block i, block 0 is the entry.
+    `successors[i]` and `predecessors[i]` hold block indexes and `exits`
+    the blocks that can leave the program, by running off its end or by
+    jumping to a label that is not in the listing.
+    """
+
+    def __init__(self, listing):
+        self.blocks = blocks = split_blocks(listing)
+        starts = dict((block[0][1], index) for index, block in enumerate(blocks) if block[0][0] == Q_LABEL)
+        end = len(blocks)
+        successors = self.successors = []
+        predecessors = self.predecessors = [[] for _ in blocks]
+        exits = self.exits = set()
+        for index, block in enumerate(blocks):
+            op, target = block[-1][:2]
+            if op == Q_JMP:
+                targets = [starts.get(target, end)]
+            elif op == Q_JFALSE or op == Q_JTRUE:
+                targets = [starts.get(target, end)]
+                if targets[0] != index + 1:
+                    targets.append(index + 1)
+            elif op == Q_JTAB:
+                # an index out of the table runs on
+                targets = []
+                for successor in [starts.get(label, end) for label in jump_labels(block[-1])] + [index + 1]:
+                    if successor not in targets:
+                        targets.append(successor)
+            else:
+                targets = [index + 1]
+            if end in targets:
+                exits.add(index)
+                targets.remove(end)
+            successors.append(targets)
+            for successor in targets:
+                predecessors[successor].append(index)
+        self._dominance = None
+
+    @classmethod
+    def from_quads(cls, quads):
+        return cls(quad_list(quads))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def listing(self, indexes=None):
+        """Return the quads of the blocks `indexes`, all of them by default, in one list."""
+        blocks = self.blocks
+        if indexes is None:
+            indexes = range(len(blocks))
+        return [quad for index in indexes for quad in blocks[index]]
+
+    def postorder(self):
+        """Return the blocks reached from the entry, each after all the
+        blocks it reaches first on a depth-first walk."""
+        order = []
+        if not self.blocks:
+            return order
+        successors = self.successors
+        seen = {0}
+        stack = [(0, iter(successors[0]))]
+        while stack:
+            index, following = stack[-1]
+            for successor in following:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append((successor, iter(successors[successor])))
+                    break
+            else:
+                stack.pop()
+                order.append(index)
+        return order
+
+    def reachable(self):
+        return set(self.postorder())
+
+    def immediate_dominators(self):
+        """Return the immediate dominator of each block, None for the
+        blocks that are not reached and the entry for itself.
+
+        This is the iterative algorithm of Cooper, Harvey and Kennedy, which
+        only keeps one index per block.
+        """
+        order = self.postorder()
+        number = dict((index, position) for position, index in enumerate(order))
+        dominators = [None] * len(self.blocks)
+        if not order:
+            return dominators
+        dominators[0] = 0
+        predecessors = self.predecessors
+
+        def intersect(first, second):
+            while first != second:
+                while number[first] < number[second]:
+                    first = dominators[first]
+                while number[second] < number[first]:
+                    second = dominators[second]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for index in reversed(order[:-1]):
+                dominator = None
+                for predecessor in predecessors[index]:
+                    if dominators[predecessor] is not None:
+                        dominator = predecessor if dominator is None else intersect(predecessor, dominator)
+                if dominators[index] != dominator:
+                    dominators[index] = dominator
+                    changed = True
+        return dominators
+
+    def dominates(self, first, second):
+        """Whether every path from the entry to block `second` goes through block `first`."""
+        if self._dominance is None:
+            self._dominance = self._number_dominator_tree()
+        entered, left = self._dominance
+        if entered[first] is None or entered[second] is None:
+            return False
+        return entered[first] <= entered[second] and left[second] <= left[first]
+
+    def _number_dominator_tree(self):
+        # numbers each block on entering and leaving it on a walk of the
+        # dominator tree, a block dominates the ones numbered inside it
+        dominators = self.immediate_dominators()
+        children = [[] for _ in self.blocks]
+        for index, dominator in enumerate(dominators):
+            if dominator is not None and index != 0:
+                children[dominator].append(index)
+        entered = [None] * len(self.blocks)
+        left = [None] * len(self.blocks)
+        if not self.blocks:
+            return entered, left
+        clock = count()
+        entered[0] = next(clock)
+        stack = [(0, iter(children[0]))]
+        while stack:
+            index, following = stack[-1]
+            for child in following:
+                entered[child] = next(clock)
+                stack.append((child, iter(children[child])))
+                break
+            else:
+                stack.pop()
+                left[index] = next(clock)
+        return entered, left
+
+    def back_edges(self):
+        """Return the (block, header) jumps to a block that dominates the jumping one."""
+        return [(index, successor) for index in range(len(self.blocks))
+                for successor in self.successors[index] if self.dominates(successor, index)]
+
+    def natural_loops(self):
+        """Return {header: set of blocks} of the natural loops, the loops of
+        back edges to one header taken together."""
+        loops = OrderedDict()
+        for tail, header in self.back_edges():
+            body = loops.setdefault(header, {header})
+            pending = [tail]
+            while pending:
+                index = pending.pop()
+                if index not in body:
+                    body.add(index)
+                    pending.extend(self.predecessors[index])
+        return loops
+
+
+def solve_dataflow(cfg, transfer, forward=True, meet=or_, boundary=0, initial=0):
+    """Solve a dataflow problem whose values are bit-vectors held in ints.
+
+    `transfer(index, value)` takes the value on one side of block `index`
+    to the other side, in the direction of the flow. The value coming
+    into a block is the `meet` of its neighbours', and `boundary` comes in
+    at the entry, or at the exits when going backward. Every value starts
+    as `initial`, 0 for a union, all ones for an intersection.
+
+    Returns the lists of the values at the start and at the end of each
+    block.
+    """
+    size = len(cfg.blocks)
+    starts = [initial] * size
+    ends = [initial] * size
+    if forward:
+        before, after, sources, targets = starts, ends, cfg.predecessors, cfg.successors
+        edges = set([0]) if size else set()
+    else:
+        before, after, sources, targets = ends, starts, cfg.successors, cfg.predecessors
+        edges = cfg.exits
+    # the blocks to visit, the next one last; the listing order is close
+    # to the order of the flow in the code of structured statements
+    pending = list(range(size - 1, -1, -1) if forward else range(size))
+    queued = set(pending)
+    while pending:
+        index = pending.pop()
+        queued.discard(index)
+        value = boundary if index in edges else None
+        for source in sources[index]:
+            value = after[source] if value is None else meet(value, after[source])
+        before[index] = initial if value is None else value
+        value = transfer(index, before[index])
+        if value != after[index]:
+            after[index] = value
+            for target in targets[index]:
+                if target not in queued:
+                    queued.add(target)
+                    pending.append(target)
+    return starts, ends
+
+
+def operand_bits(cfg):
+    """Give a bit to every variable and to the registers read outside the
+    block writing them; the other registers never live past their block."""
+    bits = {}
+    home = {}
+    for index, block in enumerate(cfg.blocks):
+        for quad in block:
+            for operand in quad[1:]:
+                kind = operand & OPERAND_KIND_MASK
+                if kind == O_VAR:
+                    if operand not in bits:
+                        bits[operand] = 1 << len(bits)
+                elif kind == O_TEMP and operand not in bits:
+                    if home.setdefault(operand, index) != index:
+                        bits[operand] = 1 << len(bits)
+    return bits
+
+
+def live_operands(cfg, bits, exit_bits=0):
+    """Return the operands of `bits` live at the start and at the end of
+    each block, `exit_bits` being read when the program ends."""
+    gens = []
+    kills = []
+    for block in cfg.blocks:
+        gen = kill = 0
+        for op, arg1, arg2, result in reversed(block):
+            if op == Q_LABEL:
+                continue
+            if op not in JUMP_QUAD_OPS:
+                bit = bits.get(result, 0)
+                kill |= bit
+                gen &= ~bit
+            gen |= bits.get(arg1, 0) | bits.get(arg2, 0)
+        gens.append(gen)
+        kills.append(kill)
+    return solve_dataflow(cfg, lambda index, live: gens[index] | (live & ~kills[index]),
+                          forward=False, boundary=exit_bits)
+
+
+def reaching_definitions(cfg):
+    """Return the stores to variables, as (block, position) pairs, and for
+    each block the bit-vectors of the stores reaching its start and end."""
+    definitions = []
+    # variable -> the bits of all its stores
+    stores = {}
+    block_stores = []
+    for index, block in enumerate(cfg.blocks):
+        last = {}
+        for position, (op, arg1, arg2, result) in enumerate(block):
+            if op != Q_LABEL and op not in JUMP_QUAD_OPS and result & OPERAND_KIND_MASK == O_VAR:
+                bit = 1 << len(definitions)
+                definitions.append((index, position))
+                stores[result] = stores.get(result, 0) | bit
+                last[result] = bit
+        block_stores.append(last)
+    gens = []
+    kills = []
+    for last in block_stores:
+        gen = kill = 0
+        for variable, bit in last.items():
+            gen |= bit
+            kill |= stores[variable]
+        gens.append(gen)
+        kills.append(kill)
+    starts, ends = solve_dataflow(cfg, lambda index, reaching: gens[index] | (reaching & ~kills[index]))
+    return definitions, starts, ends
+
+
+def cfg_dot(quads):
+    """Return the control flow graph of a QuadBuffer in the DOT language.
+
+    Loop headers have a double border and the jumps back to them are
+    dashed.
+    """
+    cfg = ControlFlowGraph.from_quads(quads)
+    text = OperandText(quads)
+    headers = cfg.natural_loops()
+    back_edges = set(cfg.back_edges())
+    lines = ['digraph cfg {', '    node [shape=box, fontname="monospace"];']
+    for index, block in enumerate(cfg.blocks):
+        label = ''.join(format_quad(text, quad) + '\\l' for quad in block)
+        lines.append('    B{0} [label="B{0}\\l{1}"{2}];'.format(index, label, ', peripheries=2' if index in headers else ''))
+    for index, successors in enumerate(cfg.successors):
+        for successor in successors:
+            lines.append('    B{} -> B{}{};'.format(index, successor,
+                                                    ' [style=dashed]' if (index, successor) in back_edges else ''))
+    if cfg.blocks:
+        lines.append('    start [shape=point];')
+        lines.append('    start -> B0;')
+    for index in sorted(cfg.exits):
+        lines.append('    B{} -> end;'.format(index))
+    lines.append('    end [shape=point];')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
 
-def main():
-    global newLine_pos
-    import sys
-    warn_file = open("warns.txt", 'w')
-    error_file = open("errors.txt", 'w')
-    text = open(sys.argv[1], 'r').read()
-    # text = open('part10.pas', 'r').read()
-    newLine_pos = locations_of_substring(text, '\n')
-    lexer = Lexer(text, warn_file, error_file)
-    parser = Parser(lexer, warn_file, error_file)
-    tree = parser.parse()
-    semantic_analyzer = SemanticAnalyzer(warn_file, error_file)
 
+###############################################################################
+#                                                                             #
+#  OPTIMIZER                                                                  #
+#                                                                             #
+###############################################################################
+def truncating_divide(a, b):
+    """Integer division rounding toward zero, as in C."""
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def truncating_shift(a, k):
+    """a / 2**k rounding toward zero, the shift a division by a power of two becomes."""
+    return a >> k if a >= 0 else -(-a >> k)
+
+
+def boolean_constant(value):
+    return TRUE if value else FALSE
+
+
+# how the quads of two int constants are evaluated
+ARITHMETIC_FOLDS = {
+    Q_ADD: lambda a, b: a + b,
+    Q_SUB: lambda a, b: a - b,
+    Q_MUL: lambda a, b: a * b,
+    Q_DIV: truncating_divide,
+    Q_SHL: lambda a, k: a << k,
+    Q_SHR: truncating_shift,
+}
+COMPARISON_FOLDS = {
+    Q_EQUAL: lambda a, b: boolean_constant(a == b),
+    Q_CASE_EQUAL: lambda a, b: boolean_constant(a == b),
+    Q_NOT_EQUAL: lambda a, b: boolean_constant(a != b),
+    Q_LESS_EQUAL: lambda a, b: boolean_constant(a <= b),
+    Q_GREATER_EQUAL: lambda a, b: boolean_constant(a >= b),
+    Q_LESS: lambda a, b: boolean_constant(a < b),
+    Q_GREATER: lambda a, b: boolean_constant(a > b),
+}
+LOGICAL_FOLDS = {
+    Q_AND: lambda a, b: boolean_constant(a == TRUE and b == TRUE),
+    Q_OR: lambda a, b: boolean_constant(a == TRUE or b == TRUE),
+}
+
+# opcodes that only compute their result register
+PURE_QUAD_OPS = frozenset(ARITHMETIC_FOLDS) | frozenset(COMPARISON_FOLDS) | frozenset(LOGICAL_FOLDS) \
+    | frozenset((Q_UMINUS, Q_NOT))
+
+
+def fold_constants(quads):
+    """Return a QuadBuffer with the constant parts of `quads` computed.
+
+    Quads of constants are evaluated, and the reads of a const variable
+    that is stored once, with a constant, use that constant. Identities
+    like x + 0, x * 1, x * 0 and - - x are applied and the constants of a
+    chain of additions or multiplications on one operand are gathered, so
+    1 + x + 2 becomes x + 3. A jfalse or jtrue on a constant becomes a jmp
+    or is dropped. Registers that are no longer read are not computed.
+    """
+    inlined = {}
+    while True:
+        folded, stores = _fold_quads(quads, inlined)
+        constants = {}
+        for var, stored in stores.items():
+            if len(stored) == 1 and stored[0] & OPERAND_KIND_MASK == O_CONST \
+                    and quads.values[var >> OPERAND_KIND_BITS] in quads.const_names:
+                constants[var] = stored[0]
+        # a const set from other consts is only known after they are inlined
+        if constants == inlined:
+            return _drop_unused_registers(folded)
+        inlined = constants
+
+
+def _fold_quads(quads, inlined):
+    """One folding pass, reading the variables of `inlined` as constants.
+
+    Returns the new buffer and the operands stored to each variable.
+    """
+    values = quads.values
+    intern = quads.intern
+    folded = quads.derived()
+    emit = folded.code.extend
+    # what an operand is replaced by
+    same = dict(inlined)
+    # register -> (operand, offset) for a register holding operand + offset
+    sums = {}
+    # register -> (operand, factor) for a register holding operand * factor
+    products = {}
+    # register -> operand, for a register holding - operand
+    negations = {}
+    # registers holding TRUE or FALSE
+    booleans = set()
+    stores = {}
+
+    def constant(operand):
+        if operand & OPERAND_KIND_MASK == O_CONST:
+            return values[operand >> OPERAND_KIND_BITS]
+        return None
+
+    def number(operand):
+        value = constant(operand)
+        return value if type(value) is int else None
+
+    def add(base, offset, result):
+        # emits result = base + offset
+        if offset == 0:
+            same[result] = base
+        else:
+            if offset > 0:
+                emit((Q_ADD, base, intern(O_CONST, offset), result))
+            else:
+                emit((Q_SUB, base, intern(O_CONST, -offset), result))
+            sums[result] = base, offset
+
+    def multiply(base, factor, result):
+        # emits result = base * factor
+        if factor == 0:
+            same[result] = intern(O_CONST, 0)
+        elif factor == 1:
+            same[result] = base
+        else:
+            emit((Q_MUL, base, intern(O_CONST, factor), result))
+            products[result] = base, factor
+
+    fields = iter(quads.code)
+    for op, arg1, arg2, result in zip(fields, fields, fields, fields):
+        arg1 = same.get(arg1, arg1)
+        arg2 = same.get(arg2, arg2)
+        if op == Q_JFALSE or op == Q_JTRUE:
+            condition = constant(arg2)
+            if condition == TRUE or condition == FALSE:
+                if (condition == TRUE) == (op == Q_JTRUE):
+                    emit((Q_JMP, arg1, NO_OPERAND, NO_OPERAND))
+                continue
+        elif op == Q_JTAB:
+            index = number(arg2)
+            if index is not None:
+                labels = jump_labels((op, arg1, arg2, result))
+                if 0 <= index < len(labels):
+                    emit((Q_JMP, labels[index], NO_OPERAND, NO_OPERAND))
+                continue
+        elif op == Q_ASSIGN:
+            stores.setdefault(result, []).append(arg1)
+        elif op in ARITHMETIC_FOLDS:
+            a, b = number(arg1), number(arg2)
+            if a is not None and b is not None and not (op == Q_DIV and b == 0) \
+                    and not ((op == Q_SHL or op == Q_SHR) and b < 0):
+                same[result] = intern(O_CONST, ARITHMETIC_FOLDS[op](a, b))
+                continue
+            if op == Q_ADD or op == Q_SUB:
+                if b is not None:
+                    base, offset = sums.get(arg1, (arg1, 0))
+                    add(base, offset + b if op == Q_ADD else offset - b, result)
+                    continue
+                if a is not None:
+                    base, offset = sums.get(arg2, (arg2, 0))
+                    if op == Q_ADD:
+                        add(base, a + offset, result)
+                        continue
+                    if arg2 in sums:
+                        # k - (x + c) is (k - c) - x
+                        emit((Q_SUB, intern(O_CONST, a - offset), base, result))
+                        continue
+            elif op == Q_MUL:
+                if a is not None or b is not None:
+                    factor, operand = (a, arg2) if a is not None else (b, arg1)
+                    base, inner = products.get(operand, (operand, 1))
+                    multiply(base, inner * factor, result)
+                    continue
+            elif op == Q_DIV and b == 1:
+                same[result] = arg1
+                continue
+        elif op in COMPARISON_FOLDS:
+            a, b = number(arg1), number(arg2)
+            if a is not None and b is not None:
+                same[result] = intern(O_CONST, COMPARISON_FOLDS[op](a, b))
+                continue
+            booleans.add(result)
+        elif op in LOGICAL_FOLDS:
+            a, b = constant(arg1), constant(arg2)
+            if a in (TRUE, FALSE) and b in (TRUE, FALSE):
+                same[result] = intern(O_CONST, LOGICAL_FOLDS[op](a, b))
+                continue
+            # the operand that decides the result on its own, and the one
+            # the result takes otherwise
+            absorbing, neutral = (FALSE, TRUE) if op == Q_AND else (TRUE, FALSE)
+            if a == absorbing or b == absorbing:
+                same[result] = intern(O_CONST, absorbing)
+                continue
+            if a == neutral and arg2 in booleans:
+                same[result] = arg2
+                continue
+            if b == neutral and arg1 in booleans:
+                same[result] = arg1
+                continue
+            booleans.add(result)
+        elif op == Q_UMINUS:
+            a = number(arg1)
+            if a is not None:
+                same[result] = intern(O_CONST, -a)
+                continue
+            if arg1 in negations:
+                same[result] = negations[arg1]
+                continue
+            negations[result] = arg1
+        emit((op, arg1, arg2, result))
+    return folded, stores
+
+
+def _drop_unused_registers(quads):
+    """Return `quads` without the quads computing registers nobody reads."""
+    code = quads.code
+    reads = {}
+    for index in range(0, len(code), 4):
+        for operand in (code[index + 1], code[index + 2]):
+            if operand & OPERAND_KIND_MASK == O_TEMP:
+                reads[operand] = reads.get(operand, 0) + 1
+    # a register is written before it is read, so going backward all of
+    # its reads are counted when its quad is reached
+    kept = []
+    for index in range(len(code) - 4, -1, -4):
+        quad = code[index:index + 4]
+        op, arg1, arg2, result = quad
+        if op in PURE_QUAD_OPS and result & OPERAND_KIND_MASK == O_TEMP and not reads.get(result):
+            for operand in (arg1, arg2):
+                if operand in reads:
+                    reads[operand] -= 1
+            continue
+        kept.append(quad)
+    pruned = quads.derived()
+    for quad in reversed(kept):
+        pruned.code.extend(quad)
+    return pruned
+
+
+def _drop_unreachable(listing):
+    """Drop the blocks no path from the start reaches, the jumps to the
+    quad that follows anyway and the labels nothing jumps to."""
+    cfg = ControlFlowGraph(listing)
+    listing = cfg.listing(sorted(cfg.reachable()))
+    kept = []
+    for index, quad in enumerate(listing):
+        if quad[0] in JUMP_QUAD_OPS and quad[0] != Q_JTAB:
+            following = index + 1
+            while following < len(listing) and listing[following][0] == Q_LABEL \
+                    and listing[following][1] != quad[1]:
+                following += 1
+            if following < len(listing) and listing[following] == (Q_LABEL, quad[1], NO_OPERAND, NO_OPERAND):
+                continue
+        kept.append(quad)
+    targets = set(label for quad in kept if quad[0] in JUMP_QUAD_OPS for label in jump_labels(quad))
+    return [quad for quad in kept if quad[0] != Q_LABEL or quad[1] in targets]
+
+
+def _live_quads(block, live, bits, kept=None, following=None):
+    """Go back over a block from the operands `live` after it and return
+    those live before it, appending the quads that matter to `kept`.
+
+    A quad matters when it jumps or something later reads its result; only
+    the operands of those count as read. When `kept` is given, `following`
+    holds the labels right after the kept quads, and a jump to one of them
+    is dropped as well.
+    """
+    # the registers of the block read later in it
+    local = set()
+    for quad in reversed(block):
+        op, arg1, arg2, result = quad
+        if kept is not None:
+            if op == Q_LABEL:
+                following.add(arg1)
+                kept.append(quad)
+                continue
+            if op in JUMP_QUAD_OPS and op != Q_JTAB and arg1 in following:
+                continue
+        if op != Q_LABEL and op not in JUMP_QUAD_OPS:
+            bit = bits.get(result)
+            if bit is None:
+                if result not in local:
+                    continue
+                local.discard(result)
+            elif not live & bit:
+                continue
+            else:
+                live &= ~bit
+        for operand in (arg1, arg2):
+            bit = bits.get(operand)
+            if bit is not None:
+                live |= bit
+            elif operand & OPERAND_KIND_MASK == O_TEMP:
+                local.add(operand)
+        if kept is not None:
+            following.clear()
+            kept.append(quad)
+    return live
+
+
+def _drop_dead_stores(listing, exit_live):
+    """Drop the quads whose result is not read before it is written again
+    or the program ends, by the liveness of the operands."""
+    cfg = ControlFlowGraph(listing)
+    bits = operand_bits(cfg)
+    exit_bits = 0
+    if exit_live:
+        for operand, bit in bits.items():
+            if operand & OPERAND_KIND_MASK == O_VAR:
+                exit_bits |= bit
+    blocks = cfg.blocks
+    _, live_out = solve_dataflow(cfg, lambda index, live: _live_quads(blocks[index], live, bits),
+                                 forward=False, boundary=exit_bits)
+    kept = []
+    following = set()
+    for index in range(len(blocks) - 1, -1, -1):
+        _live_quads(blocks[index], live_out[index], bits, kept, following)
+    kept.reverse()
+    return kept
+
+
+def eliminate_dead_code(quads, exit_live=True):
+    """Return a QuadBuffer without the quads of `quads` that cannot matter.
+
+    These are the blocks that are never reached, the jumps to the next quad,
+    the labels nothing jumps to and the stores, to variables and registers,
+    whose value is never read. The variables are read at the end of the
+    program unless `exit_live` is false. A jfalse or jtrue to a label that
+    is not in the listing, the last case of a switch, ends the program.
+    """
+    listing = quad_list(quads)
+    while True:
+        size = len(listing)
+        listing = _drop_dead_stores(_drop_unreachable(listing), exit_live)
+        if len(listing) == size:
+            break
+    pruned = quads.derived()
+    pruned.code = array('q', [field for quad in listing for field in quad])
+    return pruned
+
+
+# operand order does not matter to these
+COMMUTATIVE_QUAD_OPS = frozenset((Q_ADD, Q_MUL, Q_AND, Q_OR, Q_EQUAL, Q_NOT_EQUAL, Q_CASE_EQUAL))
+
+
+def registers_read_outside(blocks):
+    """Return the registers read in another block than the one writing them."""
+    home = {}
+    escaping = set()
+    for index, block in enumerate(blocks):
+        for quad in block:
+            for operand in quad[1:]:
+                if operand & OPERAND_KIND_MASK == O_TEMP and home.setdefault(operand, index) != index:
+                    escaping.add(operand)
+    return escaping
+
+
+def number_values(quads):
+    """Return a QuadBuffer computing each value once per basic block.
+
+    Local value numbering: the operands of a block get numbers, equal when
+    they hold the same value, and a quad whose op and operand numbers were
+    seen before reads the register computed then. A variable stored to
+    takes the number of the stored value, so a reassigned variable does not
+    match the expressions of its old value.
+    """
+    blocks = split_blocks(quad_list(quads))
+    escaping = registers_read_outside(blocks)
+    kept = []
+    for block in blocks:
+        fresh = count()
+        numbers = {}
+        # (op, number, number) -> the register holding it, and back
+        computed = {}
+        held = {}
+        # register -> the earlier register it is replaced with
+        same = {}
+
+        def number(operand):
+            value = numbers.get(operand)
+            if value is None:
+                value = numbers[operand] = next(fresh)
+            return value
+
+        for op, arg1, arg2, result in block:
+            arg1 = same.get(arg1, arg1)
+            arg2 = same.get(arg2, arg2)
+            if op in PURE_QUAD_OPS:
+                left, right = number(arg1), number(arg2)
+                if op in COMMUTATIVE_QUAD_OPS and left > right:
+                    left, right = right, left
+                key = op, left, right
+                holder = computed.get(key)
+                if holder is not None and result & OPERAND_KIND_MASK == O_TEMP and result not in escaping:
+                    same[result] = holder
+                    continue
+                numbers[result] = next(fresh)
+            elif op == Q_ASSIGN:
+                numbers[result] = number(arg1)
+            # a rewritten register no longer holds what it was kept for
+            if held.get(result) is not None:
+                del computed[held.pop(result)]
+            if op in PURE_QUAD_OPS and result & OPERAND_KIND_MASK == O_TEMP:
+                computed[key] = result
+                held[result] = key
+            kept.append((op, arg1, arg2, result))
+    numbered = quads.derived()
+    numbered.code = array('q', [field for quad in kept for field in quad])
+    return numbered
+
+
+def label_operands(listing):
+    """Return the labels a list of quads places or jumps to."""
+    labels = set()
+    for quad in listing:
+        if quad[0] == Q_LABEL:
+            labels.add(quad[1])
+        elif quad[0] in JUMP_QUAD_OPS:
+            labels.update(jump_labels(quad))
+    return labels
+
+
+def _takes_preheader(blocks, header, body):
+    # whether the loop can be entered through a preheader put under the
+    # label of its header: a loop block running on into the header, or a
+    # jtab into it, would run the preheader as well
+    label = blocks[header][0]
+    if label[0] != Q_LABEL or header - 1 in body:
+        return False
+    return not any(quad[0] == Q_JTAB and label[1] in jump_labels(quad) for index in body for quad in blocks[index])
+
+
+def _invariant_quads(blocks, body, moved, live, bits, values):
+    # the (block, position) of the quads of a loop that compute the same
+    # register from the same values on every round, in an order that
+    # computes each operand before it is read
+    writes = {}
+    for index in body:
+        for position, (op, _, _, result) in enumerate(blocks[index]):
+            if op != Q_LABEL and op not in JUMP_QUAD_OPS and (index, position) not in moved:
+                writes[result] = writes.get(result, 0) + 1
+    invariant = []
+    changed = True
+    while changed:
+        changed = False
+        for index in sorted(body):
+            for position, (op, arg1, arg2, result) in enumerate(blocks[index]):
+                if op not in PURE_QUAD_OPS or (index, position) in moved or arg1 in writes or arg2 in writes:
+                    continue
+                # one write in the loop, and no value from before the loop read in it
+                if result & OPERAND_KIND_MASK != O_TEMP or writes.get(result) != 1 or live & bits.get(result, 0):
+                    continue
+                if op == Q_DIV:
+                    # computed before the loop even when the loop does not get
+                    # to it, so only when it cannot divide by zero
+                    divisor = values[arg2 >> OPERAND_KIND_BITS] if arg2 & OPERAND_KIND_MASK == O_CONST else None
+                    if type(divisor) is not int or divisor == 0:
+                        continue
+                moved.add((index, position))
+                invariant.append((index, position))
+                del writes[result]
+                changed = True
+    return invariant
+
+
+def hoist_invariants(quads, output=None):
+    """Return a QuadBuffer whose loops compute their invariants once, before the loop.
+
+    Loop-invariant code motion: in each natural loop, a pure quad writing a
+    register written nowhere else in the loop, from constants, variables
+    the loop does not store to and registers computed before it or by
+    other such quads, moves to a preheader. The preheader takes the label
+    of the loop header, so entering the loop runs it, and the jumps back
+    inside the loop go to a new label after it. Loops are taken from the
+    outermost, so a quad leaves every loop it is invariant in. The counts
+    are printed to `output`, stdout by default.
+    """
+    listing = quad_list(quads)
+    cfg = ControlFlowGraph(listing)
+    blocks = cfg.blocks
+    bits = operand_bits(cfg)
+    live_in, _ = live_operands(cfg, bits)
+    fresh = count(max([label >> OPERAND_KIND_BITS for label in label_operands(listing)] + [0]) + 1)
+    moved = set()
+    # header -> (the quads of its preheader, the new label of the header, the loop blocks)
+    preheaders = {}
+    for header, body in sorted(cfg.natural_loops().items(), key=lambda item: -len(item[1])):
+        if not _takes_preheader(blocks, header, body):
+            continue
+        invariant = _invariant_quads(blocks, body, moved, live_in[header], bits, quads.values)
+        if invariant:
+            preheaders[header] = ([blocks[index][position] for index, position in invariant],
+                                  next(fresh) << OPERAND_KIND_BITS | O_LABEL, body)
+    # the loop blocks jumping back to each header
+    back = dict((blocks[header][0][1], (label, body)) for header, (_, label, body) in preheaders.items())
+    kept = []
+    for index, block in enumerate(blocks):
+        start = 0
+        if index in preheaders:
+            hoisted, label, _ = preheaders[index]
+            kept.append(block[0])
+            kept += hoisted
+            kept.append((Q_LABEL, label, NO_OPERAND, NO_OPERAND))
+            start = 1
+        for position in range(start, len(block)):
+            if (index, position) in moved:
+                continue
+            op, arg1, arg2, result = block[position]
+            if op in JUMP_QUAD_OPS and op != Q_JTAB and arg1 in back and index in back[arg1][1]:
+                arg1 = back[arg1][0]
+            kept.append((op, arg1, arg2, result))
+    print('licm: {} quads hoisted out of {} loops'.format(len(moved), len(preheaders)), file=output)
+    hoisted = quads.derived()
+    hoisted.code = array('q', [field for quad in kept for field in quad])
+    return hoisted
+
+
+def int_operand(values, operand):
+    """Return the int of a constant operand, None for other operands."""
+    if operand & OPERAND_KIND_MASK == O_CONST:
+        value = values[operand >> OPERAND_KIND_BITS]
+        if type(value) is int:
+            return value
+    return None
+
+
+# how a comparison of x and y reads as one of y and x, or of -x and -y
+SWAPPED_COMPARISONS = {Q_LESS: Q_GREATER, Q_GREATER: Q_LESS, Q_LESS_EQUAL: Q_GREATER_EQUAL,
+                       Q_GREATER_EQUAL: Q_LESS_EQUAL, Q_EQUAL: Q_EQUAL, Q_NOT_EQUAL: Q_NOT_EQUAL}
+
+
+class StrengthReducer(object):
+    """Rewrites the loops of a quad listing one at a time, see reduce_strength."""
+
+    def __init__(self, quads, listing, exit_live):
+        self.quads = quads
+        self.listing = listing
+        self.exit_live = exit_live
+        self.fresh_registers = count(max([operand >> OPERAND_KIND_BITS for quad in listing for operand in quad[1:]
+                                          if operand & OPERAND_KIND_MASK == O_TEMP] + [-1]) + 1)
+        self.fresh_labels = count(max([label >> OPERAND_KIND_BITS for label in label_operands(listing)] + [0]) + 1)
+        self.loops = 0
+        self.multiplies = 0
+        self.counters = 0
+
+    def constant(self, value):
+        return self.quads.intern(O_CONST, value)
+
+    def register(self):
+        return next(self.fresh_registers) << OPERAND_KIND_BITS | O_TEMP
+
+    def run(self):
+        """Reduce the loops, the innermost first, until none changes."""
+        done = set()
+        while True:
+            cfg = ControlFlowGraph(self.listing)
+            for header, body in sorted(cfg.natural_loops().items(), key=lambda item: len(item[1])):
+                label = cfg.blocks[header][0][1]
+                if label in done or not _takes_preheader(cfg.blocks, header, body):
+                    continue
+                done.add(label)
+                listing = self.reduce_loop(cfg, header, body)
+                if listing is not None:
+                    self.listing = listing
+                    self.loops += 1
+                    break
+            else:
+                return self.listing
+
+    def counters_of(self, blocks, body, writes):
+        # variable -> (step, (block, position) of its store, the quad
+        # adding the step) of the variables a loop only changes by adding
+        # the same constant
+        values = self.quads.values
+        counters = OrderedDict()
+        for index in sorted(body):
+            block = blocks[index]
+            for position, (op, arg1, arg2, result) in enumerate(block):
+                if op != Q_ASSIGN or result & OPERAND_KIND_MASK != O_VAR or writes.get(result) != 1 \
+                        or writes.get(arg1) != 1:
+                    continue
+                for earlier in range(position - 1, -1, -1):
+                    if block[earlier][3] == arg1:
+                        break
+                else:
+                    continue
+                step_op, left, right, _ = block[earlier]
+                step = None
+                if step_op == Q_ADD and left == result:
+                    step = int_operand(values, right)
+                elif step_op == Q_ADD and right == result:
+                    step = int_operand(values, left)
+                elif step_op == Q_SUB and left == result:
+                    step = int_operand(values, right)
+                    step = None if step is None else -step
+                if step:
+                    counters[result] = step, (index, position), (index, earlier)
+        return counters
+
+    def reduce_loop(self, cfg, header, body):
+        """Return the listing with the loop at `header` reduced, None when
+        nothing in it can be."""
+        blocks = cfg.blocks
+        values = self.quads.values
+        # operand -> its stores in the loop, its stores in all and the (block, position) of its reads
+        writes = {}
+        stores = {}
+        reads = {}
+        for index, block in enumerate(blocks):
+            for position, (op, arg1, arg2, result) in enumerate(block):
+                if op == Q_LABEL or op in JUMP_QUAD_OPS:
+                    if op != Q_LABEL:
+                        reads.setdefault(arg2, []).append((index, position))
+                    continue
+                if index in body:
+                    writes[result] = writes.get(result, 0) + 1
+                stores[result] = stores.get(result, 0) + 1
+                for operand in (arg1, arg2):
+                    reads.setdefault(operand, []).append((index, position))
+        counters = self.counters_of(blocks, body, writes)
+
+        def invariant(operand):
+            kind = operand & OPERAND_KIND_MASK
+            return kind == O_CONST or kind == O_VAR and operand not in writes
+
+        # the blocks run on every round, where a product saves at least
+        # the step it is replaced with
+        latches = [tail for tail, target in cfg.back_edges() if target == header]
+        every_round = set(index for index in body if all(cfg.dominates(index, tail) for tail in latches))
+        preheader = []
+        # register -> [counter, step, (factor, offset) or None, (block, position)]
+        # for the registers holding counter * factor + offset, stepped by
+        # the operand `step` when the counter is
+        induced = OrderedDict()
+        for index in sorted(every_round):
+            for position, (op, arg1, arg2, result) in enumerate(blocks[index]):
+                if op not in (Q_MUL, Q_ADD, Q_SUB) or result & OPERAND_KIND_MASK != O_TEMP or stores[result] != 1:
+                    continue
+                if op == Q_MUL:
+                    # a product of a counter, or of a register that follows one
+                    if (arg1 in counters or arg1 in induced) and invariant(arg2):
+                        base, operand = arg1, arg2
+                    elif (arg2 in counters or arg2 in induced) and invariant(arg1):
+                        base, operand = arg2, arg1
+                    else:
+                        continue
+                elif arg1 in induced and invariant(arg2):
+                    base, operand = arg1, arg2
+                elif op == Q_ADD and arg2 in induced and invariant(arg1):
+                    base, operand = arg2, arg1
+                else:
+                    continue
+                if base in counters:
+                    counter, step, form = base, self.constant(counters[base][0]), (1, 0)
+                else:
+                    counter, step, form = induced[base][:3]
+                # the register is read in its block only, before the counter changes
+                store = counters[counter][1]
+                spots = reads.get(result, [])
+                if any(spot[0] != index or spot[1] <= position for spot in spots):
+                    continue
+                if spots and store[0] == index and position < store[1] <= max(spot[1] for spot in spots):
+                    continue
+                number = int_operand(values, operand)
+                if op == Q_MUL:
+                    if int_operand(values, step) is not None and number is not None:
+                        step = self.constant(int_operand(values, step) * number)
+                    elif int_operand(values, step) == 1:
+                        step = operand
+                    else:
+                        product = self.register()
+                        preheader.append((Q_MUL, step, operand, product))
+                        step = product
+                    if form is not None:
+                        form = None if number is None else (form[0] * number, form[1] * number)
+                    self.multiplies += 1
+                elif form is not None:
+                    form = None if number is None else (form[0], form[1] + number if op == Q_ADD else form[1] - number)
+                preheader.append((op, arg1, arg2, result))
+                induced[result] = [counter, step, form, (index, position)]
+        if not induced:
+            return None
+        moved = set(entry[3] for entry in induced.values())
+
+        # the registers still read in the loop are kept in step with their counter
+        kept = set(register for register in induced
+                   if any(spot not in moved for spot in reads.get(register, [])))
+        dropped = set()
+        # (block, position) -> the comparison of a reduced register replacing it
+        compared = {}
+        bits = operand_bits(cfg)
+        exit_bits = 0
+        if self.exit_live:
+            for operand, bit in bits.items():
+                if operand & OPERAND_KIND_MASK == O_VAR:
+                    exit_bits |= bit
+        live_in, _ = live_operands(cfg, bits, exit_bits)
+        leaving = set(successor for index in body for successor in cfg.successors[index] if successor not in body)
+        for counter, (step, store, increment) in counters.items():
+            bit = bits.get(counter, 0)
+            if any(live_in[index] & bit for index in leaving) \
+                    or any(index in cfg.exits for index in body) and exit_bits & bit:
+                continue
+            followers = [register for register, entry in induced.items()
+                         if entry[0] == counter and entry[2] is not None and entry[2][0] != 0]
+            if not followers or reads.get(blocks[increment[0]][increment[1]][3]) != [store]:
+                continue
+            # the counter is only read to step it, by the moved quads and by
+            # comparisons with invariants, which compare a follower instead
+            register = followers[0]
+            factor, offset = induced[register][2]
+            tests = {}
+            for spot in reads.get(counter, []):
+                if spot == increment or spot in moved or spot[0] not in body:
+                    continue
+                op, arg1, arg2, result = blocks[spot[0]][spot[1]]
+                if op not in SWAPPED_COMPARISONS or not invariant(arg2 if arg1 == counter else arg1) \
+                        or arg1 == arg2:
+                    break
+                tests[spot] = op, arg1, arg2, result
+            else:
+                for spot, (op, arg1, arg2, result) in tests.items():
+                    bound = self.scaled(arg2 if arg1 == counter else arg1, factor, offset, preheader)
+                    if factor < 0:
+                        op = SWAPPED_COMPARISONS[op]
+                    compared[spot] = (op, register, bound, result) if arg1 == counter else (op, bound, register, result)
+                dropped.update((store, increment))
+                kept.add(register)
+                self.counters += 1
+
+        # the steps of the kept registers follow the stores of their counters
+        steps = {}
+        for register, (counter, step, _, _) in induced.items():
+            if register in kept:
+                number = int_operand(values, step)
+                if number is not None and number < 0:
+                    quad = (Q_SUB, register, self.constant(-number), register)
+                else:
+                    quad = (Q_ADD, register, step, register)
+                steps.setdefault(counters[counter][1], []).append(quad)
+        label = blocks[header][0]
+        inner = next(self.fresh_labels) << OPERAND_KIND_BITS | O_LABEL
+        listing = []
+        for index, block in enumerate(blocks):
+            if index == header:
+                listing.append(label)
+                listing += preheader
+                listing.append((Q_LABEL, inner, NO_OPERAND, NO_OPERAND))
+            for position, quad in enumerate(block):
+                spot = index, position
+                if index == header and position == 0:
+                    continue
+                if spot not in moved and spot not in dropped:
+                    quad = compared.get(spot, quad)
+                    if index in body and quad[0] in JUMP_QUAD_OPS and quad[0] != Q_JTAB and quad[1] == label[1]:
+                        quad = (quad[0], inner, quad[2], quad[3])
+                    listing.append(quad)
+                listing += steps.get(spot, [])
+        return listing
+
+    def scaled(self, operand, factor, offset, preheader):
+        # operand * factor + offset, computed in the preheader unless constant
+        number = int_operand(self.quads.values, operand)
+        if number is not None:
+            return self.constant(number * factor + offset)
+        if factor != 1:
+            product = self.register()
+            preheader.append((Q_MUL, operand, self.constant(factor), product))
+            operand = product
+        if offset:
+            total = self.register()
+            preheader.append((Q_ADD, operand, self.constant(offset), total))
+            operand = total
+        return operand
+
+
+def _shifts(listing, quads):
+    # the multiplications and divisions by powers of two as shifts
+    values = quads.values
+    shifted = 0
+    for index, (op, arg1, arg2, result) in enumerate(listing):
+        if op == Q_MUL or op == Q_DIV:
+            number = int_operand(values, arg2)
+            if op == Q_MUL and (number is None or number < 2 or number & (number - 1)):
+                arg1, arg2 = arg2, arg1
+                number = int_operand(values, arg2)
+            if number is not None and number > 1 and not number & (number - 1):
+                listing[index] = (Q_SHL if op == Q_MUL else Q_SHR, arg1, quads.intern(O_CONST, number.bit_length() - 1), result)
+                shifted += 1
+    return shifted
+
+
+def reduce_strength(quads, exit_live=True, output=None):
+    """Return a QuadBuffer with cheaper operations in place of the loop
+    products and the multiplications and divisions by powers of two.
+
+    In each natural loop, a counter is a variable that the loop only
+    changes by adding a constant to it, like the i = i + 1 of a for loop.
+    A register holding a product of a counter and an invariant, and the
+    registers adding invariants to it, are computed once before the loop
+    and then stepped after each store to the counter: i * 4 becomes an
+    addition of 4 each round. A counter only read to step it and to
+    compare it with invariants is then dropped, comparing one of these
+    registers instead, unless it is read after the loop; the variables are
+    read at the end of the program unless `exit_live` is false. Last, the
+    multiplications and divisions by a power of two become shifts. The
+    counts are printed to `output`, stdout by default.
+    """
+    reducer = StrengthReducer(quads, quad_list(quads), exit_live)
+    listing = reducer.run()
+    reduced = quads.derived()
+    shifted = _shifts(listing, reduced)
+    print('strength: {} products stepped in {} loops, {} counters dropped, {} shifts'.format(
+        reducer.multiplies, reducer.loops, reducer.counters, shifted), file=output)
+    reduced.code = array('q', [field for quad in listing for field in quad])
+    return reduced
+
+
+# the passes selected with --optimize, applied in the order given, each
+# called with the quads and the file to print its counts to
+OPTIMIZATIONS = OrderedDict([
+    ('fold', lambda quads, output: fold_constants(quads)),
+    ('cse', lambda quads, output: number_values(quads)),
+    ('dce', lambda quads, output: eliminate_dead_code(quads)),
+    # also drops the stores to variables that are not read again
+    ('dce-all', lambda quads, output: eliminate_dead_code(quads, exit_live=False)),
+    ('licm', hoist_invariants),
+    ('strength', lambda quads, output: reduce_strength(quads, output=output)),
+    # also drops the counters that are not read again
+    ('strength-all', lambda quads, output: reduce_strength(quads, exit_live=False, output=output)),
+])
+
+
+def optimize(quads, passes, output=None):
+    """Run the named passes over `quads`, printing how many quads each
+    removed to `output`, stdout by default."""
+    for name in passes:
+        before = len(quads)
+        quads = OPTIMIZATIONS[name](quads, output)
+        if len(quads) > before:
+            print('{}: {} quads added to {}'.format(name, len(quads) - before, before), file=output)
+        else:
+            print('{}: {} of {} quads removed'.format(name, before - len(quads), before), file=output)
+    return quads
+
+
+###############################################################################
+#                                                                             #
+#  REGISTER ALLOCATION                                                        #
+#                                                                             #
+###############################################################################
+# the memory a spilled register is kept in; not an identifier of the
+# language, so never the name of a program variable
+SPILL_SLOT_NAME = 'S_{}'
+
+
+def register_intervals(quads):
+    """Return {register: [first, last]}, the quad indexes each register is
+    live between.
+
+    A register is live from the quad writing it to the last quad reading
+    it. When that span takes in the head of a loop without its jump back,
+    the register is also read in the next round, so the span is extended to
+    the jump.
+    """
+    code = quads.code
+    intervals = {}
+    labels = {}
+    jumps = []
+    for index, position in enumerate(range(0, len(code), 4)):
+        op, arg1, arg2, result = code[position:position + 4]
+        if op == Q_LABEL:
+            labels[arg1] = index
+            continue
+        if op in JUMP_QUAD_OPS:
+            jumps.extend((label, index) for label in jump_labels((op, arg1, arg2, result)))
+        for operand in (arg1, arg2, result):
+            if operand & OPERAND_KIND_MASK == O_TEMP:
+                interval = intervals.get(operand)
+                if interval is None:
+                    intervals[operand] = [index, index]
+                else:
+                    interval[1] = index
+    loops = sorted((labels[label], index) for label, index in jumps if labels.get(label, index) < index)
+    heads = [head for head, _ in loops]
+    for interval in intervals.values():
+        while True:
+            # the loops starting inside the span
+            start, end = bisect_left(heads, interval[0] + 1), bisect_left(heads, interval[1] + 1)
+            last = max([interval[1]] + [back for _, back in loops[start:end]])
+            if last == interval[1]:
+                break
+            interval[1] = last
+    return intervals
+
+
+def linear_scan(intervals, limit=None):
+    """Give each interval a number, no two overlapping intervals the same.
+
+    `intervals` is a list of (first, last, register) in the order of first.
+    At most `limit` numbers are handed out, when they are all taken the
+    interval ending last is spilled. Returns {register: number}, the spilled
+    registers and the most intervals that were live at once.
+    """
+    numbers = {}
+    spilled = []
+    free = []
+    # (last, register) of the intervals holding a number
+    active = []
+    # the ends of all live intervals, for the pressure
+    live = []
+    peak = 0
+    count = 0
+    for first, last, register in intervals:
+        # a register read for the last time can be written by the same quad
+        while active and active[0][0] <= first:
+            heapq.heappush(free, numbers[heapq.heappop(active)[1]])
+        while live and live[0] <= first:
+            heapq.heappop(live)
+        heapq.heappush(live, last)
+        peak = max(peak, len(live))
+        if free:
+            number = heapq.heappop(free)
+        elif limit is None or count < limit:
+            number = count
+            count += 1
+        else:
+            victim = max(active)
+            if victim[0] <= last:
+                spilled.append(register)
+                continue
+            active.remove(victim)
+            heapq.heapify(active)
+            number = numbers.pop(victim[1])
+            spilled.append(victim[1])
+        numbers[register] = number
+        heapq.heappush(active, (last, register))
+    return numbers, spilled, peak
+
+
+def allocate_registers(quads, max_registers=None, output=None):
+    """Return a QuadBuffer using as few registers as the temporaries of
+    `quads` need at once, R0 up.
+
+    With `max_registers` the registers still needed beyond it are kept in
+    memory, the spill slots S_0 up, which are reused the same way. The
+    counts are printed to `output`, stdout by default.
+    """
+    intervals = register_intervals(quads)
+    order = sorted((first, last, register) for register, (first, last) in intervals.items())
+    numbers, spilled, peak = linear_scan(order, max_registers)
+    renamed = dict((register, number << OPERAND_KIND_BITS | O_TEMP) for register, number in numbers.items())
+    spilled = set(spilled)
+    slots, _, _ = linear_scan([interval for interval in order if interval[2] in spilled])
+    for register, slot in slots.items():
+        renamed[register] = quads.intern(O_VAR, SPILL_SLOT_NAME.format(slot))
+    allocated = quads.derived()
+    code = allocated.code = array('q', quads.code)
+    # every field but the opcode is an operand
+    for field in range(1, 4):
+        code[field::4] = array('q', [renamed.get(operand, operand) for operand in code[field::4]])
+    print('registers: {} temporaries in {} registers and {} spill slots, at most {} live'.format(
+        len(intervals), len(set(numbers.values())), len(set(slots.values())), peak), file=output)
+    return allocated
+
+
+###############################################################################
+#                                                                             #
+#  VIRTUAL MACHINE                                                            #
+#                                                                             #
+###############################################################################
+class BackendError(Exception):
+    """Raised by a backend for a program it cannot compile or run, which is
+    reported without a traceback."""
+
+
+def parse_quads(text):
+    """Return the QuadBuffer of a quad listing in the format of out.txt."""
+    quads = QuadBuffer()
+    opcodes = dict((str(name), op) for op, name in enumerate(QUAD_OP_NAMES) if name)
+
+    def operand(field):
+        if not field:
+            return NO_OPERAND
+        if field[0] in 'RL' and field[1:].isdigit():
+            return int(field[1:]) << OPERAND_KIND_BITS | (O_TEMP if field[0] == 'R' else O_LABEL)
+        if field.lstrip('-').isdigit():
+            return quads.intern(O_CONST, int(field))
+        if field in (TRUE, FALSE):
+            return quads.intern(O_CONST, field)
+        if field == 'None':
+            return quads.intern(O_CONST, None)
+        return quads.intern(O_VAR, field)
+
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.endswith(':'):
+            quads.emit(Q_LABEL, operand(line[:-1]))
+            continue
+        fields = [field.strip() for field in line.strip('()').split(',')]
+        if len(fields) != 4 or fields[0] not in opcodes:
+            raise ValueError('not a quad at line {}: {}'.format(number, line))
+        quads.emit(opcodes[fields[0]], *(operand(field) for field in fields[1:]))
+    return quads
+
+
+def vm_value(value):
+    """The value a constant operand has in the machine."""
+    if value == TRUE:
+        return True
+    elif value == FALSE:
+        return False
+    return value
+
+
+# the operators of the quads on machine values
+VM_OPERATIONS = {
+    Q_ADD: add,
+    Q_SUB: sub,
+    Q_MUL: mul,
+    Q_DIV: truncating_divide,
+    Q_SHL: lshift,
+    Q_SHR: truncating_shift,
+    Q_AND: lambda a, b: bool(a and b),
+    Q_OR: lambda a, b: bool(a or b),
+    # a NOT between two terms negates the right one
+    Q_NOT: lambda a, b: not b,
+    Q_EQUAL: eq,
+    Q_CASE_EQUAL: eq,
+    Q_NOT_EQUAL: ne,
+    Q_LESS_EQUAL: le,
+    Q_GREATER_EQUAL: ge,
+    Q_LESS: lt,
+    Q_GREATER: gt,
+}
+
+
+# Each handler makes the function running one instruction on the slots `s`,
+# which returns the index of the instruction to run next.
+def _vm_assign(s, a, r, following):
+    def assign():
+        s[r] = s[a]
+        return following
+    return assign
+
+
+def _vm_add(s, a, b, r, following):
+    def add_():
+        s[r] = s[a] + s[b]
+        return following
+    return add_
+
+
+def _vm_sub(s, a, b, r, following):
+    def sub_():
+        s[r] = s[a] - s[b]
+        return following
+    return sub_
+
+
+def _vm_binary(operation):
+    def handler(s, a, b, r, following):
+        def binary():
+            s[r] = operation(s[a], s[b])
+            return following
+        return binary
+    return handler
+
+
+def _vm_uminus(s, a, b, r, following):
+    def uminus():
+        s[r] = -s[a]
+        return following
+    return uminus
+
+
+def _vm_jmp(target):
+    def jmp():
+        return target
+    return jmp
+
+
+def _vm_jfalse(s, condition, target, following):
+    def jfalse():
+        return following if s[condition] else target
+    return jfalse
+
+
+def _vm_jtrue(s, condition, target, following):
+    def jtrue():
+        return target if s[condition] else following
+    return jtrue
+
+
+def _vm_jtab(s, index, table, following):
+    size = len(table)
+
+    def jtab():
+        position = s[index]
+        return table[position] if 0 <= position < size else following
+    return jtab
+
+
+# superinstructions of two quads
+def _vm_test_jump(operation, s, a, b, r, jump_if, target, following):
+    # a comparison and the jfalse or jtrue on its result
+    def test_jump():
+        value = s[r] = operation(s[a], s[b])
+        return target if bool(value) == jump_if else following
+    return test_jump
+
+
+def _vm_compute_store(operation, s, a, b, r, variable, following):
+    # an operation and the store of its result to a variable
+    def compute_store():
+        s[variable] = s[r] = operation(s[a], s[b])
+        return following
+    return compute_store
+
+
+def _vm_add_store(s, a, b, r, variable, following):
+    def add_store():
+        s[variable] = s[r] = s[a] + s[b]
+        return following
+    return add_store
+
+
+VM_HANDLERS = dict((op, _vm_binary(operation)) for op, operation in VM_OPERATIONS.items())
+VM_HANDLERS[Q_ADD] = _vm_add
+VM_HANDLERS[Q_SUB] = _vm_sub
+VM_HANDLERS[Q_UMINUS] = _vm_uminus
+
+TEST_QUAD_OPS = frozenset(COMPARISON_FOLDS) | frozenset(LOGICAL_FOLDS) | frozenset((Q_NOT,))
+
+
+class QuadMachine(object):
+    """Runs the quads of a QuadBuffer.
+
+    Labels are resolved to instruction indexes once, and every variable,
+    register and constant gets a slot of one list. An instruction is a
+    function made by the handler of its opcode that works on the slots and
+    returns the index of the next instruction. A comparison followed by
+    the jump on its result, and an operation followed by the store of its
+    result, run as one instruction, and the jumps to a jmp, or running on
+    into one, go straight to its target. A jump to a label no quad places
+    ends the program; `unresolved` lists those labels. A division by zero
+    stops it with a BackendError naming the quad, counted from 1 like the
+    lines of out.txt.
+    """
+
+    def __init__(self, quads):
+        self.quads = quads
+        self.slots = []
+        # operand -> slot
+        self.slot_of = {}
+        listing = quad_list(quads)
+        self.unresolved = unresolved_labels(listing)
+        # instruction -> index of its first quad
+        self.first_quads = []
+        self.program = self._load(listing)
+        self.steps = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(parse_quads(text))
+
+    def slot(self, operand):
+        index = self.slot_of.get(operand)
+        if index is None:
+            index = self.slot_of[operand] = len(self.slots)
+            kind = operand & OPERAND_KIND_MASK
+            value = 0
+            if kind == O_CONST:
+                value = vm_value(self.quads.values[operand >> OPERAND_KIND_BITS])
+            self.slots.append(value)
+        return index
+
+    def _load(self, listing):
+        # lay the instructions out first, as (first quad, quads in it), to
+        # know where the labels go
+        layout = []
+        labels = {}
+        index = 0
+        while index < len(listing):
+            op, arg1, arg2, result = listing[index]
+            if op == Q_LABEL:
+                labels[arg1] = len(layout)
+                index += 1
+                continue
+            size = 1
+            if index + 1 < len(listing):
+                next_op, next_arg1, next_arg2, _ = listing[index + 1]
+                if op in TEST_QUAD_OPS and next_op in (Q_JFALSE, Q_JTRUE) and next_arg2 == result:
+                    size = 2
+                elif op in VM_OPERATIONS and next_op == Q_ASSIGN and next_arg1 == result:
+                    size = 2
+            layout.append((index, size))
+            index += size
+        end = len(layout)
+        self.first_quads = [index for index, _ in layout]
+
+        def landing(position):
+            # where running on from instruction `position` really goes, past
+            # the jmps; a loop of jmps stays where it is
+            seen = set()
+            while position < end and position not in seen and listing[layout[position][0]][0] == Q_JMP:
+                seen.add(position)
+                position = labels.get(listing[layout[position][0]][1], end)
+            return position
+
+        s = self.slots
+        slot = self.slot
+        program = []
+        for position, (index, size) in enumerate(layout):
+            op, arg1, arg2, result = listing[index]
+            following = landing(position + 1)
+            if op in JUMP_QUAD_OPS:
+                target = landing(labels.get(arg1, end))
+            if op == Q_JMP:
+                program.append(_vm_jmp(target))
+            elif op == Q_JFALSE:
+                program.append(_vm_jfalse(s, slot(arg2), target, following))
+            elif op == Q_JTRUE:
+                program.append(_vm_jtrue(s, slot(arg2), target, following))
+            elif op == Q_JTAB:
+                table = [landing(labels.get(label, end)) for label in jump_labels(listing[index])]
+                program.append(_vm_jtab(s, slot(arg2), table, following))
+            elif op == Q_ASSIGN:
+                program.append(_vm_assign(s, slot(arg1), slot(result), following))
+            elif size == 2:
+                next_op, next_arg1, _, next_result = listing[index + 1]
+                if next_op == Q_ASSIGN:
+                    if op == Q_ADD:
+                        program.append(_vm_add_store(s, slot(arg1), slot(arg2), slot(result), slot(next_result),
+                                                     following))
+                    else:
+                        program.append(_vm_compute_store(VM_OPERATIONS[op], s, slot(arg1), slot(arg2), slot(result),
+                                                         slot(next_result), following))
+                else:
+                    program.append(_vm_test_jump(VM_OPERATIONS[op], s, slot(arg1), slot(arg2), slot(result),
+                                                 next_op == Q_JTRUE, landing(labels.get(next_arg1, end)), following))
+            else:
+                program.append(VM_HANDLERS[op](s, slot(arg1), slot(arg2), slot(result), following))
+        return program
+
+    def run(self, max_steps=None):
+        """Run the program from the start until it ends or `max_steps`
+        instructions ran, and return whether it ended."""
+        program = self.program
+        end = len(program)
+        limit = -1 if max_steps is None else max_steps
+        pc = 0
+        steps = 0
+        started = time.perf_counter()
+        try:
+            while pc < end and steps != limit:
+                pc = program[pc]()
+                steps += 1
+        except ZeroDivisionError:
+            # a fused instruction divides in its first quad
+            raise BackendError('vm: division by zero at quad {}'.format(self.first_quads[pc] + 1))
+        self.seconds = time.perf_counter() - started
+        self.steps = steps
+        return pc >= end
+
+    def environment(self):
+        """Return {name: value} of the variables, TRUE and FALSE for booleans."""
+        values = self.quads.values
+        environment = OrderedDict()
+        for operand, index in self.slot_of.items():
+            if operand & OPERAND_KIND_MASK == O_VAR:
+                value = self.slots[index]
+                if type(value) is bool:
+                    value = TRUE if value else FALSE
+                environment[values[operand >> OPERAND_KIND_BITS]] = value
+        return environment
+
+
+def unresolved_note(backend, labels):
+    """Return the line telling that the jumps to `labels`, placed by no
+    quad, end a run of `backend`."""
+    return '{}: no quad places {}, where a jump ends the program; the quads run as emitted, and an if with an ' \
+           'else jumps to a label it never places after repeating its then block, so --python, running the else, ' \
+           'may print other values'.format(backend, ', '.join(format_operand(O_LABEL, label >> OPERAND_KIND_BITS)
+                                                               for label in labels))
+
+
+def run_quads(quads, max_steps=None):
+    """Run quads on a QuadMachine, printing the counts, the jumps to no
+    label and the variables."""
+    machine = QuadMachine(quads)
+    ended = machine.run(max_steps)
+    print('vm: {} instructions for {} quads in {:.3f}s{}'.format(
+        machine.steps, len(quads), machine.seconds, '' if ended else ', stopped'))
+    if machine.unresolved:
+        print(unresolved_note('vm', machine.unresolved))
+    for name, value in machine.environment().items():
+        print('{} = {}'.format(name, value))
+    return machine
+
+
+###############################################################################
+#                                                                             #
+#  PYTHON BACKEND                                                             #
+#                                                                             #
+###############################################################################
+PYTHON_OPERATORS = {PLUS: '+', MINUS: '-', MULTIPLY: '*', EQUAL: '==', NOT_EQUAL: '!=', LESS_EQUAL: '<=',
+                    GREATER_EQUAL: '>=', LESS: '<', GREATER: '>', AND: 'and', OR: 'or'}
+# changes with the code PythonGenerator writes, to tell cached code apart
+PYTHON_BACKEND_VERSION = 3
+# how deep a statement's blocks may nest before it moves into a function of
+# its own; CPython refuses more than 20 nested loops in one function
+PYTHON_NESTING = 16
+
+
+def python_divide(a, b, position):
+    """truncating_divide for the Python backend, stopping on a division by
+    zero with a BackendError naming the position of the operator."""
+    if b == 0:
+        raise BackendError('python: division by zero at ' + position)
+    return truncating_divide(a, b)
+
+
+def indent(lines):
+    """Return the lines of a Python block, `pass` for no lines."""
+    return ['    ' + line for line in lines] or ['    pass']
+
+
+def nesting(lines):
+    """Return how many blocks deep the lines of a statement go."""
+    return max(len(line) - len(line.lstrip(' ')) for line in lines) // 4 + 1 if lines else 0
+
+
+class PythonGenerator(NodeVisitor):
+    """Translates a tree into Python statements, a list of lines for each
+    statement.
+
+    The variables become locals `v_<name>`; `names` maps them back.
+    Expressions are three-address code: every operation stores its result
+    in a temporary `_t<n>`, the lines computing it wait in `pending` for
+    the statement using it, and an expression's result is a name or a
+    literal. So no expression nests, however long; the temporaries of a
+    statement are reused by the next one.
+
+    Statements follow their meaning: an else runs its own block and every
+    case of a switch tests the variable again, like falling through to the
+    next case label. A break is Python's, a switch it leaves being a loop
+    run once. A statement nesting deeper than PYTHON_NESTING, that no
+    break leaves, moves into a function `_block_<n>` in `blocks`.
+    """
+
+    def __init__(self):
+        self.names = OrderedDict()
+        self.pending = []
+        self.temporaries = 0
+        self.blocks = []
+
+    def local(self, name):
+        python_name = self.names.get(name)
+        if python_name is None:
+            python_name = self.names[name] = 'v_' + name
+        return python_name
+
+    def operation(self, operands, expression):
+        """Store an expression of the operands in a temporary and return its name."""
+        for operand in operands:
+            # operands are the latest temporaries, so they free like a stack
+            if operand.startswith('_t'):
+                self.temporaries -= 1
+        name = '_t{}'.format(self.temporaries)
+        self.temporaries += 1
+        self.pending.append(name + ' = ' + expression)
+        return name
+
+    def take(self):
+        """Return the lines computing the last expressions, freeing their temporaries."""
+        lines = self.pending
+        self.pending = []
+        self.temporaries = 0
+        return lines
+
+    def outline(self, node, lines):
+        """Move a statement's lines into a function if they nest too deep."""
+        if nesting(lines) <= PYTHON_NESTING or breaks_out([node]):
+            return lines
+        name = '_block_{}'.format(len(self.blocks))
+        self.blocks.append((name, lines))
+        return [name + '()']
+
+    def visit_Program(self, node):
+        lines = []
+        for child in node.children:
+            lines += (yield child) or []
+        return lines
+
+    visit_Compound = visit_Program
+
+    def visit_NoOp(self, node):
+        return []
+
+    def visit_Type(self, node):
+        pass
+
+    def visit_BreakStat(self, node):
+        return ['break']
+
+    def visit_VarDecl(self, node):
+        name = self.local(node.left.value)
+        if node.right:
+            value = yield node.right
+            return self.take() + [name + ' = ' + value]
+        return []
+
+    def visit_Assign(self, node):
+        name = self.local(node.left.value)
+        value = yield node.right
+        return self.take() + [name + ' = ' + value]
+
+    def visit_Var(self, node):
+        return self.local(node.value)
+
+    def visit_Number(self, node):
+        return repr(node.value)
+
+    def visit_Boolean(self, node):
+        return repr(node.value == TRUE)
+
+    def visit_BinOp(self, node):
+        left = yield node.left
+        right = yield node.right
+        if node.op.type == DIVIDE:
+            return self.operation((left, right), '_divide({}, {}, {!r})'.format(
+                left, right, format_position(node.op)))
+        return self.operation((left, right), left + ' ' + PYTHON_OPERATORS[node.op.type] + ' ' + right)
+
+    def visit_BoolOp(self, node):
+        left = yield node.left
+        right = yield node.right
+        if node.op.type == NOT:
+            # a NOT between two terms negates the right one
+            return self.operation((left, right), 'not ' + right)
+        return self.operation((left, right), left + ' ' + PYTHON_OPERATORS[node.op.type] + ' ' + right)
+
+    def visit_UnaryOp(self, node):
+        op = node.op.type
+        if op == PLUS:
+            return (yield node.expr)
+        elif op == MINUS:
+            operand = yield node.expr
+            return self.operation((operand,), '-' + operand)
+        # a NOT with no operand
+        return 'None'
+
+    def loop(self, condition, before, body, after=()):
+        """Return a loop testing a condition, computed by the lines
+        `before`, ahead of the body or, with `after`, behind it."""
+        if not before and not after:
+            return ['while ' + condition + ':'] + indent(body)
+        if after:
+            return ['while True:'] + indent(body + list(after) + ['if not ' + condition + ':', '    break'])
+        return ['while True:'] + indent(before + ['if not ' + condition + ':', '    break'] + body)
+
+    def visit_IfStat(self, node):
+        condition = yield node.expr
+        lines = self.take() + ['if ' + condition + ':'] + indent((yield node.cmpd1))
+        if node.cmpd2 is not None:
+            lines += ['else:'] + indent((yield node.cmpd2))
+        return self.outline(node, lines)
+
+    def visit_WhileStat(self, node):
+        condition = yield node.expr
+        before = self.take()
+        return self.outline(node, self.loop(condition, before, (yield node.cmpd1)))
+
+    def visit_DoWhileStat(self, node):
+        body = yield node.cmpd1
+        condition = yield node.expr
+        return self.outline(node, self.loop(condition, [], body, self.take()))
+
+    def visit_ForStat(self, node):
+        lines = (yield node.init) or []
+        condition = (yield node.middle) or 'True'
+        before = self.take()
+        body = (yield node.cmpd_stat) + ((yield node.end) or [])
+        return self.outline(node, lines + self.loop(condition, before, body))
+
+    def visit_SwitchStat(self, node):
+        name = self.local(node.var.value)
+        lines = []
+        for i, case in enumerate(node.case_stats):
+            body = yield node.cmpd_stats[i]
+            value = case_value(case)
+            if value is None:
+                lines += body
+            else:
+                lines += ['if ' + name + ' == ' + repr(value) + ':'] + indent(body)
+        if breaks_out(node.cmpd_stats):
+            lines = ['while True:'] + indent(lines + ['break'])
+        return self.outline(node, lines)
+
+
+def python_source(tree):
+    """Return the Python source of a function `program` running the tree
+    and returning {name: value} of its variables."""
+    generator = PythonGenerator()
+    body = generator.visit(tree) if tree is not None else []
+    names = generator.names
+    lines = ['def program():']
+    if names:
+        lines.append('    ' + ' = '.join(names.values()) + ' = 0')
+    for name, block in generator.blocks:
+        # the variables stay program's, shared with its blocks
+        lines.append('    def ' + name + '():')
+        if names:
+            lines.append('        nonlocal ' + ', '.join(names.values()))
+        lines += indent(indent(block))
+    lines += body and indent(body)
+    lines.append('    return {' + ', '.join('{!r}: {}'.format(name, python_name)
+                                            for name, python_name in names.items()) + '}')
+    return '\n'.join(lines) + '\n'
+
+
+class PythonBackend(object):
+    """Compiles trees into Python code objects and runs them.
+
+    With a `cache_dir` the code objects are kept there with marshal, under
+    a hash of a key naming the source, the backend and Python versions.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.cached = False
+
+    def cache_path(self, key):
+        digest = hashlib.sha256()
+        digest.update('{} {}\n'.format(PYTHON_BACKEND_VERSION, sys.version).encode())
+        digest.update(key)
+        return os.path.join(self.cache_dir, digest.hexdigest() + '.marshal')
+
+    def compile(self, tree, key=None):
+        """Return the code object of a tree; `key`, the bytes of the source,
+        finds it in the cache, where the tree is not needed."""
+        path = None
+        if self.cache_dir is not None and key is not None:
+            path = self.cache_path(key)
+            if os.path.exists(path):
+                with open(path, 'rb') as infile:
+                    self.cached = True
+                    return marshal.load(infile)
+        self.cached = False
+        try:
+            code = compile(python_source(tree), '<program>', 'exec')
+        except (SyntaxError, RecursionError) as e:
+            # the limits of CPython's compiler, e.g. on indentation
+            raise BackendError('python: cannot compile the program: {}'.format(
+                e.msg if isinstance(e, SyntaxError) else e))
+        if path is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # written aside first, so a reader never finds half a file
+            partial = '{}.{}'.format(path, os.getpid())
+            with open(partial, 'wb') as outfile:
+                marshal.dump(code, outfile)
+            os.replace(partial, path)
+        return code
+
+    @staticmethod
+    def run(code):
+        """Run a compiled program and return {name: value} of its variables."""
+        namespace = {'_divide': python_divide}
+        exec(code, namespace)
+        return namespace['program']()
+
+
+def run_python(tree, key=None, cache_dir=None):
+    """Compile a tree with the PythonBackend and run it, printing the times and the variables."""
+    backend = PythonBackend(cache_dir)
+    started = time.perf_counter()
+    code = backend.compile(tree, key)
+    compiled = time.perf_counter()
+    environment = backend.run(code)
+    ran = time.perf_counter()
+    print('python: {} in {:.3f}s, ran in {:.3f}s'.format(
+        'loaded' if backend.cached else 'compiled', compiled - started, ran - compiled))
+    for name, value in environment.items():
+        print('{} = {}'.format(name, value))
+    return environment
+
+
+###############################################################################
+#                                                                             #
+#  C BACKEND                                                                  #
+#                                                                             #
+###############################################################################
+C_OPERATORS = {Q_ADD: '+', Q_SUB: '-', Q_MUL: '*', Q_AND: '&&', Q_OR: '||', Q_EQUAL: '==', Q_CASE_EQUAL: '==',
+               Q_NOT_EQUAL: '!=', Q_LESS_EQUAL: '<=', Q_GREATER_EQUAL: '>=', Q_LESS: '<', Q_GREATER: '>'}
+
+C_PRELUDE = '''#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+/* rounds toward zero like the quads, and stops on a division by zero,
+   naming the quad */
+static long divide(long a, long b, int quad)
+{
+    if (b == 0) {
+        fprintf(stderr, "division by zero at quad %d\\n", quad);
+        exit(1);
+    }
+    return a / b;
+}
+
+/* a / 2**k rounding toward zero, like divide */
+static long shift_right(long a, long k)
+{
+    return (a < 0 ? a + ((1L << k) - 1) : a) >> k;
+}
+
+'''
+
+# the exit status of a C program stopped by its budget of steps
+C_STOPPED_STATUS = 3
+# the exit status of a C program stopped by a division by zero
+C_FAILED_STATUS = 1
+
+
+class CGenerator(object):
+    """Translates quads into the C function `main` of a program printing
+    the final value of every variable.
+
+    Variables become `long v_<name>` and registers `long r<n>`, both
+    starting at 0, labels become C labels and the jumps gotos. A jump to
+    a label that is not in the quads ends the program, as on the
+    QuadMachine. With `max_steps` every label passed takes a step, and
+    the program stops when they run out.
+    """
+
+    def __init__(self, quads, max_steps=None):
+        self.quads = quads
+        self.max_steps = max_steps
+        self.variables = OrderedDict()
+        self.registers = set()
+
+    def operand(self, operand):
+        kind = operand & OPERAND_KIND_MASK
+        if kind == O_TEMP:
+            number = operand >> OPERAND_KIND_BITS
+            self.registers.add(number)
+            return 'r' + str(number)
+        value = self.quads.values[operand >> OPERAND_KIND_BITS] if kind != O_NONE else None
+        if kind == O_VAR:
+            return self.variables.setdefault(value, 'v_' + value)
+        value = vm_value(value)
+        if value is None or value is False:
+            return '0'
+        elif value is True:
+            return '1'
+        return str(value) + 'L'
+
+    def statement(self, quad, labels, number):
+        """Return the lines of C of a quad, quad `number` counted from 1."""
+        op, arg1, arg2, result = quad
+        if op == Q_LABEL:
+            if self.max_steps is not None:
+                return ['L{}:'.format(arg1 >> OPERAND_KIND_BITS), '    if (--steps < 0) goto stop;']
+            return ['L{}:;'.format(arg1 >> OPERAND_KIND_BITS)]
+        elif op == Q_JTAB:
+            lines = ['    switch ({}) {{'.format(self.operand(arg2))]
+            for position, label in enumerate(jump_labels(quad)):
+                lines.append('    case {}: goto {};'.format(
+                    position, 'L{}'.format(label >> OPERAND_KIND_BITS) if label in labels else 'end'))
+            return lines + ['    }']
+        elif op in JUMP_QUAD_OPS:
+            target = 'L{}'.format(arg1 >> OPERAND_KIND_BITS) if arg1 in labels else 'end'
+            if op == Q_JMP:
+                return ['    goto {};'.format(target)]
+            return ['    if ({}{}) goto {};'.format('!' if op == Q_JFALSE else '', self.operand(arg2), target)]
+        if op == Q_ASSIGN:
+            value = self.operand(arg1)
+        elif op == Q_UMINUS:
+            value = '-' + self.operand(arg1)
+        elif op == Q_NOT:
+            # a NOT between two terms negates the right one
+            value = '!' + self.operand(arg2)
+        elif op == Q_DIV:
+            value = 'divide({}, {}, {})'.format(self.operand(arg1), self.operand(arg2), number)
+        elif op == Q_SHL:
+            # shifted unsigned, a negative value wraps like a product does
+            value = '(long)((unsigned long){} << {})'.format(self.operand(arg1), self.operand(arg2))
+        elif op == Q_SHR:
+            value = 'shift_right({}, {})'.format(self.operand(arg1), self.operand(arg2))
+        else:
+            value = '{} {} {}'.format(self.operand(arg1), C_OPERATORS[op], self.operand(arg2))
+        return ['    {} = {};'.format(self.operand(result), value)]
+
+    def source(self):
+        listing = quad_list(self.quads)
+        labels = set(quad[1] for quad in listing if quad[0] == Q_LABEL)
+        body = [line for number, quad in enumerate(listing, 1) for line in self.statement(quad, labels, number)]
+        lines = ['int main(void)', '{']
+        names = list(self.variables.values()) + ['r' + str(number) for number in sorted(self.registers)]
+        if names:
+            lines.append('    long ' + ', '.join(name + ' = 0' for name in names) + ';')
+        if self.max_steps is not None:
+            lines.append('    long steps = {}L;'.format(self.max_steps))
+        lines.append('    int status = 0;')
+        lines.append('    clock_t started = clock();')
+        lines += body
+        if self.max_steps is not None:
+            lines += ['    goto end;', 'stop:', '    status = {};'.format(C_STOPPED_STATUS)]
+        lines.append('end:')
+        # the time of the run goes to stderr, the variables to stdout
+        lines.append('    fprintf(stderr, "%f\\n", (double) (clock() - started) / CLOCKS_PER_SEC);')
+        for name, c_name in self.variables.items():
+            lines.append('    printf("{} = %ld\\n", {});'.format(name, c_name))
+        lines += ['    return status;', '}']
+        return C_PRELUDE + '\n'.join(lines) + '\n'
+
+
+def c_source(quads, max_steps=None):
+    """Return the C source of a program running the quads of a QuadBuffer."""
+    return CGenerator(quads, max_steps).source()
+
+
+class CBackend(object):
+    """Builds quads into an executable with the C compiler of the system,
+    `$CC` or `cc`, and runs it.
+
+    The compiler is called with -fwrapv, so additions and products that
+    do not fit in a long wrap around instead of being undefined.
+    """
+
+    def __init__(self, compiler=None):
+        self.compiler = compiler or os.environ.get('CC', 'cc')
+
+    def build(self, quads, source_path, max_steps=None):
+        """Write the C source of the quads to `source_path` and build it
+        next to it; return the path of the executable."""
+        with open(source_path, 'w') as outfile:
+            outfile.write(c_source(quads, max_steps))
+        executable = os.path.splitext(source_path)[0] + ('.exe' if os.name == 'nt' else '')
+        command = [self.compiler, '-O2', '-fwrapv', '-o', executable, source_path]
+        built = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if built.returncode != 0:
+            raise Exception('C compiler failed: {}\n{}'.format(' '.join(command), built.stderr))
+        return executable
+
+    @staticmethod
+    def run(executable):
+        """Run a built program; return {name: value} of its variables,
+        the seconds it ran and whether it stopped on its steps."""
+        ran = subprocess.run([os.path.abspath(executable)], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        if ran.returncode == C_FAILED_STATUS:
+            raise BackendError('c: ' + ran.stderr.strip())
+        if ran.returncode not in (0, C_STOPPED_STATUS):
+            raise BackendError('c: the program failed with status {}: {}'.format(ran.returncode, ran.stderr.strip()))
+        environment = OrderedDict()
+        for line in ran.stdout.splitlines():
+            name, value = line.split(' = ')
+            environment[name] = int(value)
+        return environment, float(ran.stderr.split()[-1]), ran.returncode == C_STOPPED_STATUS
+
+
+def run_c(quads, source_path='out.c', max_steps=None):
+    """Build quads with the CBackend and run them, printing the times, the
+    jumps to no label and the variables; return the seconds the program ran."""
+    backend = CBackend()
+    started = time.perf_counter()
+    executable = backend.build(quads, source_path, max_steps)
+    built = time.perf_counter()
+    environment, seconds, stopped = backend.run(executable)
+    print('c: built {} in {:.3f}s, ran in {:.3f}s{}'.format(
+        executable, built - started, seconds, ', stopped' if stopped else ''))
+    unresolved = unresolved_labels(quad_list(quads))
+    if unresolved:
+        print(unresolved_note('c', unresolved))
+    for name, value in environment.items():
+        print('{} = {}'.format(name, value))
+    return seconds
+
+
+def compare_speed(machine, seconds):
+    """Print how many times faster than a QuadMachine run a C program ran."""
+    if seconds > 0:
+        print('c: {:.1f}x the speed of the vm'.format(machine.seconds / seconds))
+    else:
+        print('c: too fast to compare with the vm')
+
+
+###############################################################################
+#                                                                             #
+#  COMPILE SERVER                                                             #
+#                                                                             #
+###############################################################################
+# the options a compile request can give, and their defaults
+COMPILE_OPTIONS = OrderedDict([
+    ('lexer', 'table'),
+    ('parser', 'pratt'),
+    ('dispatch_switches', False),
+    ('short_circuit', False),
+    ('optimize', []),
+    ('registers', None),
+])
+
+# the longest request line a server reads, the source of a program included
+MAX_REQUEST_BYTES = 1 << 26
+
+# JSON-RPC 2.0 error codes; RPC_TIMEOUT is in the range left to servers
+RPC_PARSE_ERROR = -32700
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_INVALID_PARAMS = -32602
+RPC_INTERNAL_ERROR = -32603
+RPC_TIMEOUT = -32000
+
+
+class RpcError(Exception):
+    """A JSON-RPC error, raised by a server method and by CompileClient."""
+
+    def __init__(self, code, message):
+        super(RpcError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def compile_options(options):
+    """Return the options of a compile request with the defaults filled in,
+    raising ValueError for an unknown option or value."""
+    merged = OrderedDict(COMPILE_OPTIONS)
+    for name, value in (options or {}).items():
+        if name not in merged:
+            raise ValueError('unknown option {!r}'.format(name))
+        merged[name] = value
+    # the stream lexer reads a file, a request brings text
+    if merged['lexer'] not in LEXERS or merged['lexer'] == 'stream':
+        raise ValueError('unknown lexer {!r}'.format(merged['lexer']))
+    if merged['parser'] not in PARSERS:
+        raise ValueError('unknown parser {!r}'.format(merged['parser']))
+    if not isinstance(merged['optimize'], list) or any(name not in OPTIMIZATIONS for name in merged['optimize']):
+        raise ValueError('optimize takes a list of {}'.format(', '.join(OPTIMIZATIONS)))
+    registers = merged['registers']
+    if registers is not None and (type(registers) is not int or registers < 0):
+        raise ValueError('registers takes a count, 0 for as many as needed')
+    return merged
+
+
+def compile_source(text, options=None):
+    """Compile the text of a program as main() compiles a file and return
+    what it writes, as a dict.
+
+    `warnings`, `errors`, `symtable` and `quads` hold the text of the
+    files, `quads` being None when the code generation did not start, and
+    `output` what the compilation printed. `exception` is the exception
+    that stopped the compilation, None when it ran to the end.
+    """
+    options = compile_options(options)
+    context = CompilationContext(output=io.StringIO())
+    output = context.output
+    quads = None
+    exception = None
+    started = time.perf_counter()
     try:
-        semantic_analyzer.visit(tree)
+        lexer = LEXERS[options['lexer']](text, context)
+        tree = PARSERS[options['parser']](lexer, context).parse()
+        semantic_analyzer = SemanticAnalyzer(context)
+        try:
+            semantic_analyzer.visit(tree)
+        except Exception as e:
+            print(e, file=output)
+        interpreter = Interpreter(tree, context, options['dispatch_switches'], options['short_circuit'])
+        quads = interpreter.quads
+        interpreter.interpret()
+        if options['short_circuit']:
+            print(interpreter.short_circuit_report(), file=output)
+        quads = optimize(quads, options['optimize'], output)
+        if options['registers'] is not None:
+            quads = allocate_registers(quads, options['registers'] or None, output)
     except Exception as e:
-        print(e)
+        exception = '{}: {}'.format(type(e).__name__, e)
+    return {
+        'quads': format_quads(quads) if quads is not None else None,
+        'warnings': context.warn_file.getvalue(),
+        'errors': context.error_file.getvalue(),
+        'symtable': context.symtable_file.getvalue(),
+        'output': output.getvalue(),
+        'exception': exception,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def report_worker(started):
+    """The initializer of a worker of a CompileServer, telling the server its pid."""
+    started.put(os.getpid())
+
+
+class CompileServer(object):
+    """Serves compiles over JSON-RPC 2.0, one JSON object a line, on a
+    Unix socket or on stdin and stdout.
+
+    Method `compile` takes {"source": text, "options": {...}}, the options
+    of COMPILE_OPTIONS, and returns the dict of compile_source; `ping`
+    returns "pong". The requests of a connection run side by side and are
+    answered as they finish. A compile runs in a pool of `workers`
+    processes, so the module state of the compiler is never shared; one
+    running longer than `timeout` seconds is answered with an RPC_TIMEOUT
+    error and its worker is ended.
+    """
+
+    def __init__(self, workers=None, timeout=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.pool = None
+        # where the workers of the pool put their pids
+        self.started = None
+        self.idle = None
+
+    def new_pool(self):
+        # spawned rather than forked: a fork copies the locks other threads
+        # hold, like the one of stdin while it is read
+        context = multiprocessing.get_context('spawn')
+        self.started = context.SimpleQueue()
+        pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=report_worker,
+                                   initargs=(self.started,))
+        # started now, not by the first compile and on its time
+        for _ in range(self.workers):
+            pool.submit(int)
+        return pool
+
+    def start(self):
+        self.pool = self.new_pool()
+        # a compile is handed to the pool when a worker is free, so its
+        # timeout does not count the wait
+        self.idle = asyncio.Semaphore(self.workers)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def replace_pool(self):
+        # the executor cannot stop a call that is running, so the processes
+        # of the old pool are ended; the calls running in them start again.
+        # A worker runs a call only after putting its pid
+        pool, started = self.pool, self.started
+        self.pool = self.new_pool()
+        while not started.empty():
+            try:
+                os.kill(started.get(), signal.SIGTERM)
+            except OSError:
+                # already gone
+                pass
+        started.close()
+        # the pool sees its processes end and breaks, and then shuts down
+        # at once, but off the event loop, which serves the other requests
+        await asyncio.get_running_loop().run_in_executor(None, partial(pool.shutdown, wait=True,
+                                                                       cancel_futures=True))
+
+    async def compile(self, source, options=None):
+        if not isinstance(source, str):
+            raise RpcError(RPC_INVALID_PARAMS, 'source takes the text of a program')
+        if options is not None and not isinstance(options, dict):
+            raise RpcError(RPC_INVALID_PARAMS, 'options takes an object')
+        try:
+            compile_options(options)
+        except ValueError as e:
+            raise RpcError(RPC_INVALID_PARAMS, str(e))
+        loop = asyncio.get_running_loop()
+        async with self.idle:
+            while True:
+                pool = self.pool
+                try:
+                    return await asyncio.wait_for(loop.run_in_executor(pool, compile_source, source, options),
+                                                  self.timeout)
+                except asyncio.TimeoutError:
+                    await self.replace_pool()
+                    raise RpcError(RPC_TIMEOUT, 'the compile took more than {} seconds'.format(self.timeout))
+                except BrokenProcessPool:
+                    # ended with the pool of another compile that timed out
+                    if pool is self.pool:
+                        await self.replace_pool()
+                        raise RpcError(RPC_INTERNAL_ERROR, 'the worker of the compile died')
+
+    async def ping(self):
+        return 'pong'
+
+    async def respond(self, line):
+        """Return the response to a request line, None for a notification."""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': RPC_PARSE_ERROR, 'message': str(e)}}
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' \
+                or not isinstance(request.get('method'), str):
+            return {'jsonrpc': '2.0', 'id': None,
+                    'error': {'code': RPC_INVALID_REQUEST, 'message': 'not a JSON-RPC 2.0 request'}}
+        method = {'compile': self.compile, 'ping': self.ping}.get(request['method'])
+        params = request.get('params', {})
+        try:
+            if method is None:
+                raise RpcError(RPC_METHOD_NOT_FOUND, 'no method {!r}'.format(request['method']))
+            if not isinstance(params, dict):
+                raise RpcError(RPC_INVALID_PARAMS, 'params takes an object')
+            try:
+                result = await method(**params)
+            except TypeError as e:
+                raise RpcError(RPC_INVALID_PARAMS, str(e))
+            response = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+        except RpcError as e:
+            response = {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': e.code, 'message': e.message}}
+        return response if 'id' in request else None
+
+    async def serve_lines(self, readline, write):
+        """Answer the request lines `readline` returns, until it returns
+        b'', writing each response line with `write`."""
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def answer(line):
+            response = await self.respond(line)
+            if response is not None:
+                async with lock:
+                    await write((json.dumps(response) + '\n').encode('utf-8'))
+
+        while True:
+            line = await readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(answer(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+
+    async def serve_connection(self, reader, writer):
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            await self.serve_lines(reader.readline, write)
+        except asyncio.CancelledError:
+            # the server is stopping
+            pass
+        finally:
+            writer.close()
+
+    async def serve_socket(self, path):
+        """Serve the connections to the Unix socket at `path` until cancelled."""
+        self.start()
+        # ended like an interrupt, so the socket is removed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        server = await asyncio.start_unix_server(self.serve_connection, path, limit=MAX_REQUEST_BYTES)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def serve_stdio(self):
+        """Serve the requests on stdin until it ends."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+
+        # the pipes are read and written by threads, which works on Windows as well
+        async def readline():
+            return await loop.run_in_executor(None, stdin.readline, MAX_REQUEST_BYTES)
+
+        async def write(data):
+            stdout.write(data)
+            await loop.run_in_executor(None, stdout.flush)
+
+        try:
+            await self.serve_lines(readline, write)
+        finally:
+            self.stop()
+
+
+class CompileClient(object):
+    """A blocking client of a CompileServer, through its Unix socket or
+    the stdin and stdout of a server process it starts.
+
+        client = CompileClient.spawn()
+        result = client.compile(text, optimize=['fold'])
+    """
+
+    def __init__(self, reader, writer, closing=None):
+        self.reader = reader
+        self.writer = writer
+        self.closing = closing
+        self.ids = count(1)
+
+    @classmethod
+    def connect(cls, path):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+        return cls(connection.makefile('rb'), connection.makefile('wb'), connection)
+
+    @classmethod
+    def spawn(cls, workers=None, timeout=None):
+        command = [sys.executable, os.path.abspath(__file__), '--serve']
+        if workers is not None:
+            command += ['--workers', str(workers)]
+        if timeout is not None:
+            command += ['--timeout', str(timeout)]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return cls(process.stdout, process.stdin, process)
+
+    def call(self, method, params=None):
+        """Call a method of the server and return its result, raising RpcError for an error."""
+        request = {'jsonrpc': '2.0', 'id': next(self.ids), 'method': method, 'params': params or {}}
+        self.writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        self.writer.flush()
+        line = self.reader.readline()
+        if not line:
+            raise RpcError(RPC_INTERNAL_ERROR, 'the server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RpcError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def compile(self, source, **options):
+        return self.call('compile', {'source': source, 'options': options})
+
+    def close(self):
+        self.writer.close()
+        self.reader.close()
+        if isinstance(self.closing, subprocess.Popen):
+            self.closing.wait()
+        elif self.closing is not None:
+            self.closing.close()
+
+
+def benchmark_server(source_path, rounds):
+    """Compile a file `rounds` times by starting compiler.py and reading its
+    files back, as the GUI does, and `rounds` times through a CompileServer
+    on stdin and stdout, printing the latencies."""
+    with open(source_path, 'r') as source:
+        text = source.read()
+    directory = tempfile.mkdtemp()
+    spawned = []
+    try:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            # without the compile cache, which would answer every round
+            # after the first and leave the spawn nothing to measure
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--no-cache', os.path.abspath(source_path)],
+                           cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for name in ('warns.txt', 'errors.txt', 'out.txt', 'symtable.txt'):
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    with open(path, 'r') as infile:
+                        infile.read()
+            # the GUI deletes the symbol table it read
+            if os.path.exists(os.path.join(directory, 'symtable.txt')):
+                os.remove(os.path.join(directory, 'symtable.txt'))
+            spawned.append(time.perf_counter() - started)
+    finally:
+        shutil.rmtree(directory)
+    started = time.perf_counter()
+    client = CompileClient.spawn(workers=1)
+    try:
+        client.call('ping')
+        startup = time.perf_counter() - started
+        served = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            client.compile(text)
+            served.append(time.perf_counter() - started)
+    finally:
+        client.close()
+    print('spawn: {} compiles, median {:.1f}ms, mean {:.1f}ms'.format(
+        rounds, statistics.median(spawned) * 1000, statistics.mean(spawned) * 1000))
+    print('server: {} compiles, median {:.1f}ms, mean {:.1f}ms, after starting in {:.1f}ms'.format(
+        rounds, statistics.median(served) * 1000, statistics.mean(served) * 1000, startup * 1000))
+    print('server: {:.1f}x faster'.format(statistics.median(spawned) / statistics.median(served)))
 
-    interpreter = Interpreter(tree, warn_file, error_file)
-    with open("out.txt", 'w') as outfile:
-        global out_file
-        out_file = outfile
-        interpreter.interpret()
+
+###############################################################################
+#                                                                             #
+#  COMPILE CACHE                                                              #
+#                                                                             #
+###############################################################################
+# the most a compile cache holds unless told otherwise
+CACHE_MAX_BYTES = 256 << 20
+# the entries are spread over this many directories, each holding its
+# share of the size and evicting on its own
+CACHE_DIRECTORIES = 256
+# what an entry keeps of a compile, the keys of compile_source's dict
+CACHE_FIELDS = ('quads', 'warnings', 'errors', 'symtable', 'output')
+
+
+def default_cache_dir():
+    """Return the directory of the compile cache: $COMPILER_CACHE_DIR, or
+    `compiler` in the cache directory of the user."""
+    directory = os.environ.get('COMPILER_CACHE_DIR')
+    if directory:
+        return directory
+    base = (os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'compiler')
+
+
+class CompileCache(object):
+    """The results of successful compiles, kept in `directory` under a hash
+    of the compiler's own source, the options and the program, so a
+    program compiled again with the same options is not lexed, parsed,
+    analyzed or translated.
+
+    An entry holds the CACHE_FIELDS of compile_source's dict as
+    compressed JSON. It is written aside and renamed into place, so a
+    reader never finds half an entry and processes can share the cache. A
+    hit marks the entry as just used; after a store the least recently
+    used entries of its directory go until it holds its share of
+    `max_bytes`. `hits`, `misses`, `stores` and `evictions` count what
+    this object did. A cache that cannot be read or written acts as if
+    it were empty.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        with open(os.path.abspath(__file__), 'rb') as infile:
+            self.version = hashlib.sha256(infile.read()).hexdigest()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def key(self, text, options=None):
+        """Return the key of compiling `text` with the options of compile_options."""
+        digest = hashlib.sha256()
+        digest.update('{}\n{}\n'.format(self.version, json.dumps(compile_options(options), sort_keys=True)).encode())
+        digest.update(text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + '.json.z')
+
+    def get(self, key):
+        """Return the CACHE_FIELDS kept under `key`, None if there are none."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as infile:
+                entry = json.loads(zlib.decompress(infile.read()).decode())
+            os.utime(path)
+        except (OSError, ValueError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, result):
+        """Keep the CACHE_FIELDS of a compile under `key`."""
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        data = zlib.compress(json.dumps(dict((field, result[field]) for field in CACHE_FIELDS)).encode())
+        try:
+            os.makedirs(directory, exist_ok=True)
+            handle, partial = tempfile.mkstemp(dir=directory, prefix='.', suffix='.partial')
+            try:
+                with os.fdopen(handle, 'wb') as outfile:
+                    outfile.write(data)
+                os.replace(partial, path)
+            except BaseException:
+                os.unlink(partial)
+                raise
+        except OSError:
+            return
+        self.stores += 1
+        self.evict(directory, path)
+
+    def evict(self, directory, kept):
+        """Remove the least recently used entries of `directory` but `kept`
+        until it holds no more than its share of `max_bytes`."""
+        total = 0
+        entries = []
+        try:
+            scanned = list(os.scandir(directory))
+        except OSError:
+            return
+        for entry in scanned:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            total += stat.st_size
+            if entry.path != kept:
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        share = self.max_bytes // CACHE_DIRECTORIES
+        entries.sort()
+        for _, path, size in entries:
+            if total <= share:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except OSError:
+                # taken by another process
+                continue
+            self.evictions += 1
+
+    def compile(self, text, options=None):
+        """Return compile_source's dict for `text`, from the cache when it
+        has the compile and keeping it there when it succeeds; `cached`
+        tells which."""
+        key = self.key(text, options)
+        started = time.perf_counter()
+        entry = self.get(key)
+        if entry is not None:
+            entry.update(exception=None, seconds=time.perf_counter() - started, cached=True)
+            return entry
+        result = compile_source(text, options)
+        if result['exception'] is None:
+            self.put(key, result)
+        result['cached'] = False
+        return result
+
+    def report(self):
+        return 'cache: {} hits, {} misses, {} stored, {} evicted'.format(
+            self.hits, self.misses, self.stores, self.evictions)
+
+    def usage(self):
+        """Return the number of entries and the bytes they take."""
+        entries = size = 0
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.startswith('.'):
+                    try:
+                        size += os.path.getsize(os.path.join(directory, name))
+                    except OSError:
+                        continue
+                    entries += 1
+        return entries, size
+
+
+###############################################################################
+#                                                                             #
+#  INCREMENTAL COMPILER                                                       #
+#                                                                             #
+###############################################################################
+# how often --watch looks at the source for a change, in seconds
+WATCH_INTERVAL = 0.2
+
+
+def statement_fingerprint(text, start, end):
+    """Return the fingerprint of the source of a statement, `text[start:end]`."""
+    return hashlib.blake2b(text[start:end].encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def common_prefix(a, b):
+    """Return the length of the longest common prefix of two strings."""
+    low, high = 0, min(len(a), len(b))
+    # a binary search comparing slices, which runs at memcmp speed
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix(a, b, limit):
+    """Return the length, at most `limit`, of the longest common suffix of two strings."""
+    low, high = 0, min(len(a), len(b), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class IncrementalLexer(object):
+    """Stands in for `lexer` on a new version of a source, scanning only
+    what differs from the `previous_text` it scanned into `previous`.
+
+    The lexers keep no state between tokens, so the tokens of `previous`
+    that end before the first changed character stay as they are, and
+    once a scan from there ends a token where one of the old tokens
+    after the last changed character ended, the old tokens after it
+    follow, moved by the change in length. `scanned` counts the tokens
+    scanned again.
+    """
+
+    def __init__(self, lexer, previous_text=None, previous=None):
+        self.lexer = lexer
+        self.text = lexer.text
+        self.lines = lexer.lines
+        self.previous_text = previous_text
+        self.previous = previous
+        self.scanned = 0
+
+    def tokenize(self):
+        lexer = self.lexer
+        previous = self.previous
+        if previous is None:
+            tokens = lexer.tokenize()
+            self.scanned = len(tokens)
+            return tokens
+        text = self.text
+        old_text = self.previous_text
+        prefix = common_prefix(old_text, text)
+        suffix = common_suffix(old_text, text, min(len(old_text), len(text)) - prefix)
+        shift = len(text) - len(old_text)
+        old_ends = previous.ends
+        # the last entry is the EOF or ERROR
+        last = len(previous) - 1
+        kept = bisect_left(old_ends, prefix, 0, last)
+        tokens = TokenBuffer(text, self.lines)
+        tokens.kinds = previous.kinds[:kept]
+        tokens.starts = previous.starts[:kept]
+        tokens.ends = old_ends[:kept]
+        tokens.value_ids = previous.value_ids[:kept]
+        tokens.values = list(previous.values)
+        tokens.value_index = dict(previous.value_index)
+        pos = old_ends[kept - 1] if kept else 0
+        if previous.kinds[last] == K_EOF and suffix:
+            # an old token end in the common suffix
+            following = bisect_left(old_ends, len(old_text) - suffix, kept, last)
+            while following < last:
+                lexer.tokenize(tokens, pos, old_ends[following] + shift)
+                if tokens.kinds and (tokens.kinds[-1] == K_EOF or tokens.kinds[-1] == K_ERROR):
+                    break
+                pos = lexer.pos
+                following = bisect_left(old_ends, pos - shift, following, last)
+                if following < last and old_ends[following] + shift == pos:
+                    self.scanned = len(tokens) - kept
+                    following += 1
+                    tokens.kinds.extend(previous.kinds[following:])
+                    tokens.starts.extend(map(shift.__add__, previous.starts[following:]))
+                    tokens.ends.extend(map(shift.__add__, old_ends[following:]))
+                    tokens.value_ids.extend(previous.value_ids[following:])
+                    return tokens
+            else:
+                lexer.tokenize(tokens, pos)
+        else:
+            lexer.tokenize(tokens, pos)
+        self.scanned = len(tokens) - kept
+        return tokens
+
+
+def symbol_signature(symbol):
+    """Return what the scope listings show of a symbol, None for no symbol."""
+    return None if symbol is None else repr(symbol)
+
+
+class RecordingSymbolTable(ScopedSymbolTable):
+    """The global scope of an incremental compile.
+
+    Since the last `begin` it notes the symbols inserted, and the
+    signature of every symbol looked up by a name not inserted since, what
+    the statement being analyzed takes from the statements before it.
+    """
+
+    def __init__(self, scope_name, scope_level, enclosing_scope=None, symtable_file=None):
+        super(RecordingSymbolTable, self).__init__(scope_name, scope_level, enclosing_scope, symtable_file)
+        self.begin()
+
+    def begin(self):
+        self.inserted = []
+        self.inserted_names = set()
+        self.looked_up = {}
+
+    def insert(self, symbol):
+        self.inserted.append(symbol)
+        self.inserted_names.add(symbol.name)
+        super(RecordingSymbolTable, self).insert(symbol)
+
+    def lookup(self, name, current_scope_only=False):
+        symbol = super(RecordingSymbolTable, self).lookup(name, current_scope_only)
+        if name not in self.inserted_names and name not in self.looked_up:
+            self.looked_up[name] = symbol_signature(symbol)
+        return symbol
+
+
+class StatementAnalyzer(SemanticAnalyzer):
+    """SemanticAnalyzer of one top-level statement at a time; `duplicates`
+    holds the variables it warned about, to warn again where they are in
+    a later version of the source."""
+
+    def __init__(self, context):
+        super(StatementAnalyzer, self).__init__(context)
+        self.duplicates = []
+
+    def duplicate(self, var):
+        self.duplicates.append(var)
+        super(StatementAnalyzer, self).duplicate(var)
+
+
+class StatementAnalysis(object):
+    """What the semantic analysis of a top-level statement took from the
+    global scope, the symbols it inserted there and what it wrote."""
+
+    def __init__(self, scope, analyzer):
+        context = analyzer.context
+        self.looked_up = scope.looked_up
+        self.inserted = scope.inserted
+        self.duplicates = analyzer.duplicates
+        self.output = context.output.getvalue()
+        self.symtable = context.symtable_file.getvalue()
+
+    def holds(self, scope):
+        """Tell if the symbols the statement looked up are still the same in `scope`."""
+        symbols = scope._symbols
+        return all(symbol_signature(symbols.get(name)) == signature for name, signature in self.looked_up.items())
+
+    def replay(self, scope):
+        """Insert the statement's symbols into `scope` again, unnoted."""
+        for symbol in self.inserted:
+            ScopedSymbolTable.insert(scope, symbol)
+
+
+class ScopeOverlay(dict):
+    """The GLOBAL_SCOPE of an Interpreter of one statement. What it stores
+    stays in the overlay; a name it reads that it did not store is read
+    from `base` and noted in `reads`."""
+
+    def __init__(self, base):
+        super(ScopeOverlay, self).__init__()
+        self.base = base
+        self.reads = set()
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        self.reads.add(name)
+        return self.base.get(name, default)
+
+
+class StatementInterpreter(Interpreter):
+    """Interpreter of one top-level statement into a QuadBuffer of its own,
+    numbering registers and labels from the start of its context. It notes
+    the declarations it makes in `declarations` instead of making them."""
+
+    def __init__(self, context, scope, dispatch_switches=False, short_circuit=False):
+        super(StatementInterpreter, self).__init__(None, context, dispatch_switches, short_circuit)
+        self.GLOBAL_SCOPE = ScopeOverlay(scope)
+        self.declarations = []
+
+    def declare(self, var_name, is_const):
+        self.declarations.append((var_name, is_const))
+
+
+class QuadFragment(object):
+    """The quads of one top-level statement, as a StatementInterpreter left
+    them, with the variables it read and stored and the declarations it
+    made."""
+
+    def __init__(self, interpreter):
+        self.code = interpreter.quads.code
+        self.values = interpreter.quads.values
+        self.registers = interpreter.context.register_id
+        self.labels = interpreter.context.label_id - 1
+        self.reads = interpreter.GLOBAL_SCOPE.reads
+        self.stores = dict(interpreter.GLOBAL_SCOPE)
+        self.declarations = interpreter.declarations
+        self.counts = (interpreter.logical_quads, interpreter.saved_registers, interpreter.comparisons,
+                       interpreter.conditional_comparisons)
+        # the last code placed and where
+        self.placement = None
+
+    def holds(self, scope):
+        """Tell if the variables the statement read still have values in `scope`."""
+        return all(scope.get(name) is not None for name in self.reads)
+
+    def place(self, quads, register_base, label_base):
+        """Return the code of the fragment in the program `quads`, its values
+        interned there in the order the statement interned them and its
+        registers and labels numbered from `register_base` and `label_base`."""
+        ids = tuple(quads.intern(O_NONE, value) >> OPERAND_KIND_BITS for value in self.values)
+        key = (register_base, label_base, ids)
+        if self.placement is not None and self.placement[0] == key:
+            return self.placement[1]
+        code = self.code
+        operands = set(code[1::4])
+        operands.update(code[2::4])
+        operands.update(code[3::4])
+        register_shift = register_base << OPERAND_KIND_BITS
+        label_shift = (label_base - 1) << OPERAND_KIND_BITS
+        placed_operands = {}
+        for operand in operands:
+            kind = operand & OPERAND_KIND_MASK
+            if kind == O_TEMP:
+                placed_operands[operand] = operand + register_shift
+            elif kind == O_LABEL:
+                placed_operands[operand] = operand + label_shift
+            elif kind == O_NONE:
+                placed_operands[operand] = operand
+            else:
+                placed_operands[operand] = ids[operand >> OPERAND_KIND_BITS] << OPERAND_KIND_BITS | kind
+        placed = array('q', code)
+        get = placed_operands.__getitem__
+        for field in (1, 2, 3):
+            placed[field::4] = array('q', map(get, code[field::4]))
+        self.placement = (key, placed)
+        return placed
+
+
+class TopLevelStatement(object):
+    """A top-level statement of an incremental compile: its tree, in an
+    arena of its own whose origin is the statement's first token, the
+    `size` tokens and `length` characters it spans and the fingerprint of
+    its source, and what analyzing and translating it gave."""
+
+    def __init__(self, root, size, length, fingerprint):
+        self.root = root
+        self.size = size
+        self.length = length
+        self.fingerprint = fingerprint
+        # an if without else would take an else after it
+        self.open_if = isinstance(root, IfStat) and root.cmpd2 is None
+        self.analysis = None
+        self.fragment = None
+
+    def matches(self, text, tokens, index):
+        """Tell if the statement is the one parsed from token `index` of
+        the TokenBuffer `tokens` of `text`: the same source, from the
+        start of a token, lexes to the same tokens and parses to the same
+        tree."""
+        if self.fingerprint is None or index + self.size >= len(tokens):
+            return False
+        start = tokens.starts[index]
+        end = tokens.ends[index + self.size - 1]
+        if end - start != self.length or statement_fingerprint(text, start, end) != self.fingerprint:
+            return False
+        return not (self.open_if and tokens.kinds[index + self.size] == K_ELSE)
+
+    def move(self, start, lines):
+        """Position the tree at offset `start` of the source indexed by `lines`."""
+        self.root.arena.origin = start
+        self.root.arena.lines = lines
+
+
+class IncrementalCompiler(object):
+    """Compiles version after version of one program, as an editor saves
+    it, redoing only what an edit invalidated. `compile` returns the dict
+    compile_source returns for the same text and options, byte for byte.
+
+    Each top-level statement of Parser.statement_list is kept as a
+    TopLevelStatement. In the next version a statement is looked for
+    where the previous statement ended and at its old distance from the
+    end of the source, which finds the statements before and after an
+    edit, and is taken when the fingerprint of its source matches. It is
+    not parsed again; its semantic analysis is replayed unless a symbol
+    it looked up in the global scope changed, and its quads are renumbered
+    into the program's unless a variable it read lost its value. Only the
+    source around an edit is lexed again, through an IncrementalLexer;
+    the optimizations and register allocation run over the whole program.
+
+    `scanned` counts the tokens of the last compile lexed again, and
+    `reused`, `parsed`, `analyzed` and `translated` the statements taken
+    as they were, and those parsed, analyzed and translated again.
+    """
+
+    def __init__(self, options=None):
+        self.options = compile_options(options)
+        self.statements = []
+        # the statements by their distance from the end of the source
+        self.tails = {}
+        # the last version lexed and its tokens
+        self.text = self.tokens = None
+        self.scanned = self.reused = self.parsed = self.analyzed = self.translated = 0
+
+    def compile(self, text):
+        options = self.options
+        context = CompilationContext(output=io.StringIO())
+        output = context.output
+        quads = None
+        exception = None
+        started = time.perf_counter()
+        self.scanned = self.reused = self.parsed = self.analyzed = self.translated = 0
+        try:
+            lexer = IncrementalLexer(LEXERS[options['lexer']](text, context), self.text, self.tokens)
+            parser = PARSERS[options['parser']](lexer, context)
+            self.text, self.tokens = text, parser.tokens
+            self.scanned = lexer.scanned
+            statements = self.parse(parser, text)
+            self.analyze(statements, context)
+            interpreter = Interpreter(None, context, options['dispatch_switches'], options['short_circuit'])
+            quads = interpreter.quads
+            self.translate(statements, interpreter)
+            if options['short_circuit']:
+                print(interpreter.short_circuit_report(), file=output)
+            quads = optimize(quads, options['optimize'], output)
+            if options['registers'] is not None:
+                quads = allocate_registers(quads, options['registers'] or None, output)
+        except Exception as e:
+            exception = '{}: {}'.format(type(e).__name__, e)
+        return {
+            'quads': format_quads(quads) if quads is not None else None,
+            'warnings': context.warn_file.getvalue(),
+            'errors': context.error_file.getvalue(),
+            'symtable': context.symtable_file.getvalue(),
+            'output': output.getvalue(),
+            'exception': exception,
+            'seconds': time.perf_counter() - started,
+        }
+
+    def parse(self, parser, text):
+        """Return the top-level statements of `text` as Parser.parse would
+        find them, taking those of the last version that match."""
+        tokens = parser.tokens
+        kinds = tokens.kinds
+        starts = tokens.starts
+        ends = tokens.ends
+        lines = parser.nodes.lines
+        previous = self.statements
+        tails = self.tails
+        statements = []
+        # the statement of the last version after the last one matched
+        following = 0
+        index = 0
+        # the first statement is parsed whatever the first token
+        while not statements or (1 << kinds[index]) & STATEMENT_FIRST:
+            start = starts[index]
+            statement = None
+            for candidate in (following, tails.get(len(text) - start)):
+                if candidate is not None and candidate < len(previous) \
+                        and previous[candidate].matches(text, tokens, index):
+                    statement = previous[candidate]
+                    statement.move(start, lines)
+                    following = candidate + 1
+                    self.reused += 1
+                    break
+            if statement is None:
+                parser.nodes = NodeArena(lines, start)
+                parser.index = index
+                parser.current_kind = kinds[index]
+                root = parser.statement()
+                size = parser.index - index
+                if size:
+                    end = ends[parser.index - 1]
+                    statement = TopLevelStatement(root, size, end - start, statement_fingerprint(text, start, end))
+                else:
+                    statement = TopLevelStatement(root, 0, 0, None)
+                self.parsed += 1
+            statements.append(statement)
+            index += statement.size
+        parser.index = index
+        parser.current_kind = kinds[index]
+        if parser.current_kind != K_EOF:
+            parser.error()
+        self.statements = statements
+        self.tails = {}
+        offset = 0
+        for i, statement in enumerate(statements):
+            self.tails[len(text) - starts[offset]] = i
+            offset += statement.size
+        return statements
+
+    def analyze(self, statements, context):
+        """Run the semantic analysis of the program over `statements`, as
+        SemanticAnalyzer.visit would, and print what stopped it."""
+        output = context.output
+        print('ENTER scope: global', file=output)
+        scope = RecordingSymbolTable('global', 1, symtable_file=context.symtable_file)
+        scope._init_builtins()
+        analyzer = StatementAnalyzer(context)
+        analyzer.current_scope = scope
+        for statement in statements:
+            analysis = statement.analysis
+            if analysis is None or not analysis.holds(scope):
+                scope.begin()
+                analyzer.context = CompilationContext(output=io.StringIO())
+                analyzer.duplicates = []
+                try:
+                    analyzer.visit(statement.root)
+                except Exception as e:
+                    # what the statement wrote before it stopped
+                    output.write(analyzer.context.output.getvalue())
+                    context.warn_file.write(analyzer.context.warn_file.getvalue())
+                    context.error_file.write(analyzer.context.error_file.getvalue())
+                    context.symtable_file.write(analyzer.context.symtable_file.getvalue())
+                    print(e, file=output)
+                    return
+                analysis = statement.analysis = StatementAnalysis(scope, analyzer)
+                self.analyzed += 1
+            else:
+                analysis.replay(scope)
+            output.write(analysis.output)
+            context.symtable_file.write(analysis.symtable)
+            analyzer.context = context
+            for var in analysis.duplicates:
+                SemanticAnalyzer.duplicate(analyzer, var)
+        analyzer.context = context
+        analyzer.close_scope(None)
+
+    def translate(self, statements, interpreter):
+        """Generate the quads of `statements` into the QuadBuffer of the
+        program's `interpreter`, as its visit of the program would."""
+        context = interpreter.context
+        quads = interpreter.quads
+        scope = interpreter.GLOBAL_SCOPE
+        dispatch_switches = interpreter.dispatch_switches
+        short_circuit = interpreter.short_circuit
+        for statement in statements:
+            fragment = statement.fragment
+            if fragment is None or not fragment.holds(scope):
+                translator = StatementInterpreter(CompilationContext(), scope, dispatch_switches, short_circuit)
+                try:
+                    translator.visit(statement.root)
+                except Exception:
+                    # the quads the statement generated before it stopped
+                    quads.code.extend(QuadFragment(translator).place(quads, context.register_id, context.label_id))
+                    context.error_file.write(translator.context.error_file.getvalue())
+                    raise
+                fragment = statement.fragment = QuadFragment(translator)
+                self.translated += 1
+            quads.code.extend(fragment.place(quads, context.register_id, context.label_id))
+            context.register_id += fragment.registers
+            context.label_id += fragment.labels
+            scope.update(fragment.stores)
+            for var_name, is_const in fragment.declarations:
+                interpreter.declare(var_name, is_const)
+            logical_quads, saved_registers, comparisons, conditional_comparisons = fragment.counts
+            interpreter.logical_quads += logical_quads
+            interpreter.saved_registers += saved_registers
+            interpreter.comparisons += comparisons
+            interpreter.conditional_comparisons += conditional_comparisons
+
+    def report(self):
+        return 'incremental: {} tokens scanned, {} of {} statements reused, {} parsed, {} analyzed, {} translated'.format(
+            self.scanned, self.reused, len(self.statements), self.parsed, self.analyzed, self.translated)
+
+
+def watch(path, options=None, interval=WATCH_INTERVAL):
+    """Compile the program at `path` as main() compiles it, and again each
+    time the file changes, until interrupted; a compile after the first
+    only redoes what the change invalidated."""
+    compiler = IncrementalCompiler(options)
+    seen = None
+    try:
+        while True:
+            try:
+                stat = os.stat(path)
+                version = (stat.st_mtime_ns, stat.st_size)
+                if version != seen:
+                    with open(path, 'r') as source:
+                        text = source.read()
+                    seen = version
+                else:
+                    text = None
+            except OSError:
+                # an editor replacing the file
+                text = None
+            if text is not None:
+                result = compiler.compile(text)
+                sys.stdout.write(result['output'])
+                write_outputs(result['warnings'], result['errors'], result['symtable'], result['quads'])
+                if result['exception'] is not None:
+                    print(result['exception'])
+                print('{} in {:.3f}s'.format(compiler.report(), result['seconds']))
+                sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+###############################################################################
+#                                                                             #
+#  BATCH COMPILER                                                             #
+#                                                                             #
+###############################################################################
+# the files taken from a directory given to --batch
+BATCH_PATTERN = '*.txt'
+# the most sources a --batch task compiles when no chunk size is given
+BATCH_CHUNK_LIMIT = 64
+# the slowest sources listed after a batch
+BATCH_SLOWEST = 10
+# the files main() writes, each for a key of compile_source's dict
+BATCH_FILES = (('warns.txt', 'warnings'), ('errors.txt', 'errors'), ('symtable.txt', 'symtable'),
+               ('out.txt', 'quads'))
+
+
+def _has_wildcard(text):
+    return any(char in text for char in '*?[')
+
+
+def _glob_root(pattern):
+    """Return the directories of a glob before its first wildcard."""
+    parts = []
+    for part in os.path.normpath(os.path.dirname(pattern)).split(os.sep):
+        if _has_wildcard(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def _input_sources(entry, pattern):
+    """Yield the (path, relative path) of the sources of one input of batch_sources."""
+    if os.path.isdir(entry):
+        for directory, subdirectories, files in os.walk(entry):
+            subdirectories.sort()
+            for name in sorted(fnmatch.filter(files, pattern)):
+                path = os.path.join(directory, name)
+                yield path, os.path.relpath(path, entry)
+    elif _has_wildcard(entry):
+        root = _glob_root(entry)
+        for path in sorted(glob.glob(entry, recursive=True)):
+            if os.path.isfile(path):
+                yield path, os.path.relpath(path, root)
+    elif os.path.isfile(entry):
+        yield entry, os.path.basename(entry)
+
+
+def batch_sources(inputs, pattern=BATCH_PATTERN, exclude=None):
+    """Return the (path, relative path) of the sources named by `inputs`,
+    sorted by relative path, the place of the source in the output tree.
+
+    An input is a file, a directory, whose files matching `pattern` keep
+    their path below it, a glob, whose files keep their path below the
+    directories before its first wildcard, or @FILE, a manifest of such
+    inputs one a line, relative to its directory, blank lines and those
+    starting with # left out. A file named twice is taken once, the files
+    below the directory `exclude`, the output tree, not at all. Raises
+    ValueError for an input naming no source and for two sources with
+    the same relative path.
+    """
+    entries = []
+    for entry in inputs:
+        if entry.startswith('@'):
+            with open(entry[1:], 'r') as manifest:
+                lines = [line.strip() for line in manifest]
+            base = os.path.dirname(entry[1:])
+            entries += [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+        else:
+            entries.append(entry)
+    sources = OrderedDict()
+    seen = set()
+    excluded = os.path.join(os.path.realpath(exclude), '') if exclude is not None else None
+    for entry in entries:
+        found = False
+        for path, relative in _input_sources(entry, pattern):
+            found = True
+            real = os.path.realpath(path)
+            if real in seen or excluded is not None and real.startswith(excluded):
+                continue
+            seen.add(real)
+            relative = os.path.normpath(relative)
+            if relative in sources:
+                raise ValueError('{} and {} both go to {}'.format(sources[relative], path, relative))
+            sources[relative] = path
+        if not found:
+            raise ValueError('no source in {}'.format(entry))
+    return [(sources[relative], relative) for relative in sorted(sources)]
+
+
+def write_batch_outputs(directory, result):
+    """Write the files main() writes for the compile `result` of
+    compile_source into `directory`, the symbol table rows on their own.
+    out.txt and symtable.txt are removed when the code generation did not
+    start, so a tree compiled again holds no files of an earlier run."""
+    os.makedirs(directory, exist_ok=True)
+    for name, key in BATCH_FILES:
+        path = os.path.join(directory, name)
+        if result['quads'] is None and key in ('symtable', 'quads'):
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        with open(path, 'w') as outfile:
+            outfile.write(result[key])
+
+
+def compile_batch_chunk(chunk, output_dir, options, cache_dir=None, cache_bytes=CACHE_MAX_BYTES):
+    """Compile the (path, relative path) sources of `chunk`, each into the
+    directory of its relative path below `output_dir`, through a
+    CompileCache in `cache_dir` if there is one. Returns the seconds and
+    the exception of each, and the hits, misses, stores and evictions of
+    the cache; a source that cannot be read is not compiled and gets no
+    files."""
+    cache = CompileCache(cache_dir, cache_bytes) if cache_dir is not None else None
+    results = []
+    for path, relative in chunk:
+        try:
+            with open(path, 'r') as source:
+                text = source.read()
+        except (OSError, UnicodeDecodeError) as e:
+            results.append((0.0, '{}: {}'.format(type(e).__name__, e)))
+            continue
+        result = cache.compile(text, options) if cache is not None else compile_source(text, options)
+        write_batch_outputs(os.path.join(output_dir, relative), result)
+        results.append((result['seconds'], result['exception']))
+    if cache is None:
+        return results, (0, 0, 0, 0)
+    return results, (cache.hits, cache.misses, cache.stores, cache.evictions)
+
+
+def compile_batch(sources, output_dir, options=None, workers=None, chunk_size=None, cache_dir=None,
+                  cache_bytes=CACHE_MAX_BYTES):
+    """Compile the (path, relative path) `sources` of batch_sources into the
+    tree `output_dir` in a pool of `workers` processes, and return the
+    (seconds, exception) of each source, in their order, and the hits,
+    misses, stores and evictions of the CompileCache in `cache_dir`, if
+    there is one, which the workers share.
+
+    The sources are handed out in chunks of `chunk_size`, by default
+    enough for several chunks a worker, and only a few chunks a worker
+    are submitted at once, so the pool holds little of a long list. Each
+    compile has its own CompilationContext, so its files only depend on
+    its source and the options, whichever worker and chunk it falls in.
+    """
+    options = compile_options(options)
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, min(BATCH_CHUNK_LIMIT, len(sources) // (workers * 4)))
+    chunks = [sources[start:start + chunk_size] for start in range(0, len(sources), chunk_size)]
+    if not chunks:
+        return [], (0, 0, 0, 0)
+    workers = min(workers, len(chunks))
+    results = [None] * len(chunks)
+    counts = [0, 0, 0, 0]
+    pending = {}
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for index, chunk in enumerate(chunks):
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+            pending[pool.submit(compile_batch_chunk, chunk, output_dir, options, cache_dir, cache_bytes)] = index
+        for future in pending:
+            results[pending[future]] = future.result()
+    for _, chunk_counts in results:
+        counts = [total + count for total, count in zip(counts, chunk_counts)]
+    return [result for chunk_results, _ in results for result in chunk_results], tuple(counts)
+
+
+def run_batch(sources, output_dir, options=None, workers=None, chunk_size=None, cache_dir=None,
+              cache_bytes=CACHE_MAX_BYTES):
+    """Compile the `sources` of batch_sources into the tree `output_dir` as
+    compile_batch does and print how fast, the use of the cache, the
+    failures and the slowest sources. Returns the number of sources that
+    failed."""
+    started = time.perf_counter()
+    results, counts = compile_batch(sources, output_dir, options, workers, chunk_size, cache_dir, cache_bytes)
+    seconds = time.perf_counter() - started
+    failures = [(relative, exception) for (_, relative), (_, exception) in zip(sources, results)
+                if exception is not None]
+    print('batch: {} sources in {:.2f}s, {:.1f} a second, {} failed'.format(
+        len(sources), seconds, len(sources) / seconds if seconds else 0.0, len(failures)))
+    if cache_dir is not None:
+        cache = CompileCache(cache_dir, cache_bytes)
+        cache.hits, cache.misses, cache.stores, cache.evictions = counts
+        print(cache.report())
+    for relative, exception in failures:
+        print('failed: {}: {}'.format(relative, exception))
+    timings = [(compiled, relative) for (_, relative), (compiled, _) in zip(sources, results)]
+    for compiled, relative in heapq.nlargest(BATCH_SLOWEST, timings):
+        print('slowest: {:.3f}s {}'.format(compiled, relative))
+    return len(failures)
+
+
+def main():
+    import argparse
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('source', nargs='*',
+                            help='the program to compile; with --batch any number of files, directories, globs '
+                                 'and @manifests listing them')
+    arg_parser.add_argument('--lexer', choices=sorted(LEXERS), default='table',
+                            help='scanner engine, `legacy` is the original char-by-char Lexer, '
+                                 '`stream` scans the file in place without reading it into memory')
+    arg_parser.add_argument('--parser', choices=sorted(PARSERS), default='pratt',
+                            help='expression parser, `recursive` is the original recursive descent Parser')
+    arg_parser.add_argument('--dispatch-switches', action='store_true',
+                            help='jump straight to the case of a switch of {} or more cases, through a jump table '
+                                 'when the values are dense or a tree of comparisons'.format(SWITCH_DISPATCH_MIN_CASES))
+    arg_parser.add_argument('--short-circuit', action='store_true',
+                            help='compile the and, or and not of if and loop conditions to jumps, skipping the '
+                                 'right side when the left side decides')
+    arg_parser.add_argument('--optimize', action='append', choices=list(OPTIMIZATIONS), default=[],
+                            help='run an optimization pass over the quads, may be given more than once; '
+                                 '`dce` and `strength` keep the last value of every variable, `dce-all` and '
+                                 '`strength-all` only what is read')
+    arg_parser.add_argument('--registers', type=int, metavar='N',
+                            help='reuse the registers of temporaries once they are dead, 0 for as many as needed '
+                                 'or at most N, keeping the rest in memory')
+    arg_parser.add_argument('--cfg', metavar='FILE',
+                            help='write the control flow graph of the quads to FILE in the DOT language')
+    arg_parser.add_argument('--run', action='store_true',
+                            help='run the quads on the virtual machine as emitted and print the variables; an '
+                                 'if with an else may end with other values than with --python')
+    arg_parser.add_argument('--max-steps', type=int, metavar='N',
+                            help='stop the virtual machine after N instructions, and the --c program after '
+                                 'passing N labels')
+    arg_parser.add_argument('--quads', action='store_true',
+                            help='the source is a quad listing like out.txt, which is run')
+    arg_parser.add_argument('--python', action='store_true',
+                            help='compile the program to Python bytecode, run it and print the variables')
+    arg_parser.add_argument('--cache', metavar='DIR',
+                            help='keep the code objects of --python in DIR')
+    arg_parser.add_argument('--c', action='store_true',
+                            help='write the quads as C to out.c, build it with $CC or cc, run it and print the '
+                                 'variables, the quads as emitted as with --run; with --run also compare its speed '
+                                 'to the virtual machine')
+    arg_parser.add_argument('--serve', nargs='?', const='', metavar='SOCKET',
+                            help='serve compiles over JSON-RPC on the Unix socket SOCKET, or on stdin and stdout '
+                                 'without one, instead of compiling a source')
+    arg_parser.add_argument('--workers', type=int, metavar='N',
+                            help='the processes of --serve and --batch compiling side by side, by default one '
+                                 'a CPU')
+    arg_parser.add_argument('--timeout', type=float, default=10.0, metavar='SECONDS',
+                            help='the longest a compile of --serve may take')
+    arg_parser.add_argument('--server', metavar='SOCKET',
+                            help='compile the source on the server at SOCKET and write its files')
+    arg_parser.add_argument('--bench-server', type=int, metavar='N',
+                            help='compile the source N times by starting a compiler and N times on a server, '
+                                 'and print the latencies')
+    arg_parser.add_argument('--batch', metavar='DIR',
+                            help='compile every source into DIR, each to a directory of the files of a compile '
+                                 'at its path below the directory or glob naming it, and print a summary')
+    arg_parser.add_argument('--pattern', default=BATCH_PATTERN,
+                            help='the files of --batch taken from a directory, {} by default'.format(BATCH_PATTERN))
+    arg_parser.add_argument('--chunk-size', type=int, metavar='N',
+                            help='the sources of --batch a worker compiles at a time, by default enough for a '
+                                 'few chunks a worker, at most {}'.format(BATCH_CHUNK_LIMIT))
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help='compile without reading or writing the compile cache')
+    arg_parser.add_argument('--compile-cache', metavar='DIR',
+                            help='keep the compiles in DIR, by default $COMPILER_CACHE_DIR or compiler in the '
+                                 'cache directory of the user; not used with --cfg, --run, --python, --c, '
+                                 '--watch and the stream lexer')
+    arg_parser.add_argument('--cache-size', type=int, default=CACHE_MAX_BYTES >> 20, metavar='MB',
+                            help='the most the compile cache holds, dropping the least recently used compiles, '
+                                 '{} by default'.format(CACHE_MAX_BYTES >> 20))
+    arg_parser.add_argument('--cache-stats', action='store_true',
+                            help='print the hits and misses of the compile cache and its size')
+    arg_parser.add_argument('--watch', action='store_true',
+                            help='compile the source and again each time it changes, until interrupted, only '
+                                 'redoing the top-level statements an edit invalidated')
+    args = arg_parser.parse_args()
+    if args.cache_size < 0:
+        arg_parser.error('--cache-size takes a size of 0 or more')
+    options = dict(lexer=args.lexer, parser=args.parser, dispatch_switches=args.dispatch_switches,
+                   short_circuit=args.short_circuit, optimize=args.optimize, registers=args.registers)
+    cache_dir = None if args.no_cache else args.compile_cache or default_cache_dir()
+
+    if args.batch is not None:
+        if not args.source:
+            arg_parser.error('--batch takes one or more sources')
+        if args.quads or args.run or args.python or args.c or args.cfg or args.server or args.bench_server \
+                or args.watch:
+            arg_parser.error('--batch only compiles')
+        if args.lexer == 'stream':
+            arg_parser.error('--batch compiles with the table or legacy lexer')
+        if args.chunk_size is not None and args.chunk_size < 1:
+            arg_parser.error('--chunk-size takes a count of 1 or more')
+        try:
+            options = compile_options(options)
+            sources = batch_sources(args.source, args.pattern, exclude=args.batch)
+        except (OSError, ValueError) as e:
+            arg_parser.error(str(e))
+        failed = run_batch(sources, args.batch, options, args.workers, args.chunk_size, cache_dir,
+                           args.cache_size << 20)
+        sys.exit(1 if failed else 0)
+    if len(args.source) > 1:
+        arg_parser.error('only --batch takes more than one source')
+    args.source = args.source[0] if args.source else None
+
+    if args.serve is not None:
+        server = CompileServer(args.workers, args.timeout)
+        try:
+            asyncio.run(server.serve_socket(args.serve) if args.serve else server.serve_stdio())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        return
+    if args.source is None:
+        arg_parser.error('the following arguments are required: source')
+    if args.bench_server is not None:
+        benchmark_server(args.source, args.bench_server)
+        return
+    if args.server is not None:
+        if args.quads or args.run or args.python or args.c or args.cfg or args.lexer == 'stream':
+            arg_parser.error('--server only compiles, with the table or legacy lexer')
+        with open(args.source, 'r') as source:
+            text = source.read()
+        client = CompileClient.connect(args.server)
+        try:
+            result = client.compile(text, **options)
+        finally:
+            client.close()
+        sys.stdout.write(result['output'])
+        write_outputs(result['warnings'], result['errors'], result['symtable'], result['quads'])
+        if result['exception'] is not None:
+            sys.exit(result['exception'])
+        return
+    if args.watch:
+        if args.quads or args.run or args.python or args.c or args.cfg or args.lexer == 'stream':
+            arg_parser.error('--watch only compiles, with the table or legacy lexer')
+        try:
+            options = compile_options(options)
+        except ValueError as e:
+            arg_parser.error(str(e))
+        watch(args.source, options)
+        return
+
+    if args.quads:
+        with open(args.source, 'r') as source:
+            quads = parse_quads(source.read())
+        machine = run_quads(quads, args.max_steps)
+        if args.c:
+            compare_speed(machine, run_c(quads, max_steps=args.max_steps))
+        return
+
+    cache = None
+    if cache_dir is not None and args.lexer != 'stream' and not (args.cfg or args.run or args.python or args.c):
+        cache = CompileCache(cache_dir, args.cache_size << 20)
+    elif args.cache_stats:
+        arg_parser.error('--cache-stats needs the compile cache, which --no-cache, --cfg, --run, --python, --c '
+                         'and the stream lexer leave out')
+
+    # everything is collected in memory and each file is written once at
+    # the end, also when the compilation stops on an exception; with the
+    # cache so is what the compile prints, which is kept with the files
+    context = CompilationContext(output=io.StringIO() if cache is not None else None)
+    output = context.output
+    quads = None
+    entry = None
+    failure = None
+    try:
+        if args.lexer != 'stream':
+            with open(args.source, 'r') as source:
+                text = source.read()
+            # text = open('part10.pas', 'r').read()
+            if cache is not None:
+                key = cache.key(text, options)
+                entry = cache.get(key)
+        if entry is None:
+            if args.lexer == 'stream':
+                lexer = StreamLexer.open(args.source, context)
+            else:
+                lexer = LEXERS[args.lexer](text, context)
+            parser = PARSERS[args.parser](lexer, context)
+            tree = parser.parse()
+            semantic_analyzer = SemanticAnalyzer(context)
+
+            try:
+                semantic_analyzer.visit(tree)
+            except Exception as e:
+                print(e, file=output)
+
+            interpreter = Interpreter(tree, context, args.dispatch_switches, args.short_circuit)
+            quads = interpreter.quads
+            interpreter.interpret()
+            if args.short_circuit:
+                print(interpreter.short_circuit_report(), file=output)
+            quads = optimize(quads, args.optimize, output)
+            if args.registers is not None:
+                quads = allocate_registers(quads, args.registers or None, output)
+            if args.cfg:
+                with open(args.cfg, 'w') as outfile:
+                    outfile.write(cfg_dot(quads))
+            machine = None
+            if args.run:
+                machine = run_quads(quads, args.max_steps)
+            if args.python:
+                with open(args.source, 'rb') as source:
+                    key = source.read()
+                run_python(tree, key, args.cache)
+            if args.c:
+                seconds = run_c(quads, max_steps=args.max_steps)
+                if machine is not None:
+                    compare_speed(machine, seconds)
+    except BackendError as e:
+        failure = e
+    finally:
+        if entry is None:
+            entry = {
+                'quads': format_quads(quads) if quads is not None else None,
+                'warnings': context.warn_file.getvalue(),
+                'errors': context.error_file.getvalue(),
+                'symtable': context.symtable_file.getvalue(),
+                # printed as it went without the cache
+                'output': output.getvalue() if cache is not None else '',
+            }
+        # a compile found in the cache is written as it was at first
+        sys.stdout.write(entry['output'])
+        write_outputs(entry['warnings'], entry['errors'], entry['symtable'], entry['quads'])
+    if cache is not None:
+        if not cache.hits:
+            cache.put(key, entry)
+        if args.cache_stats:
+            print(cache.report())
+            entries, size = cache.usage()
+            print('cache: {} compiles in {:.1f} of {} MB at {}'.format(
+                entries, size / (1 << 20), args.cache_size, cache.directory))
+    if failure is not None:
+        sys.exit(str(failure))
+
+
+def write_outputs(warnings, errors, symtable, quads):
+    """Write warns.txt and errors.txt, and symtable.txt and out.txt if the code generation was started."""
+    with open("warns.txt", 'w') as outfile:
+        outfile.write(warnings)
+    with open("errors.txt", 'w') as outfile:
+        outfile.write(errors)
+    if quads is not None:
+        # the symbol table rows add up over runs
+        with open("symtable.txt", 'a') as outfile:
+            outfile.write(symtable)
+        with open("out.txt", 'w') as outfile:
+            outfile.write(quads)
 
 
 if __name__ == '__main__':
@@ -3,12 +3,35 @@
 #  LEXER                                                                      #
 #                                                                             #
 ###############################################################################
+import re
+from array import array
+from bisect import bisect_left
+from enum import IntEnum
+from operator import itemgetter
+
+
+
+class CompilationContext(object):
+    """The numbering of the registers and labels of one compilation, handed
+    to its Interpreter, so compilations can run one after another or in
+    threads of one process, each numbering from the start."""
+
+    def __init__(self):
+        self.register_id = 0
+        self.label_id = 1
+
+    def new_register(self):
+        """Return the operand of a register not used before."""
+        register = self.register_id << OPERAND_KIND_BITS | O_TEMP
+        self.register_id += 1
+        return register
+
+    def new_label(self):
+        """Return the operand of a label not used before."""
+        label = self.label_id << OPERAND_KIND_BITS | O_LABEL
+        self.label_id += 1
+        return label
 
-register_id = 0
-label_id = 1
-line_no = 1
-out_file = None
-newLine_pos = None
 
 # Token types
 #
@@ -52,23 +75,40 @@ DIVIDE        = 'DIVIDE'
 ID            = 'ID'
 EOF           = 'EOF'
 
-def locations_of_substring(string, substring):
-    """Return a list of locations of a substring."""
+class LineIndex(object):
+    """Maps source offsets to 1-based (line, column) positions.
 
-    substring_length = len(substring)    
-    def recurse(locations_found, start):
-        location = string.find(substring, start)
-        if location != -1:
-            return recurse(locations_found + [location], location+substring_length)
-        else:
-            return locations_found
+    The offsets of all newlines are collected in one linear pass into a
+    compact array('q'); a lookup is a binary search over it.
+    """
+
+    def __init__(self, text):
+        self.newlines = newlines = array('q')
+        find = text.find
+        pos = find('\n')
+        while pos != -1:
+            newlines.append(pos)
+            pos = find('\n', pos + 1)
+
+    def line(self, offset):
+        return bisect_left(self.newlines, offset) + 1
+
+    def position(self, offset):
+        """Return the (line, column) of the character at `offset`."""
+        index = bisect_left(self.newlines, offset)
+        if index:
+            return index + 1, offset - self.newlines[index - 1]
+        return 1, offset + 1
 
-    return recurse([], 0)
 
 class Token(object):
-    def __init__(self, type, value):
+    def __init__(self, type, value, pos=None, line=None, column=None):
         self.type = type
         self.value = value
+        # start offset and 1-based line/column of the token in the source
+        self.pos = pos
+        self.line = line
+        self.column = column
 
     def __str__(self):
         return 'Token({type}, {value})'.format(
@@ -79,6 +119,13 @@ class Token(object):
     def __repr__(self):
         return self.__str__()
 
+def format_position(token):
+    """Describe where `token` starts, for diagnostics."""
+    if token is None or token.line is None:
+        return 'unknown position'
+    return 'line: {}, column: {}'.format(token.line, token.column)
+
+
 RESERVED_KEYWORDS = {
     'int': Token(INTEGER_TYPE, INTEGER_TYPE),
     'const': Token(CONSTANT, CONSTANT),
@@ -103,16 +150,19 @@ class Lexer(object):
         self.text = text
         self.pos = 0
         self.current_char = self.text[self.pos]
+        self.lines = LineIndex(text)
+        self.token_start = 0
 
     def error(self):
-        raise Exception('Lexical Error: Invalid character at line: ' + str(line_no))
+        raise Exception('Lexical Error: Invalid character at ' + format_position(self.token_at(self.pos)))
+
+    def token_at(self, offset, type=None, value=None):
+        """Build a token starting at `offset`, positioned through the line index."""
+        line, column = self.lines.position(offset)
+        return Token(type, value, offset, line, column)
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
-        global line_no
-        if len(newLine_pos) > 0 and self.pos > newLine_pos[0]:
-            line_no = line_no + 1
-            del newLine_pos[0]
         self.pos += 1
         if self.pos > len(self.text) - 1:
             self.current_char = None  # Indicates end of input
@@ -157,11 +207,17 @@ class Lexer(object):
         return token
 
     def get_next_token(self):
+        """Return the next token, stamped with its position in the source."""
+        token = self._next_token()
+        return self.token_at(self.token_start, token.type, token.value)
+
+    def _next_token(self):
         """Lexical analyzer (also known as scanner or tokenizer)
         This method is responsible for breaking a sentence
         apart into tokens. One token at a time.
         """
         while self.current_char is not None:
+            self.token_start = self.pos
 
             if self.current_char.isspace():
                 self.skip_whitespace()
@@ -256,16 +312,182 @@ class Lexer(object):
 
             self.error()
 
+        self.token_start = self.pos
         return Token(EOF, None)
 
 
+# Master pattern used by FastLexer. A single match skips any whitespace and
+# complete #...# comments in front of a token and then classifies the token.
+# It only ever matches ASCII: a non-ASCII character (or an unterminated
+# comment) makes the match fail, and FastLexer falls back to the same str
+# predicates the legacy Lexer uses so both engines agree on unicode input.
+_TOKEN_PATTERN = re.compile(r"""
+    (?:[\t-\r\x1c-\x1f ]|\#[^#]*\#)*     # whitespace (the ASCII isspace set) and comments
+    (?:
+        ([A-Za-z][A-Za-z0-9]*)            # 1: identifier or keyword
+      | ([0-9]+)                          # 2: integer literal
+      | (==|!=|<=|>=|[<>:,=;(){}+\-*/])   # 3: operator or punctuation
+      | (\Z)                              # 4: end of input
+    )
+""", re.VERBOSE)
+
+_SKIP_PATTERN = re.compile(r'(?:[\t-\r\x1c-\x1f ]|\#[^#]*\#)*')
+
+_ID_GROUP, _INT_GROUP, _OP_GROUP, _EOF_GROUP = 1, 2, 3, 4
+
+OPERATORS = {
+    '==': EQUAL,
+    '!=': NOT_EQUAL,
+    '<=': LESS_EQUAL,
+    '>=': GREATER_EQUAL,
+    '<': LESS,
+    '>': GREATER,
+    ':': COLON,
+    ',': COMMA,
+    '=': ASSIGN,
+    ';': SEMI_COLON,
+    '(': L_PAREN,
+    ')': R_PAREN,
+    '{': L_BRACE,
+    '}': R_BRACE,
+    '+': PLUS,
+    '-': MINUS,
+    '*': MULTIPLY,
+    '/': DIVIDE
+}
+
+
+class FastLexer(object):
+    """Table-driven replacement for Lexer.
+
+    Produces exactly the same token stream as Lexer, but consumes a whole
+    token per step: one `_TOKEN_PATTERN.match` skips the whitespace and
+    comments in front of the token, classifies it and finds its end.
+    Keywords come straight out of RESERVED_KEYWORDS. The legacy Lexer is
+    still available through `--lexer legacy` for comparison.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.lines = LineIndex(text)
+        self._tokens = self._scan()
+
+    def error(self):
+        raise Exception('Lexical Error: Invalid character at ' + format_position(self.token_at(self.pos)))
+
+    def token_at(self, offset, type=None, value=None):
+        """Build a token starting at `offset`, positioned through the line index."""
+        line, column = self.lines.position(offset)
+        return Token(type, value, offset, line, column)
+
+    def get_next_token(self):
+        return next(self._tokens)
+
+    def _scan(self):
+        text = self.text
+        newlines = self.lines.newlines
+        match = _TOKEN_PATTERN.match
+        keywords = RESERVED_KEYWORDS
+        operators = OPERATORS
+        pos = 0
+
+        while True:
+            m = match(text, pos)
+            if m is None:
+                # non-ASCII character or unterminated comment
+                token = self._slow_token(pos)
+                pos = self.pos
+                if token is not None:
+                    yield token
+                continue
+
+            group = m.lastindex
+            start = m.start(group)
+            pos = m.end()
+            # inlined LineIndex.position()
+            line = bisect_left(newlines, start)
+            column = start - newlines[line - 1] if line else start + 1
+            line += 1
+
+            if group == _ID_GROUP:
+                if text[pos:pos + 1] > '\x7f':
+                    yield self._word(start, pos)
+                    pos = self.pos
+                    continue
+                word = m.group(group)
+                keyword = keywords.get(word)
+                if keyword is None:
+                    yield Token(ID, word, start, line, column)
+                else:
+                    yield Token(keyword.type, keyword.value, start, line, column)
+            elif group == _OP_GROUP:
+                value = m.group(group)
+                yield Token(operators[value], value, start, line, column)
+            elif group == _INT_GROUP:
+                if text[pos:pos + 1] > '\x7f':
+                    yield self._integer(start, pos)
+                    pos = self.pos
+                    continue
+                yield Token(INTEGER_VALUE, int(m.group(group)), start, line, column)
+            else:
+                self.pos = pos
+                while True:
+                    yield Token(EOF, None, start, line, column)
+
+    def _slow_token(self, pos):
+        """Scan one token that starts with a non-ASCII character.
+
+        Returns None after skipping a non-ASCII whitespace character.
+        """
+        text = self.text
+        pos = _SKIP_PATTERN.match(text, pos).end()
+        self.pos = pos
+        char = text[pos]
+        if char.isspace():
+            self.pos = pos + 1
+            return None
+        if char.isalpha():
+            return self._word(pos, pos)
+        if char.isdigit():
+            return self._integer(pos, pos)
+        self.error()
+
+    def _extend(self, end, predicate):
+        """Extend a token while `predicate` accepts the next character."""
+        text = self.text
+        length = len(text)
+        while end < length and predicate(text[end]):
+            end += 1
+        return end
+
+    def _word(self, start, end):
+        end = self._extend(end, str.isalnum)
+        self.pos = end
+        word = self.text[start:end]
+        keyword = RESERVED_KEYWORDS.get(word)
+        if keyword is not None:
+            return self.token_at(start, keyword.type, keyword.value)
+        return self.token_at(start, ID, word)
+
+    def _integer(self, start, end):
+        end = self._extend(end, str.isdigit)
+        self.pos = end
+        return self.token_at(start, INTEGER_VALUE, int(self.text[start:end]))
+
+
+LEXERS = {
+    'table': FastLexer,
+    'legacy': Lexer
+}
+
+
 ###############################################################################
 #                                                                             #
 #  PARSER                                                                     #
 #                                                                             #
 ###############################################################################
 
-boolean_e = []
 class AST(object):   # parent node, abstract syntax tree
     pass
 
@@ -372,7 +594,7 @@ class Parser(object):
         self.current_token = self.lexer.get_next_token()
 
     def error(self):
-        raise Exception('Syntax Error: Invalid syntax at line: ' + str(line_no))
+        raise Exception('Syntax Error: Invalid syntax at ' + format_position(self.current_token))
 
     def eat(self, token_type):
         # compare the current token type with the passed token
@@ -504,67 +726,65 @@ class Parser(object):
                             | SWITCH L_PAREN variable R_PAREN L_BRACE (CASE (INTEGER_VALUE | MINUS INTEGER_VALUE) COLON compound_statement)+ (DEFAULT COLON compound_statement) R_BRACE
         """
         node = NoOp()
-        global boolean_e
         if self.current_token.type == IF:
             self.eat(IF)
             self.eat(L_PAREN)
-            boolean_e.append(self.boolean_expression())
+            bool_expr = self.boolean_expression()
             self.eat(R_PAREN)
-            self.cmpd_stat1 = self.compound_statement()
-            self.cmpd_stat2 = None
+            cmpd_stat1 = self.compound_statement()
+            cmpd_stat2 = None
             if self.current_token.type == ELSE:
                 self.eat(ELSE)
-                self.cmpd_stat2 = self.compound_statement()
-            node = IfStat(boolean_e[-1], self.cmpd_stat1, self.cmpd_stat2)
-            del boolean_e[-1]
+                cmpd_stat2 = self.compound_statement()
+            node = IfStat(bool_expr, cmpd_stat1, cmpd_stat2)
             return node
         elif self.current_token.type == SWITCH:
             self.eat(SWITCH)
             self.eat(L_PAREN)
-            self.var = self.variable()
+            var = self.variable()
             self.eat(R_PAREN)
             self.eat(L_BRACE)
             self.eat(CASE)
-            self.case_stats = []
-            self.cmpd_stats = []
+            case_stats = []
+            cmpd_stats = []
             if self.current_token.type == INTEGER_VALUE:
                 num_token = self.current_token
                 self.eat(INTEGER_VALUE)
                 self.eat(COLON)
-                self.cmpd_stats.append(self.compound_statement())
-                self.case_stats.append(Number(num_token))
+                cmpd_stats.append(self.compound_statement())
+                case_stats.append(Number(num_token))
             elif self.current_token.type == MINUS:
                 minus_token = self.current_token
                 self.eat(MINUS)
                 num_token = self.current_token
                 self.eat(INTEGER_VALUE)
                 self.eat(COLON)
-                self.cmpd_stats.append(self.compound_statement())
-                self.case_stats.append(UnaryOp(minus_token, Number(num_token)))
+                cmpd_stats.append(self.compound_statement())
+                case_stats.append(UnaryOp(minus_token, Number(num_token)))
             while self.current_token.type == CASE:
                 self.eat(CASE)
                 if self.current_token.type == INTEGER_VALUE:
                     num_token = self.current_token
                     self.eat(INTEGER_VALUE)
                     self.eat(COLON)
-                    self.cmpd_stats.append(self.compound_statement())
-                    self.case_stats.append(Number(num_token))
+                    cmpd_stats.append(self.compound_statement())
+                    case_stats.append(Number(num_token))
                 elif self.current_token.type == MINUS:
                     minus_token = self.current_token
                     self.eat(MINUS)
                     num_token = self.current_token
                     self.eat(INTEGER_VALUE)
                     self.eat(COLON)
-                    self.cmpd_stats.append(self.compound_statement())
-                    self.case_stats.append(UnaryOp(minus_token, Number(num_token)))
+                    cmpd_stats.append(self.compound_statement())
+                    case_stats.append(UnaryOp(minus_token, Number(num_token)))
             if self.current_token.type == DEFAULT:
                 default_token = self.current_token
                 self.eat(DEFAULT)
                 self.eat(COLON)
-                self.cmpd_stats.append(self.compound_statement())
-                self.case_stats.append(default_token)
+                cmpd_stats.append(self.compound_statement())
+                case_stats.append(default_token)
             self.eat(R_BRACE)
-            node = SwitchStat(self.var, self.case_stats, self.cmpd_stats)
+            node = SwitchStat(var, case_stats, cmpd_stats)
             return node
 
     def iteration_statement(self):
@@ -577,32 +797,32 @@ class Parser(object):
         if self.current_token.type == WHILE:
             self.eat(WHILE)
             self.eat(L_PAREN)
-            self.bool_expr = self.boolean_expression()
+            bool_expr = self.boolean_expression()
             self.eat(R_PAREN)
-            self.cmpd_stat = self.compound_statement()
-            node = WhileStat(self.bool_expr, self.cmpd_stat)
+            cmpd_stat = self.compound_statement()
+            node = WhileStat(bool_expr, cmpd_stat)
             return node
         elif self.current_token.type == DO:
             self.eat(DO)
-            self.cmpd_stat = self.compound_statement()
+            cmpd_stat = self.compound_statement()
             self.eat(WHILE)
             self.eat(L_PAREN)
-            self.bool_expr = self.boolean_expression()
+            bool_expr = self.boolean_expression()
             self.eat(R_PAREN)
             self.eat(SEMI_COLON)
-            node = DoWhileStat(self.bool_expr, self.cmpd_stat)
+            node = DoWhileStat(bool_expr, cmpd_stat)
             return node
         elif self.current_token.type == FOR:
             self.eat(FOR)
             self.eat(L_PAREN)
-            self.init = self.init_for()
+            init = self.init_for()
             self.eat(SEMI_COLON)
-            self.middle = self.boolean_expression()
+            middle = self.boolean_expression()
             self.eat(SEMI_COLON)
-            self.end = self.assignment_statement()
+            end = self.assignment_statement()
             self.eat(R_PAREN)
-            self.cmpd_stat = self.compound_statement()
-            node = ForStat(self.init, self.middle, self.end, self.cmpd_stat)
+            cmpd_stat = self.compound_statement()
+            node = ForStat(init, middle, end, cmpd_stat)
             return node
 
     def variable_declaration(self):
@@ -773,6 +993,204 @@ class Parser(object):
         return node
 
 
+###############################################################################
+#                                                                             #
+#  INTERMEDIATE CODE                                                          #
+#                                                                             #
+###############################################################################
+# Quadruple opcodes; QUAD_OP_NAMES holds their spelling in out.txt
+class QuadOp(IntEnum):
+    LABEL = 0
+    ASSIGN = 1
+    ADD = 2
+    SUB = 3
+    MUL = 4
+    DIV = 5
+    UMINUS = 6
+    AND = 7
+    OR = 8
+    NOT = 9  # a NOT between two terms
+    EQUAL = 10
+    NOT_EQUAL = 11
+    LESS_EQUAL = 12
+    GREATER_EQUAL = 13
+    LESS = 14
+    GREATER = 15
+    CASE_EQUAL = 16  # the switch comparison
+    JFALSE = 17
+    JTRUE = 18
+    JMP = 19
+
+
+QUAD_OP_NAMES = ('', '=', '+', '-', '*', '/', 'uminus',
+                 AND, OR, NOT, EQUAL, NOT_EQUAL, LESS_EQUAL, GREATER_EQUAL, LESS, GREATER,
+                 'equal', 'jfalse', 'jtrue', 'jmp')
+
+Q_LABEL = int(QuadOp.LABEL)
+Q_ASSIGN = int(QuadOp.ASSIGN)
+Q_ADD = int(QuadOp.ADD)
+Q_SUB = int(QuadOp.SUB)
+Q_MUL = int(QuadOp.MUL)
+Q_DIV = int(QuadOp.DIV)
+Q_UMINUS = int(QuadOp.UMINUS)
+Q_AND = int(QuadOp.AND)
+Q_OR = int(QuadOp.OR)
+Q_NOT = int(QuadOp.NOT)
+Q_EQUAL = int(QuadOp.EQUAL)
+Q_NOT_EQUAL = int(QuadOp.NOT_EQUAL)
+Q_LESS_EQUAL = int(QuadOp.LESS_EQUAL)
+Q_GREATER_EQUAL = int(QuadOp.GREATER_EQUAL)
+Q_LESS = int(QuadOp.LESS)
+Q_GREATER = int(QuadOp.GREATER)
+Q_CASE_EQUAL = int(QuadOp.CASE_EQUAL)
+Q_JFALSE = int(QuadOp.JFALSE)
+Q_JTRUE = int(QuadOp.JTRUE)
+Q_JMP = int(QuadOp.JMP)
+
+# opcodes of the BinOp and BoolOp operators, by token type
+ARITHMETIC_QUAD_OPS = {PLUS: Q_ADD, MINUS: Q_SUB, MULTIPLY: Q_MUL, DIVIDE: Q_DIV}
+BOOLEAN_QUAD_OPS = {AND: Q_AND, OR: Q_OR, NOT: Q_NOT, EQUAL: Q_EQUAL, NOT_EQUAL: Q_NOT_EQUAL,
+                    LESS_EQUAL: Q_LESS_EQUAL, GREATER_EQUAL: Q_GREATER_EQUAL,
+                    LESS: Q_LESS, GREATER: Q_GREATER}
+
+
+class OperandKind(IntEnum):
+    NONE = 0  # an unused operand field
+    CONST = 1  # an int, or TRUE or FALSE
+    VAR = 2  # a variable name
+    TEMP = 3  # the number n of register Rn
+    LABEL = 4  # the number n of label Ln
+
+
+O_NONE = int(OperandKind.NONE)
+O_CONST = int(OperandKind.CONST)
+O_VAR = int(OperandKind.VAR)
+O_TEMP = int(OperandKind.TEMP)
+O_LABEL = int(OperandKind.LABEL)
+
+# an encoded operand keeps its kind in the low bits
+OPERAND_KIND_BITS = 3
+OPERAND_KIND_MASK = (1 << OPERAND_KIND_BITS) - 1
+NO_OPERAND = O_NONE
+
+
+def format_operand(kind, value):
+    if kind == O_TEMP:
+        return 'R' + str(value)
+    elif kind == O_LABEL:
+        return 'L' + str(value)
+    elif kind == O_NONE:
+        return ''
+    return str(value)
+
+
+class Quad(tuple):
+    """One decoded quadruple, (op, arg1, arg2, result) with (kind, value) operands."""
+    __slots__ = ()
+    op = property(itemgetter(0))
+    arg1 = property(itemgetter(1))
+    arg2 = property(itemgetter(2))
+    result = property(itemgetter(3))
+
+    def __repr__(self):
+        if self[0] == Q_LABEL:
+            return format_operand(*self[1]) + ':'
+        return '({}, {}, {}, {})'.format(QUAD_OP_NAMES[self[0]], *(format_operand(*arg) for arg in self[1:]))
+
+
+class QuadBuffer(object):
+    """Quadruples held in one flat typed array.
+
+    Quad `i` is `code[4 * i:4 * i + 4]`, its opcode and the operands arg1,
+    arg2 and result in the order of the text listing. Jumps keep their
+    target label in arg1 and the condition in arg2, a LABEL quad only has
+    arg1.
+
+    An operand is an int with its OperandKind in the low bits and above
+    them the number of a register or label, or the index of a variable
+    name or constant in `values`. NO_OPERAND, 0, is an unused field.
+    """
+
+    def __init__(self):
+        self.code = array('q')
+        self.values = []
+        self.value_index = {}
+
+    def __len__(self):
+        return len(self.code) >> 2
+
+    def emit(self, op, arg1=NO_OPERAND, arg2=NO_OPERAND, result=NO_OPERAND):
+        self.code.extend((op, arg1, arg2, result))
+
+    def intern(self, kind, value):
+        """Return the operand of a variable or constant."""
+        value_id = self.value_index.get(value)
+        if value_id is None:
+            value_id = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        return value_id << OPERAND_KIND_BITS | kind
+
+    def operand(self, operand):
+        """Return the (kind, value) pair an encoded operand stands for."""
+        kind = operand & OPERAND_KIND_MASK
+        if kind == O_CONST or kind == O_VAR:
+            return kind, self.values[operand >> OPERAND_KIND_BITS]
+        elif kind == O_NONE:
+            return kind, None
+        return kind, operand >> OPERAND_KIND_BITS
+
+    def __getitem__(self, index):
+        code = self.code
+        start = 4 * index if index >= 0 else len(code) + 4 * index
+        if not 0 <= start < len(code):
+            raise IndexError('quad index out of range')
+        operand = self.operand
+        return Quad((code[start], operand(code[start + 1]), operand(code[start + 2]), operand(code[start + 3])))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class OperandText(dict):
+    """Memo of the text of encoded operands; variables and constants repeat
+    a lot, registers are mostly used once and are not kept."""
+
+    def __init__(self, quads):
+        super(OperandText, self).__init__()
+        self.quads = quads
+
+    def __missing__(self, operand):
+        if operand & OPERAND_KIND_MASK == O_TEMP:
+            return 'R' + str(operand >> OPERAND_KIND_BITS)
+        text = self[operand] = format_operand(*self.quads.operand(operand))
+        return text
+
+
+def format_quads(quads, block_size=1 << 13):
+    """Return the text listing of a QuadBuffer, one line per quad.
+
+    The lines are joined a block at a time, so only the lines of one
+    block are alive next to the text.
+    """
+    names = QUAD_OP_NAMES
+    text = OperandText(quads)
+    code = quads.code
+    blocks = []
+    for first in range(0, len(code), 4 * block_size):
+        lines = []
+        append = lines.append
+        fields = iter(code[first:first + 4 * block_size])
+        for op, arg1, arg2, result in zip(fields, fields, fields, fields):
+            if op == Q_LABEL:
+                append(text[arg1] + ':')
+            else:
+                append('(' + names[op] + ', ' + text[arg1] + ', ' + text[arg2] + ', ' + text[result] + ')')
+        append('')
+        blocks.append('\n'.join(lines))
+    return ''.join(blocks)
+
+
 ###############################################################################
 #                                                                             #
 #  INTERPRETER                                                                #
@@ -789,10 +1207,16 @@ class NodeVisitor(object):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 
 class Interpreter(NodeVisitor):
-    def __init__(self, parser):
+    """Generates the quadruples of the parsed program into the QuadBuffer `quads`."""
+
+    def __init__(self, parser, context):
         self.parser = parser
+        self.context = context
         import collections
         self.GLOBAL_SCOPE = collections.OrderedDict()
+        self.quads = QuadBuffer()
+        # quads are appended straight to the buffer's array
+        self.code = self.quads.code
 
     def visit_Program(self, node):
         for child in node.children:
@@ -804,77 +1228,47 @@ class Interpreter(NodeVisitor):
         if node.right:
             value = self.visit(node.right)
             self.GLOBAL_SCOPE[var_name] = value
-            out_file.write("(=, " + str(value) + ", , " + str(var_name) + ")\n")
+            self.code.extend((Q_ASSIGN, value, NO_OPERAND, self.quads.intern(O_VAR, var_name)))
 
     def visit_Type(self, node):
         # Do nothing
         pass
 
     def visit_BinOp(self, node):
-        global register_id
-        if node.op.type == PLUS:
-            # value = self.visit(node.left) + self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(+, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
-            return destination_register
-        elif node.op.type == MINUS:
-            # value = self.visit(node.left) - self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(-, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
-            return destination_register
-        elif node.op.type == MULTIPLY:
-            # value = self.visit(node.left) * self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(*, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
-            return destination_register
-        elif node.op.type == DIVIDE:
-            # value = self.visit(node.left) / self.visit(node.right)
-            left_val = str(self.visit(node.left))
-            right_val = str(self.visit(node.right))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(/, ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-            register_id = register_id + 1
+        op = ARITHMETIC_QUAD_OPS.get(node.op.type)
+        if op is not None:
+            # value = self.visit(node.left) <op> self.visit(node.right)
+            left_val = self.visit(node.left)
+            right_val = self.visit(node.right)
+            destination_register = self.context.new_register()
+            self.code.extend((op, left_val, right_val, destination_register))
             return destination_register
 
     def visit_Number(self, node):
-        return str(node.value)
+        return self.quads.intern(O_CONST, node.value)
 
     def visit_UnaryOp(self, node):
-        global register_id
         op = node.op.type
         if op == PLUS:
-            return '' + str(self.visit(node.expr))
+            return self.visit(node.expr)
         elif op == MINUS:
             # return '-' + str(self.visit(node.expr))
-            value = str(self.visit(node.expr))
-            destination_register = 'R' + str(register_id)
-            out_file.write('(uminus, ' + value + ', , ' + destination_register + ')\n')
-            register_id = register_id + 1
+            value = self.visit(node.expr)
+            destination_register = self.context.new_register()
+            self.code.extend((Q_UMINUS, value, NO_OPERAND, destination_register))
             return destination_register
+        # a NOT with no operand, listed as None
+        return self.quads.intern(O_CONST, None)
 
     def visit_Compound(self, node):
         for child in node.children:
             self.visit(child)
 
     def visit_Assign(self, node):
-        global register_id
         var_name = node.left.value
         # self.GLOBAL_SCOPE[var_name] = self.visit(node.right)
         value = self.visit(node.right)
-
-        # out_file.write('(=, ' + str(var_name) + ', ' + str(self.visit(node.right)) + ', R' + str(register_id) + ')\n')
-        out_file.write("(=, " + str(value) + ", , " + str(var_name) + ")\n")
-        # register_id = register_id + 1
-        # return 'R' + str(register_id - 1)
+        self.code.extend((Q_ASSIGN, value, NO_OPERAND, self.quads.intern(O_VAR, var_name)))
 
     def visit_Var(self, node):
         var_name = node.value
@@ -882,94 +1276,73 @@ class Interpreter(NodeVisitor):
         if var_value is None:
             raise NameError(repr(var_name))
         else:
-            return str(var_name)
+            return self.quads.intern(O_VAR, var_name)
 
     def visit_NoOp(self, node):
-        return ""
+        return NO_OPERAND
 
     def visit_Boolean(self, node):
-        return str(node.value)
+        return self.quads.intern(O_CONST, node.value)
 
     def visit_SwitchStat(self, node):
-        global register_id, label_id
-        v = str(node.var.value)
+        v = self.quads.intern(O_VAR, node.var.value)
         for i,case in enumerate(node.case_stats):
             cmpd = node.cmpd_stats[i]
-            my_label = label_id
-            label_id = label_id + 1
-            out_file.write('L' + str(my_label) + ':\n')
+            self.code.extend((Q_LABEL, self.context.new_label(), NO_OPERAND, NO_OPERAND))
             if not (str(case.value) == 'DEFAULT'):
-                destination_register = 'R' + str(register_id)
-                out_file.write('(equal, ' + v + ', ' + str(case.value) + ', ' + destination_register + ')\n')
-                register_id = register_id + 1
-                out_file.write('(jfalse, L' + str(label_id) + ', ' + destination_register + ', )\n')
+                destination_register = self.context.new_register()
+                self.code.extend((Q_CASE_EQUAL, v, self.quads.intern(O_CONST, case.value), destination_register))
+                # to whichever label is made next
+                next_label = self.context.label_id << OPERAND_KIND_BITS | O_LABEL
+                self.code.extend((Q_JFALSE, next_label, destination_register, NO_OPERAND))
             self.visit(cmpd)
-            
-
-
 
     def visit_IfStat(self, node):
-        global register_id, label_id
-        value = str(self.visit(node.expr))
-        my_label = label_id
-        label_id = label_id + 1
-        out_file.write('(jfalse, L' + str(my_label) + ', ' + value + ', )\n')
-        value = str(self.visit(node.cmpd1))
+        value = self.visit(node.expr)
+        my_label = self.context.new_label()
+        self.code.extend((Q_JFALSE, my_label, value, NO_OPERAND))
+        self.visit(node.cmpd1)
         if node.cmpd2 is not None:
-            my_label = label_id
-            label_id = label_id + 1
-            out_file.write('(jmp, L' + str(my_label) + ', , )\n')
-            value = str(self.visit(node.cmpd1))
-        out_file.write('L' + str(my_label) + ':\n')
+            my_label = self.context.new_label()
+            self.code.extend((Q_JMP, my_label, NO_OPERAND, NO_OPERAND))
+            self.visit(node.cmpd1)
+        self.code.extend((Q_LABEL, my_label, NO_OPERAND, NO_OPERAND))
 
     def visit_WhileStat(self, node):
-        global register_id, label_id
-        my_label1 = label_id
-        label_id = label_id + 1
-        out_file.write('L' + str(my_label1) + ':\n')
-        cond = str(self.visit(node.expr))
-        my_label2 = label_id
-        label_id = label_id + 1
-        out_file.write('(jfalse, L' + str(my_label2) + ', ' + cond + ', )\n')
-        val = str(self.visit(node.cmpd1))
-        out_file.write('(jmp, L' + str(my_label1) + ', , )\n')
-        out_file.write('L' + str(my_label2) + ':\n')
+        my_label1 = self.context.new_label()
+        self.code.extend((Q_LABEL, my_label1, NO_OPERAND, NO_OPERAND))
+        cond = self.visit(node.expr)
+        my_label2 = self.context.new_label()
+        self.code.extend((Q_JFALSE, my_label2, cond, NO_OPERAND))
+        self.visit(node.cmpd1)
+        self.code.extend((Q_JMP, my_label1, NO_OPERAND, NO_OPERAND))
+        self.code.extend((Q_LABEL, my_label2, NO_OPERAND, NO_OPERAND))
 
     def visit_DoWhileStat(self, node):
-        global register_id, label_id
-        my_label1 = label_id
-        label_id = label_id + 1
-        out_file.write('L' + str(my_label1) + ':\n')
-        cond = str(self.visit(node.cmpd1))
-        # my_label2 = label_id
-        # label_id = label_id + 1
-        # out_file.write('(jfalse, L' + str(my_label2) + ', ' + cond + ', )\n')
-        val = str(self.visit(node.expr))
-        out_file.write('(jtrue, L' + str(my_label1) + ', ' + val + ', )\n')
+        my_label1 = self.context.new_label()
+        self.code.extend((Q_LABEL, my_label1, NO_OPERAND, NO_OPERAND))
+        self.visit(node.cmpd1)
+        val = self.visit(node.expr)
+        self.code.extend((Q_JTRUE, my_label1, val, NO_OPERAND))
 
     def visit_BoolOp(self, node):
-        global register_id
-        left_val = str(self.visit(node.left))
-        right_val = str(self.visit(node.right))
-        destination_register = 'R' + str(register_id)
-        out_file.write('(' + str(node.op.type) + ', ' + left_val + ', ' + right_val + ', ' + destination_register + ')\n')
-        register_id = register_id + 1
+        left_val = self.visit(node.left)
+        right_val = self.visit(node.right)
+        destination_register = self.context.new_register()
+        self.code.extend((BOOLEAN_QUAD_OPS[node.op.type], left_val, right_val, destination_register))
         return destination_register
 
     def visit_ForStat(self, node):
-        global register_id, label_id
-        value = str(self.visit(node.init))
-        my_label1 = label_id
-        label_id = label_id + 1
-        out_file.write('L' + str(my_label1) + ':\n')
-        cond = str(self.visit(node.middle))
-        my_label2 = label_id
-        label_id = label_id + 1
-        out_file.write('(jfalse, L' + str(my_label2) + ', ' + cond + ', )\n')
-        cmpd = str(self.visit(node.cmpd_stat))
-        it = str(self.visit(node.end))
-        out_file.write('(jmp, L' + str(my_label1) + ', , )\n')
-        out_file.write('L' + str(my_label2) + ':\n')        
+        self.visit(node.init)
+        my_label1 = self.context.new_label()
+        self.code.extend((Q_LABEL, my_label1, NO_OPERAND, NO_OPERAND))
+        cond = self.visit(node.middle)
+        my_label2 = self.context.new_label()
+        self.code.extend((Q_JFALSE, my_label2, cond, NO_OPERAND))
+        self.visit(node.cmpd_stat)
+        self.visit(node.end)
+        self.code.extend((Q_JMP, my_label1, NO_OPERAND, NO_OPERAND))
+        self.code.extend((Q_LABEL, my_label2, NO_OPERAND, NO_OPERAND))
 
     def visit_BreakStat(self, node):
         pass
@@ -982,17 +1355,23 @@ class Interpreter(NodeVisitor):
 
 
 def main():
-    global newLine_pos
-    import sys
-    text = open(sys.argv[1], 'r').read()
-    newLine_pos = locations_of_substring(text, '\n')
-    lexer = Lexer(text)
+    import argparse
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('source')
+    arg_parser.add_argument('--lexer', choices=sorted(LEXERS), default='table',
+                            help='scanner engine, `legacy` is the original char-by-char Lexer')
+    args = arg_parser.parse_args()
+
+    text = open(args.source, 'r').read()
+    lexer = LEXERS[args.lexer](text)
     parser = Parser(lexer)
-    interpreter = Interpreter(parser)
-    with open("out.txt", 'w') as outfile:
-        global out_file
-        out_file = outfile
+    interpreter = Interpreter(parser, CompilationContext())
+    try:
         interpreter.interpret()
+    finally:
+        # the listing is written in one go, also when the code generation stops on an error
+        with open("out.txt", 'w') as outfile:
+            outfile.write(format_quads(interpreter.quads))
 
 
     # for k, v in sorted(interpreter.GLOBAL_SCOPE.items()):
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# compiler.py sits with the GUI that runs it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'finalCodeWithGUI', 'CompilerGUI', 'bin', 'Debug'))
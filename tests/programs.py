@@ -0,0 +1,30 @@
+"""The sample programs under programs/, with the files of compiling each
+one kept under golden/."""
+import os
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROGRAMS_DIR = os.path.join(TESTS_DIR, 'programs')
+GOLDEN_DIR = os.path.join(TESTS_DIR, 'golden')
+
+PROGRAMS = sorted(name[:-len('.txt')] for name in os.listdir(PROGRAMS_DIR) if name.endswith('.txt'))
+
+# the files main() writes; what it prints is kept as output.txt
+OUTPUT_FILES = ('out.txt', 'warns.txt', 'errors.txt', 'symtable.txt')
+
+
+def source_path(program):
+    return os.path.join(PROGRAMS_DIR, program + '.txt')
+
+
+def source(program):
+    with open(source_path(program)) as infile:
+        return infile.read()
+
+
+def golden(program, name):
+    """Return the text of a golden file, None when compiling does not write it."""
+    path = os.path.join(GOLDEN_DIR, program, name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as infile:
+        return infile.read()
@@ -0,0 +1,67 @@
+"""A batch compile writes the same tree of files whatever the workers and the chunks."""
+import os
+
+import pytest
+
+import compiler
+from programs import PROGRAMS, source
+from test_golden import run_compiler
+
+
+def source_tree(root):
+    """Write the sample programs three times over, in nested directories."""
+    for copy in range(3):
+        for program in PROGRAMS:
+            directory = root.joinpath(*(['copy{}'.format(copy)] * (copy + 1)))
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / (program + '.txt')).write_text(source(program))
+    return root
+
+
+def files(root):
+    """Return {relative path: text} of the files below `root`."""
+    found = {}
+    for directory, _, names in os.walk(str(root)):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path) as infile:
+                found[os.path.relpath(path, str(root))] = infile.read()
+    return found
+
+
+def test_workers_and_chunks(tmp_path):
+    sources = compiler.batch_sources([str(source_tree(tmp_path / 'sources'))])
+    assert len(sources) == 3 * len(PROGRAMS)
+    trees = []
+    for workers, chunk_size, cache in [(1, None, False), (2, 1, False), (4, 3, False), (4, None, False),
+                                       (3, 2, True), (2, 5, True)]:
+        output = tmp_path / 'out{}'.format(len(trees))
+        cache_dir = str(tmp_path / 'cache') if cache else None
+        results, counts = compiler.compile_batch(sources, str(output), workers=workers, chunk_size=chunk_size,
+                                                 cache_dir=cache_dir)
+        assert [exception is None for _, exception in results] == [
+            compiler.compile_source(source(os.path.splitext(os.path.basename(path))[0]))['exception'] is None
+            for path, _ in sources]
+        trees.append(files(output))
+    assert all(tree == trees[0] for tree in trees[1:])
+    # and the files of each source are those of compiling it on its own
+    for path, relative in sources:
+        with open(path) as infile:
+            result = compiler.compile_source(infile.read())
+        for name, key in compiler.BATCH_FILES:
+            expected = None if result['quads'] is None and key in ('symtable', 'quads') else result[key]
+            assert trees[0].get(os.path.join(relative, name)) == expected, (relative, name)
+
+
+@pytest.mark.parametrize('workers', ['1', '3'])
+def test_command_line(tmp_path, workers):
+    source_tree(tmp_path / 'sources')
+    completed = run_compiler(['--no-cache', '--batch', 'out', '--workers', workers, 'sources'], tmp_path)
+    # the syntax errors fail
+    assert completed.returncode == 1
+    lines = completed.stdout.splitlines()
+    assert lines[0].startswith('batch: {} sources in'.format(3 * len(PROGRAMS)))
+    failed = sorted(line for line in lines if line.startswith('failed: '))
+    assert len(failed) == 3 * sum(compiler.compile_source(source(program))['exception'] is not None
+                                  for program in PROGRAMS)
+    assert failed[0].startswith('failed: {}: '.format(os.path.join('copy0', 'syntax.txt')))
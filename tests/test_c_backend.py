@@ -0,0 +1,43 @@
+"""The C backend builds quads into programs that end with the variables of the QuadMachine."""
+import os
+import shutil
+
+import pytest
+
+import compiler
+from programs import source
+from test_optimize import RUNNABLE
+
+pytestmark = pytest.mark.skipif(shutil.which(os.environ.get('CC', 'cc')) is None, reason='no C compiler')
+
+OPTION_SETS = [
+    {},
+    {'registers': 1},
+    {'dispatch_switches': True, 'short_circuit': True},
+    {'optimize': ['fold', 'cse', 'licm', 'strength'], 'registers': 2},
+]
+
+
+def build_and_run(quads, path, max_steps=None):
+    backend = compiler.CBackend()
+    return backend.run(backend.build(quads, str(path), max_steps))
+
+
+@pytest.mark.parametrize('options', OPTION_SETS)
+@pytest.mark.parametrize('program', RUNNABLE)
+def test_programs(program, options, tmp_path):
+    quads = compiler.parse_quads(compiler.compile_source(source(program), options)['quads'])
+    environment, seconds, stopped = build_and_run(quads, tmp_path / 'program.c')
+    assert not stopped
+    machine = compiler.QuadMachine(quads)
+    assert machine.run()
+    expected = dict((name, 1 if value == compiler.TRUE else 0 if value == compiler.FALSE else value)
+                    for name, value in machine.environment().items())
+    assert dict(environment) == expected
+
+
+def test_max_steps(tmp_path):
+    quads = compiler.parse_quads(compiler.compile_source('int a = 0; while (true) { a = a + 1; }')['quads'])
+    environment, seconds, stopped = build_and_run(quads, tmp_path / 'endless.c', max_steps=1000)
+    assert stopped
+    assert 0 < environment['a'] <= 1000
@@ -0,0 +1,109 @@
+"""A compile found in the cache gives what compiling the source again gives."""
+import os
+
+import pytest
+
+import compiler
+from programs import OUTPUT_FILES, PROGRAMS, golden, source, source_path
+from test_golden import run_compiler, written
+
+OPTION_SETS = [
+    {},
+    {'lexer': 'legacy', 'parser': 'recursive'},
+    {'dispatch_switches': True, 'short_circuit': True},
+    {'optimize': ['fold', 'cse', 'dce'], 'registers': 0},
+]
+
+
+def cold(text, options):
+    result = compiler.compile_source(text, options)
+    del result['seconds']
+    return result
+
+
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_command_line(program, tmp_path):
+    cache = tmp_path / 'cache'
+    (tmp_path / 'cold').mkdir()
+    run_compiler(['--no-cache', source_path(program)], tmp_path / 'cold')
+    for attempt in ('miss', 'hit'):
+        directory = tmp_path / attempt
+        directory.mkdir()
+        completed = run_compiler(['--compile-cache', str(cache), '--cache-stats', source_path(program)], directory)
+        output = completed.stdout
+        # only successful compiles are kept, and they print the statistics
+        if completed.returncode == 0:
+            lines = output.splitlines(True)
+            output = ''.join(lines[:-2])
+            assert lines[-2].startswith('cache: {} hits'.format(1 if attempt == 'hit' else 0))
+        assert output == golden(program, 'output.txt')
+        for name in OUTPUT_FILES:
+            assert written(directory, name) == written(tmp_path / 'cold', name), (attempt, name)
+
+
+@pytest.mark.parametrize('options', OPTION_SETS)
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_entry(program, options, tmp_path):
+    text = source(program)
+    result = cold(text, options)
+    cache = compiler.CompileCache(str(tmp_path))
+    key = cache.key(text, options)
+    assert cache.get(key) is None
+    cache.put(key, result)
+    entry = compiler.CompileCache(str(tmp_path)).get(key)
+    assert entry == dict((field, result[field]) for field in compiler.CACHE_FIELDS)
+
+
+def test_compile(tmp_path):
+    cache = compiler.CompileCache(str(tmp_path))
+    for program in PROGRAMS:
+        first = cache.compile(source(program))
+        second = cache.compile(source(program))
+        assert not first.pop('cached')
+        # failed compiles are not kept
+        assert second.pop('cached') == (first['exception'] is None)
+        for result in (first, second):
+            del result['seconds']
+        assert second == first
+    assert cache.stores == cache.hits == sum(compiler.compile_source(source(program))['exception'] is None
+                                             for program in PROGRAMS)
+
+
+def test_key(tmp_path):
+    cache = compiler.CompileCache(str(tmp_path))
+    text = source('loops')
+    # the defaults, given or not, make one key
+    assert cache.key(text) == cache.key(text, {'lexer': 'table', 'registers': None})
+    keys = set([cache.key(text), cache.key(text + ' '), cache.key(text, {'optimize': ['fold']}),
+                cache.key(text, {'optimize': ['fold', 'cse']}), cache.key(text, {'optimize': ['cse', 'fold']})])
+    assert len(keys) == 5
+
+
+def test_damaged_entry(tmp_path):
+    cache = compiler.CompileCache(str(tmp_path))
+    key = cache.key(source('loops'))
+    cache.put(key, compiler.compile_source(source('loops')))
+    with open(cache.path(key), 'r+b') as entry:
+        entry.write(b'not zlib')
+    assert cache.get(key) is None
+    assert cache.compile(source('loops'))['cached'] is False
+    assert cache.get(key) is not None
+
+
+def test_eviction(tmp_path):
+    result = compiler.compile_source(source('loops'))
+    # keys in one directory, which holds two entries
+    keys = ['ab{:062x}'.format(number) for number in range(4)]
+    probe = compiler.CompileCache(str(tmp_path / 'probe'))
+    probe.put(keys[0], result)
+    size = os.path.getsize(probe.path(keys[0]))
+    cache = compiler.CompileCache(str(tmp_path / 'cache'), max_bytes=2 * size * compiler.CACHE_DIRECTORIES)
+    for number, key in enumerate(keys[:3]):
+        cache.put(key, result)
+        os.utime(cache.path(key), (number, number))
+    assert cache.evictions == 1 and not os.path.exists(cache.path(keys[0]))
+    # a hit makes its entry the most recently used
+    assert cache.get(keys[1]) is not None
+    cache.put(keys[3], result)
+    assert cache.evictions == 2
+    assert [os.path.exists(cache.path(key)) for key in keys] == [False, True, False, True]
@@ -0,0 +1,38 @@
+"""Compiles with contexts of their own share nothing, in turn or side by side."""
+from concurrent.futures import ThreadPoolExecutor
+
+import compiler
+from programs import PROGRAMS, source
+
+
+def compiled(program):
+    result = compiler.compile_source(source(program), {'optimize': ['fold', 'cse']})
+    del result['seconds']
+    return result
+
+
+def test_compiles_in_turn():
+    first = [compiled(program) for program in PROGRAMS]
+    # the labels and registers of a compile start over, whatever came before
+    assert [compiled(program) for program in reversed(PROGRAMS)] == first[::-1]
+
+
+def test_compiles_side_by_side():
+    expected = dict((program, compiled(program)) for program in PROGRAMS)
+    with ThreadPoolExecutor(4) as pool:
+        programs = PROGRAMS * 8
+        for program, result in zip(programs, pool.map(compiled, programs)):
+            assert result == expected[program], program
+
+
+def test_alternating_phases():
+    # both programs are parsed before either is translated
+    contexts = [compiler.CompilationContext(), compiler.CompilationContext()]
+    lexers = [compiler.FastLexer(source(program), context) for program, context in zip(('loops', 'switches'), contexts)]
+    parsers = [compiler.Parser(lexer, context) for lexer, context in zip(lexers, contexts)]
+    trees = [parser.parse() for parser in parsers]
+    for tree, context, program in zip(trees, contexts, ('loops', 'switches')):
+        interpreter = compiler.Interpreter(tree, context)
+        interpreter.interpret()
+        assert compiler.format_quads(interpreter.quads) == compiler.compile_source(
+            source(program), {'parser': 'recursive'})['quads']
@@ -0,0 +1,48 @@
+"""The dataflow problems solved on the control flow graph of a loop."""
+import compiler
+
+# block 0 stores i and s, block 1 tests, block 2 is the body and block 3 follows
+LOOP = '''(=, 0, , i)
+(=, 0, , s)
+L1:
+(LESS, i, 3, R0)
+(jfalse, L2, R0, )
+(+, s, i, R1)
+(=, R1, , s)
+(+, i, 1, R2)
+(=, R2, , i)
+(jmp, L1, , )
+L2:
+(=, s, , t)
+'''
+
+
+def loop_cfg():
+    quads = compiler.parse_quads(LOOP)
+    cfg = compiler.ControlFlowGraph.from_quads(quads)
+    assert cfg.successors == [[1], [3, 2], [1], []]
+    return quads, cfg
+
+
+def test_reaching_definitions():
+    definitions, starts, ends = compiler.reaching_definitions(loop_cfg()[1])
+    # the stores of i and s before the loop, in its body, and of t after it
+    assert definitions == [(0, 0), (0, 1), (2, 1), (2, 3), (3, 1)]
+    before, body, after = 0b00011, 0b01100, 0b10000
+    assert starts == [0, before | body, before | body, before | body]
+    assert ends == [before, before | body, body, before | body | after]
+
+
+def test_live_operands():
+    quads, cfg = loop_cfg()
+    bits = compiler.operand_bits(cfg)
+
+    def names(value):
+        return sorted(quads.values[operand >> compiler.OPERAND_KIND_BITS]
+                      for operand, bit in bits.items() if value & bit)
+
+    # the registers never leave their block
+    assert names(sum(bits.values())) == ['i', 's', 't']
+    starts, ends = compiler.live_operands(cfg, bits, exit_bits=sum(bits.values()))
+    assert [names(value) for value in starts] == [[], ['i', 's'], ['i', 's'], ['i', 's']]
+    assert [names(value) for value in ends] == [['i', 's'], ['i', 's'], ['i', 's'], ['i', 's', 't']]
@@ -0,0 +1,33 @@
+"""Compiling the sample programs from the command line writes the golden
+files, whatever the lexer and the parser."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import compiler
+from programs import OUTPUT_FILES, PROGRAMS, golden, source_path
+
+
+def run_compiler(args, cwd, timeout=60):
+    return subprocess.run([sys.executable, compiler.__file__] + args, cwd=str(cwd), stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+
+
+def written(directory, name):
+    path = os.path.join(str(directory), name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as infile:
+        return infile.read()
+
+
+@pytest.mark.parametrize('parser', sorted(compiler.PARSERS))
+@pytest.mark.parametrize('lexer', sorted(compiler.LEXERS))
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_golden_files(program, lexer, parser, tmp_path):
+    completed = run_compiler(['--no-cache', '--lexer', lexer, '--parser', parser, source_path(program)], tmp_path)
+    assert completed.stdout == golden(program, 'output.txt')
+    for name in OUTPUT_FILES:
+        assert written(tmp_path, name) == golden(program, name), name
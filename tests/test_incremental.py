@@ -0,0 +1,65 @@
+"""An incremental recompile returns what a cold compile_source returns."""
+import pytest
+
+import compiler
+from programs import PROGRAMS, source
+
+OPTION_SETS = [
+    {},
+    {'lexer': 'legacy', 'parser': 'recursive'},
+    {'dispatch_switches': True, 'short_circuit': True},
+    {'optimize': ['fold', 'cse', 'dce'], 'registers': 0},
+    {'short_circuit': True, 'optimize': ['licm', 'strength'], 'registers': 2},
+]
+
+
+def cold(text, options):
+    result = compiler.compile_source(text, options)
+    del result['seconds']
+    return result
+
+
+def edits(text):
+    """Return versions of a program as an editor saves them."""
+    lines = text.splitlines(True)
+    middle = len(lines) // 2
+    return [
+        text,
+        text + 'int extra = 1;\n',
+        ''.join(lines[:middle] + ['int inserted = 2;\n'] + lines[middle:]),
+        ''.join(lines[:middle] + lines[middle + 1:]),
+        text.replace('1', '4', 1),
+        text.replace(';', '', 1),
+        text,
+    ]
+
+
+@pytest.mark.parametrize('options', OPTION_SETS)
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_recompile(program, options):
+    incremental = compiler.IncrementalCompiler(options)
+    for version in edits(source(program)):
+        result = incremental.compile(version)
+        del result['seconds']
+        assert result == cold(version, options)
+
+
+def test_across_programs():
+    incremental = compiler.IncrementalCompiler()
+    for program in PROGRAMS + PROGRAMS[::-1]:
+        text = source(program)
+        result = incremental.compile(text)
+        del result['seconds']
+        assert result == cold(text, {})
+
+
+def test_reuses_statements():
+    incremental = compiler.IncrementalCompiler()
+    text = source('loops')
+    incremental.compile(text)
+    total = incremental.scanned
+    incremental.compile(text.replace('n = 5', 'n = 6'))
+    assert incremental.parsed == 1
+    assert incremental.reused == len(incremental.statements) - 1
+    # only the source around the edit is lexed again
+    assert 0 < incremental.scanned < total
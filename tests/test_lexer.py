@@ -0,0 +1,52 @@
+"""The StreamLexer reads the tokens FastLexer does, however small its chunks and windows."""
+import io
+
+import pytest
+
+import compiler
+from programs import PROGRAMS, source
+
+# a long name and number and a comment of many lines, over many chunks;
+# the comment counts its non-ASCII characters as one column each
+SPANNING = '''int abcdefghijklmnopqrstuvwxyz = 1234567890123;
+# a comment
+  over lines, é and ü # int b = abcdefghijklmnopqrstuvwxyz/7;#
+#
+while (b >= 10) { b = b - 1; } # the end #
+'''
+
+
+def fast_tokens(text):
+    tokens = compiler.FastLexer(text, compiler.CompilationContext()).tokenize()
+    return [token_fields(tokens.token(index)) for index in range(len(tokens))]
+
+
+def stream_tokens(source, chunk_size, window):
+    lexer = compiler.StreamLexer(source, compiler.CompilationContext(), chunk_size=chunk_size, window=window)
+    result = []
+    while True:
+        tokens = lexer.tokenize()
+        assert 0 < len(tokens) <= window
+        result += [token_fields(tokens.token(index)) for index in range(len(tokens))]
+        if tokens.kinds[-1] in (compiler.K_EOF, compiler.K_ERROR):
+            return result
+
+
+def token_fields(token):
+    return token.type, token.value, token.line, token.column
+
+
+@pytest.mark.parametrize('window', [1, 2, 7, 1 << 16])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 16, 1 << 20])
+@pytest.mark.parametrize('program', PROGRAMS + ['spanning', 'error'])
+def test_chunked_stream(program, chunk_size, window):
+    if program == 'spanning':
+        text = SPANNING
+    elif program == 'error':
+        text = 'int a = 1;\n# skipped #\nint b = a $ 2;\n'
+    else:
+        text = source(program)
+    expected = fast_tokens(text)
+    assert stream_tokens(io.BytesIO(text.encode('utf-8')), chunk_size, window) == expected
+    # a buffer, as an mmap of the file, is scanned in place
+    assert stream_tokens(text.encode('utf-8'), chunk_size, window) == expected
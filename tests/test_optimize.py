@@ -0,0 +1,186 @@
+"""The optimizations keep what the quads of a program compute."""
+import re
+
+import pytest
+
+import compiler
+from programs import PROGRAMS, source
+from test_quads import run
+
+# the programs whose quads are generated in full
+RUNNABLE = [program for program in PROGRAMS if compiler.compile_source(source(program))['exception'] is None]
+
+# loops with values the same on every iteration, and some that are not
+LOOP_PROGRAMS = {
+    'nested': '''int a = 3; int b = 4; int s = 0; int i = 0; int j = 0;
+while (i < 5) { j = 0; while (j < 3) { s = s + a * b + i * 2; j = j + 1; } i = i + 1; }
+''',
+    'conditional': '''int a = 6; int b = 0; int s = 0; int i = 0;
+do { s = s + a * 3; if (i > 2) { b = a * 2; } i = i + 1; } while (i < 5);
+''',
+    'break': '''int a = 7; int s = 0; int i = 0;
+while (i < 100) { s = s + a * a; if (s > 200) { break; } i = i + 1; }
+''',
+    'changing': '''int a = 1; int s = 0; int i = 0;
+while (i < 6) { s = s + a * 2; a = a + 1; i = i + 1; }
+''',
+    'for': '''int n = 10; int s = 0; int i = 0;
+for (i = 0; i < n; i = i + 1) { s = s + n * 3; }
+''',
+}
+
+
+def quads(text, passes, registers=None):
+    result = compiler.compile_source(text, {'optimize': passes, 'registers': registers})
+    assert result['exception'] is None
+    return result['quads']
+
+
+@pytest.mark.parametrize('program', RUNNABLE)
+def test_fold_environment(program):
+    text = source(program)
+    assert run(text, {'optimize': ['fold']}) == run(text)
+
+
+def test_fold():
+    text = 'const int k = 4;\nint a = 2 * 3 + k;\nint b = a * 1 + 0;\nint c = b / 0;\n'
+    assert quads(text, ['fold']).splitlines() == ['(=, 4, , k)', '(=, 10, , a)', '(=, a, , b)',
+                                                  '(/, b, 0, R4)', '(=, R4, , c)']
+
+
+@pytest.mark.parametrize('registers', [0, 1, 2, 3])
+@pytest.mark.parametrize('program', RUNNABLE)
+def test_registers_environment(program, registers):
+    text = source(program)
+    assert run(text, {'registers': registers}) == run(text)
+
+
+@pytest.mark.parametrize('registers', [1, 2, 3])
+def test_registers_limit(registers):
+    text = 'int a = 1; int b = 2; int c = (a + b) * (a - b) + (a * b) * (b - a);'
+    used = set(re.findall(r'\bR\d+', quads(text, [], registers)))
+    assert used == set('R{}'.format(number) for number in range(registers))
+    # with as many registers as it needs, no value is spilled
+    assert compiler.SPILL_SLOT_NAME.format(0) not in quads(text, [], 3)
+
+
+@pytest.mark.parametrize('passes', [['dce'], ['dce-all'], ['fold', 'dce-all']])
+@pytest.mark.parametrize('program', RUNNABLE)
+def test_dce_environment(program, passes):
+    text = source(program)
+    environment = run(text, {'optimize': passes})
+    expected = run(text)
+    if 'dce-all' in passes:
+        # the stores to variables not read again are dropped
+        expected = dict((name, value) for name, value in expected.items() if name in environment)
+    assert environment == expected
+
+
+def test_dce():
+    text = 'int a = 2; int b = a + 1; b = 3; int c = b;'
+    # the store of a + 1 is overwritten before it is read
+    assert quads(text, ['dce']).splitlines() == ['(=, 2, , a)', '(=, 3, , b)', '(=, b, , c)']
+    # and no variable is read after the program
+    assert quads(text, ['dce-all']) == ''
+    # the stores of b go, the loop stays: its condition reads a
+    text = 'int a = 2; int b = 0; while (a < 5) { a = a + 1; } b = a;'
+    assert quads(text, ['dce-all']).splitlines() == [line for line in quads(text, []).splitlines()
+                                                     if not line.endswith(', b)')]
+
+
+@pytest.mark.parametrize('passes', [['cse'], ['cse', 'fold'], ['fold', 'cse', 'dce']])
+@pytest.mark.parametrize('program', RUNNABLE)
+def test_cse_environment(program, passes):
+    text = source(program)
+    assert run(text, {'optimize': passes}) == run(text)
+
+
+def test_cse():
+    text = 'int a = 2; int b = 3; int c = a * b + 1; int d = a * b + 2; a = 4; int e = a * b;'
+    lines = quads(text, ['cse']).splitlines()
+    # a * b is computed again once a changes
+    assert [line for line in lines if line.startswith('(*')] == ['(*, a, b, R0)', '(*, a, b, R4)']
+    assert run(text, {'optimize': ['cse']}) == run(text) == {'a': 4, 'b': 3, 'c': 7, 'd': 8, 'e': 12}
+
+
+@pytest.mark.parametrize('options', [{'optimize': ['licm']}, {'optimize': ['licm'], 'registers': 2},
+                                     {'optimize': ['fold', 'licm', 'cse', 'dce']}])
+@pytest.mark.parametrize('program', RUNNABLE + sorted(LOOP_PROGRAMS))
+def test_licm_environment(program, options):
+    text = LOOP_PROGRAMS.get(program) or source(program)
+    assert run(text, options) == run(text)
+
+
+def test_licm():
+    lines = quads(LOOP_PROGRAMS['nested'], ['licm']).splitlines()
+    outer, inner = lines.index('(LESS, i, 5, R0)'), lines.index('(LESS, j, 3, R1)')
+    # a * b leaves both loops, i * 2 only the inner one
+    assert lines.index('(*, a, b, R2)') < outer
+    assert outer < lines.index('(*, i, 2, R4)') < inner
+    lines = quads(LOOP_PROGRAMS['changing'], ['licm']).splitlines()
+    assert lines.index('(LESS, i, 6, R0)') < lines.index('(*, a, 2, R1)')
+    # a division could fail where the loop never runs
+    text = 'int a = 1; int b = 0; int s = 0; int i = 5; while (i < 3) { s = a / b; i = i + 1; }'
+    assert quads(text, ['licm']) == quads(text, [])
+
+
+# for loops stepping products of their counters i and j
+FOR_PROGRAMS = {
+    'product': 'int n = 10; int s = 0; int i = 0;\n'
+               'for (i = 0; i < n; i = i + 1) { s = s + i * 4 + 1; }\n',
+    'invariant': 'int n = 10; int k = 3; int s = 0; int i = 0;\n'
+                 'for (i = 0; i < n; i = i + 1) { s = s + i * k; }\n',
+    'step': 'int n = 15; int s = 0; int i = 0;\n'
+            'for (i = 3; i < n; i = i + 2) { s = s + i * 8 - i; }\n',
+    'down': 'int n = 7; int s = 0; int i = 0;\n'
+            'for (i = n; i > 0; i = i - 1) { s = s + i * 5 + i * -3; }\n',
+    'nested': 'int s = 0; int i = 0; int j = 0;\n'
+              'for (i = 0; i < 4; i = i + 1) { for (j = 0; j < 3; j = j + 1) { s = s + i * 6 + j * 2; } }\n',
+    'read after': 'int n = 9; int s = 0; int t = 0; int i = 0;\n'
+                  'for (i = 0; i < n; i = i + 1) { s = s + i * 4; }\nt = i;\n',
+    'break': 'int n = 100; int s = 0; int i = 0;\n'
+             'for (i = 0; i < n; i = i + 1) { s = s + i * 3; if (s > 50) { break; } }\n',
+    'halved': 'int n = 12; int s = 0; int i = 0;\n'
+              'for (i = 0; i < n; i = i + 1) { s = s + i * 4 / 2; }\n',
+    'never': 'int n = -2; int s = 5; int i = 0;\n'
+             'for (i = 0; i < n; i = i + 1) { s = s + i * 4; }\n',
+}
+COUNTERS = ('i', 'j')
+
+
+@pytest.mark.parametrize('registers', [None, 0, 1, 2])
+@pytest.mark.parametrize('passes', [['strength'], ['strength', 'fold'], ['strength', 'cse'], ['fold', 'strength'],
+                                    ['cse', 'strength'], ['strength-all'], ['fold', 'cse', 'strength-all', 'dce']])
+@pytest.mark.parametrize('program', sorted(FOR_PROGRAMS))
+def test_strength_environment(program, passes, registers):
+    text = FOR_PROGRAMS[program]
+    environment = run(text, {'optimize': passes, 'registers': registers})
+    expected = run(text)
+    if 'strength-all' in passes:
+        # a counter read nowhere after its loop is dropped
+        environment = dict((name, value) for name, value in environment.items() if name not in COUNTERS)
+        expected = dict((name, value) for name, value in expected.items() if name not in COUNTERS)
+    assert environment == expected
+
+
+@pytest.mark.parametrize('program', RUNNABLE + sorted(LOOP_PROGRAMS))
+def test_strength_programs(program):
+    text = LOOP_PROGRAMS.get(program) or source(program)
+    assert run(text, {'optimize': ['strength'], 'registers': 2}) == run(text)
+
+
+def test_strength():
+    result = compiler.compile_source(FOR_PROGRAMS['product'], {'optimize': ['strength']})
+    lines = result['quads'].splitlines()
+    # i * 4 is computed before the loop, as a shift, and stepped by 4
+    assert '(<<, i, 2, R1)' in lines and '(+, R1, 4, R1)' in lines
+    assert not any(line.startswith('(*') for line in lines)
+    assert 'strength: 1 products stepped in 1 loops, 0 counters dropped' in result['output']
+    # with the counter not read after the loop, the loop compares R1 instead
+    result = compiler.compile_source(FOR_PROGRAMS['product'], {'optimize': ['strength-all']})
+    assert '1 counters dropped' in result['output']
+    assert '(+, i, 1' not in result['quads']
+    # the counter read after the loop stays
+    result = compiler.compile_source(FOR_PROGRAMS['read after'], {'optimize': ['strength-all']})
+    assert '0 counters dropped' in result['output']
+    assert run(FOR_PROGRAMS['read after'], {'optimize': ['strength-all']})['t'] == 9
@@ -0,0 +1,46 @@
+"""The parsers build the same trees from every lexer, and finish on every
+statement of the grammar."""
+import subprocess
+
+import pytest
+
+import compiler
+from test_golden import run_compiler
+
+BREAK_PROGRAM = 'int a = 0;\nwhile (a < 3) {\n  a = a + 1;\n  break;\n}\n'
+
+
+@pytest.mark.parametrize('parser', sorted(compiler.PARSERS))
+@pytest.mark.parametrize('lexer', sorted(compiler.LEXERS))
+def test_break_statement_is_consumed(lexer, parser, tmp_path):
+    source = tmp_path / 'break.txt'
+    source.write_text(BREAK_PROGRAM)
+    try:
+        completed = run_compiler(['--no-cache', '--lexer', lexer, '--parser', parser, str(source)], tmp_path,
+                                 timeout=10)
+    except subprocess.TimeoutExpired:
+        pytest.fail('the compile of a break did not finish')
+    assert completed.returncode == 0, completed.stderr
+    assert (tmp_path / 'errors.txt').read_text() == ''
+
+
+def test_pratt_parser_has_no_depth_limit():
+    depth = 20000
+    text = 'int a = 1;\nint b = ' + '(' * depth + 'a' + ' + 1)' * depth + ';\n'
+    text += 'int c = 0;\nif (' + '(' * depth + 'a > 0' + ')' * depth + ') { c = 1; }\n'
+    result = compiler.compile_source(text, {'parser': 'pratt'})
+    assert result['exception'] is None
+    quads = result['quads'].splitlines()
+    assert quads[depth + 1] == '(=, R{}, , b)'.format(depth - 1)
+    machine = compiler.QuadMachine.from_text(result['quads'])
+    assert machine.run()
+    assert machine.environment() == {'a': 1, 'b': depth + 1, 'c': 1}
+
+
+@pytest.mark.parametrize('parser', sorted(compiler.PARSERS))
+def test_long_chain(parser):
+    text = 'int a = 3;\nint b = ' + ' - '.join(['a'] * 20000) + ' * 2;\n'
+    result = compiler.compile_source(text, {'parser': parser})
+    assert result['exception'] is None
+    assert result['quads'] == compiler.compile_source(text, {'parser': 'pratt'})['quads']
+    assert result['quads'].splitlines()[1] == '(-, a, a, R0)'
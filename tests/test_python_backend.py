@@ -0,0 +1,79 @@
+"""The Python backend runs what the quads run, however deep the program."""
+import subprocess
+import sys
+
+import pytest
+
+import compiler
+from programs import source
+from test_quads import run, run_python
+
+# the programs whose quads run as they mean: the jump of an if/else to a
+# label no quad places ends the run of conditions, and the last case of
+# a switch of switches jumps past the statements after it
+AGREEING = ['arithmetic', 'breaks', 'loops', 'names']
+
+
+def nested_loops(depth):
+    """A program of `depth` nested whiles, each counting one variable to 2."""
+    names = ['i' + chr(ord('a') + k // 26) + chr(ord('a') + k % 26) for k in range(depth)]
+    text = ''.join('int {} = 0;\n'.format(name) for name in names) + 'int n = 0;\n'
+    for name in names:
+        text += 'while ({0} < 2) {{ {0} = {0} + 1;\n'.format(name)
+    text += 'n = n + 1; if (n > 5) { break; }\n'
+    return text + '}\n' * depth
+
+
+@pytest.mark.parametrize('program', AGREEING)
+def test_programs(program):
+    assert run_python(source(program)) == run(source(program))
+
+
+def test_code_cache(tmp_path):
+    text = source('loops')
+    key = text.encode('utf-8')
+    context = compiler.CompilationContext()
+    tree = compiler.Parser(compiler.FastLexer(text, context), context).parse()
+    compiled = compiler.PythonBackend(str(tmp_path))
+    environment = compiled.run(compiled.compile(tree, key))
+    assert not compiled.cached
+    # found by the key alone
+    loaded = compiler.PythonBackend(str(tmp_path))
+    assert loaded.run(loaded.compile(None, key)) == environment
+    assert loaded.cached
+
+
+def test_long_chain():
+    text = 'int a = 3;\nint b = ' + ' + '.join(['1'] + ['a * 2 - a / 2'] * 300) + ';\n'
+    text += 'int c = 0;\nif (' + ' and '.join(['(a > 1)'] * 300) + ') { c = 1; }\n'
+    assert run_python(text) == run(text) == {'a': 3, 'b': 1501, 'c': 1}
+
+
+def test_nested_loops():
+    text = nested_loops(25)
+    context = compiler.CompilationContext()
+    tree = compiler.Parser(compiler.FastLexer(text, context), context).parse()
+    assert 'def _block_0():' in compiler.python_source(tree)
+    environment = run_python(text)
+    assert environment['n'] == 2
+    assert environment == run(text)
+
+
+def test_conditions_are_computed_every_iteration():
+    text = '''int i = 0; int j = 0; int k = 0; int n = 5;
+while (i < n and true) { i = i + 1; }
+do { j = j + 2; } while (j < n and true);
+for (k = 0; k < n and true; k = k + 1) { }
+'''
+    assert run_python(text) == {'i': 5, 'j': 6, 'k': 5, 'n': 5}
+
+
+def test_too_deep_for_python(tmp_path):
+    # every if holds the break of the loop, so none can move out of it
+    depth = 120
+    text = 'int i = 0;\nwhile (i < 1) { i = i + 1;\n' + 'if (i > 0) {\n' * depth + 'break;\n' + '}\n' * depth + '}\n'
+    (tmp_path / 'deep.txt').write_text(text)
+    process = subprocess.run([sys.executable, compiler.__file__, '--no-cache', '--python', 'deep.txt'],
+                             cwd=str(tmp_path), capture_output=True, text=True, timeout=60)
+    assert process.returncode == 1
+    assert process.stderr == 'python: cannot compile the program: too many levels of indentation\n'
@@ -0,0 +1,42 @@
+"""The quads of a program run to what the program means."""
+import compiler
+from programs import source
+
+SWITCH_BREAKS = '''int x = 2; int y = 0;
+switch (x) {
+case 1: { y = 10; break; }
+case 2: { y = 20; break; }
+case 3: { y = 30; break; }
+case 4: { y = 40; break; }
+default: { y = 1; }
+}
+'''
+
+
+def run(text, options=None):
+    """Return the variables of running the quads of `text`, spill slots left out."""
+    result = compiler.compile_source(text, options)
+    assert result['exception'] is None
+    machine = compiler.QuadMachine.from_text(result['quads'])
+    assert machine.run(100000)
+    spill_slot = compiler.SPILL_SLOT_NAME.format('')
+    return dict((name, value) for name, value in machine.environment().items() if not name.startswith(spill_slot))
+
+
+def run_python(text):
+    context = compiler.CompilationContext()
+    tree = compiler.Parser(compiler.FastLexer(text, context), context).parse()
+    backend = compiler.PythonBackend()
+    return backend.run(backend.compile(tree))
+
+
+def test_break_leaves_loops():
+    assert run(source('breaks')) == {'a': 1, 'b': 7, 'c': 4}
+    assert run_python(source('breaks')) == {'a': 1, 'b': 7, 'c': 4}
+
+
+def test_break_leaves_switch():
+    for options in ({}, {'dispatch_switches': True}):
+        assert run(SWITCH_BREAKS, options) == {'x': 2, 'y': 20}
+    assert run_python(SWITCH_BREAKS) == {'x': 2, 'y': 20}
+
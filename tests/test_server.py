@@ -0,0 +1,52 @@
+"""A CompileServer answers like compile_source, and ends the compiles that take too long."""
+import asyncio
+import os
+
+import pytest
+
+import compiler
+from programs import source
+
+# a compile of many seconds
+SLOW = 'int a = 1;\n' * 200000
+
+
+def without_seconds(result):
+    return dict(result, seconds=None)
+
+
+def test_round_trip():
+    client = compiler.CompileClient.spawn(workers=1)
+    try:
+        assert client.call('ping') == 'pong'
+        for program in ('arithmetic', 'switches'):
+            result = client.compile(source(program), optimize=['fold'])
+            assert without_seconds(result) == without_seconds(
+                compiler.compile_source(source(program), {'optimize': ['fold']}))
+        with pytest.raises(compiler.RpcError) as raised:
+            client.compile(source('loops'), lexer='stream')
+        assert raised.value.code == compiler.RPC_INVALID_PARAMS
+    finally:
+        client.close()
+
+
+def test_timeout():
+    async def scenario():
+        server = compiler.CompileServer(workers=1, timeout=0.5)
+        server.start()
+        try:
+            loop = asyncio.get_running_loop()
+            worker = await loop.run_in_executor(server.pool, os.getpid)
+            with pytest.raises(compiler.RpcError) as raised:
+                await server.compile(SLOW)
+            assert raised.value.code == compiler.RPC_TIMEOUT
+            # the worker stuck in the compile is ended, and a new one answers
+            with pytest.raises(ProcessLookupError):
+                os.kill(worker, 0)
+            result = await server.compile(source('arithmetic'))
+            assert result['exception'] is None
+            assert await loop.run_in_executor(server.pool, os.getpid) != worker
+        finally:
+            server.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,37 @@
+"""Short-circuit jumps for and/or take the branches the computed conditions take."""
+import itertools
+
+import pytest
+
+import compiler
+from programs import source
+from test_optimize import RUNNABLE
+from test_quads import run
+
+CONDITIONS = '''int a = {}; int b = {}; int c = 0; int d = 0; int e = 0;
+if ((a > 1) and (b < 3)) {{ c = 1; }} else {{ c = 2; }}
+while ((a < 4) or (b == 0)) {{ a = a + 1; b = b + 1; }}
+do {{ d = d + 1; }} while (((d < 3) and (a > 0)) or ((b == 1) and (d < 5)));
+if (((a == 4) or (b > 2)) and ((c == 1) or true)) {{ e = 1; }}
+'''
+
+
+@pytest.mark.parametrize('program', RUNNABLE)
+def test_programs(program):
+    text = source(program)
+    assert run(text, {'short_circuit': True}) == run(text)
+
+
+def test_conditions():
+    for a, b in itertools.product(range(-1, 6), range(-1, 4)):
+        text = CONDITIONS.format(a, b)
+        assert run(text, {'short_circuit': True}) == run(text), (a, b)
+
+
+def test_jumps():
+    text = CONDITIONS.format(2, 1)
+    quads = compiler.compile_source(text)['quads']
+    assert quads.count('(AND,') + quads.count('(OR,') == 8
+    result = compiler.compile_source(text, {'short_circuit': True})
+    assert '(AND,' not in result['quads'] and '(OR,' not in result['quads']
+    assert result['output'].splitlines()[-1].startswith('short-circuit: 8 and/or/not quads')
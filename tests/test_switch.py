@@ -0,0 +1,70 @@
+"""A dispatched switch, through a jump table or a tree of compares, runs
+the cases the Python backend does for every value."""
+import pytest
+
+import compiler
+from test_quads import run, run_python
+
+# (case values, the cases ending with a break, whether there is a default)
+SHAPES = {
+    'dense': (list(range(1, 9)), {2, 5}, True),
+    'dense without default': (list(range(1, 9)), {3}, False),
+    'dense out of order': ([4, 2, 7, 1, 3, 6, 5, 8], {7}, True),
+    'sparse': ([7, 300, 5000, 90000], {5000}, False),
+    'sparse with default': ([7, 300, 5000, 90000], set(), True),
+    'clusters': ([1, 2, 3, 4, 5, 1000, 1001, 1002, 1003, 1004], {3, 1001}, True),
+    'dense with outliers': (list(range(10, 30)) + [500, 7000], {15, 25}, True),
+    'single case': ([3], set(), True),
+    'many sparse': ([k * k * 7 for k in range(1, 41)], {7 * 9, 7 * 400}, False),
+}
+
+
+def switch_program(values, breaks, default, x):
+    text = 'int x = {};\nint y = 0;\nswitch (x) {{\n'.format(x)
+    for position, value in enumerate(values):
+        text += 'case {}: {{ y = y + {}; {}}}\n'.format(value, position + 1, 'break; ' if value in breaks else '')
+    if default:
+        text += 'default: { y = y + 1000; }\n'
+    return text + '}\nint z = 1;\n'
+
+
+@pytest.mark.parametrize('shape', sorted(SHAPES))
+def test_dispatch(shape):
+    values, breaks, default = SHAPES[shape]
+    probes = sorted(set(v + d for v in values for d in (-1, 0, 1)) | {0, -5, max(values) * 2})
+    for x in probes:
+        text = switch_program(values, breaks, default, x)
+        assert run(text, {'dispatch_switches': True}) == run_python(text), x
+
+
+@pytest.mark.parametrize('shape, jump_table', [
+    ('dense', True), ('dense out of order', True), ('dense without default', True),
+    # less than half the values of their range have a case
+    ('sparse', False), ('many sparse', False), ('clusters', False), ('dense with outliers', False),
+])
+def test_lowering(shape, jump_table):
+    values, breaks, default = SHAPES[shape]
+    quads = compiler.compile_source(switch_program(values, breaks, default, 0), {'dispatch_switches': True})['quads']
+    assert ('(jtab,' in quads) == jump_table
+    # a tree splits the cases in halves, down to a few compared in turn
+    splits = quads.count('(LESS, x,')
+    assert (splits > 0) != jump_table
+    assert splits < len(values)
+
+
+def test_few_cases_chain():
+    quads = compiler.compile_source(switch_program([1, 2, 3], set(), True, 0), {'dispatch_switches': True})['quads']
+    assert '(jtab,' not in quads and '(LESS,' not in quads
+    assert quads.count('(equal,') == 3
+
+
+def test_nested():
+    text = '''int x = 2; int w = 5; int y = 0;
+switch (x) {
+case 1: { y = 1; }
+case 2: { switch (w) { case 4: { y = 4; break; } case 5: { y = y + 5; break; } case 6: { y = 6; } } y = y + 10; break; }
+case 3: { y = y + 100; }
+default: { y = y + 1000; }
+}
+'''
+    assert run(text, {'dispatch_switches': True}) == run_python(text) == {'x': 2, 'w': 5, 'y': 15}
@@ -0,0 +1,60 @@
+"""The QuadMachine runs quads, and the backends report what stops a program alike."""
+import io
+import shutil
+import subprocess
+import sys
+from contextlib import redirect_stdout
+
+import pytest
+
+import compiler
+from programs import PROGRAMS, golden
+
+DIVISION_BY_ZERO = 'int a = 4;\nint b = 0;\nint c = a / b;\n'
+
+
+@pytest.mark.parametrize('backend, message', [
+    ('run', 'vm: division by zero at quad 3'),
+    ('python', 'python: division by zero at line: 3, column: 11'),
+    ('c', 'c: division by zero at quad 3'),
+])
+def test_division_by_zero(tmp_path, backend, message):
+    if backend == 'c' and shutil.which('cc') is None:
+        pytest.skip('no C compiler')
+    (tmp_path / 'zero.txt').write_text(DIVISION_BY_ZERO)
+    process = subprocess.run([sys.executable, compiler.__file__, '--no-cache', '--' + backend, 'zero.txt'],
+                             cwd=str(tmp_path), capture_output=True, text=True, timeout=60)
+    assert process.returncode == 1
+    assert process.stderr == message + '\n'
+    # the files are written all the same
+    assert (tmp_path / 'out.txt').read_text().splitlines()[2] == '(/, a, b, R0)'
+
+
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_listing_round_trip(program):
+    listing = golden(program, 'out.txt')
+    if listing is not None:
+        assert compiler.format_quads(compiler.parse_quads(listing)) == listing
+
+
+def test_max_steps():
+    machine = compiler.QuadMachine.from_text(compiler.compile_source('int a = 0; while (true) { a = a + 1; }')['quads'])
+    assert not machine.run(1000)
+    assert machine.steps == 1000
+    assert 0 < machine.environment()['a'] < 1000
+
+
+def test_booleans():
+    machine = compiler.QuadMachine.from_text('(=, TRUE, , a)\n(LESS, 2, 1, R0)\n(=, R0, , b)\n')
+    assert machine.run()
+    assert machine.environment() == {'a': compiler.TRUE, 'b': compiler.FALSE}
+
+
+def test_unresolved_jump_reported():
+    # the if of an if/else jumps to a label it never places
+    machine = compiler.QuadMachine.from_text(golden('conditions', 'out.txt'))
+    assert machine.unresolved
+    output = io.StringIO()
+    with redirect_stdout(output):
+        compiler.run_quads(machine.quads)
+    assert 'vm: no quad places L1, where a jump ends the program' in output.getvalue()